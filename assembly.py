@@ -0,0 +1,279 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+'''Matrix-based model assembly for optimize().
+
+Builds the same formulation as optimize.build_model(), but every constraint family
+is assembled as a scipy.sparse CSR block from integer index arrays and handed to
+Gurobi in a single addMConstr call, instead of being summed term by term into
+LinExpr objects. All variables live in one MVar x with the column layout
+    X_ug | X_g | H_ug | H_g | r | Z | q | U | R | Q
+The returned model dictionary has the same keys as optimize.build_model(), with
+X and H exposed as plain dictionaries of Var objects, plus the build time, row
+count and nonzero count of every constraint family under "timings", and the MConstr
+blocks of every family under "constraints" (with the sections of the Constraint 1
+rows). With a profile
+(see profiling.py) the variables and every constraint family are recorded as phases.'''
+
+import numpy as np
+import scipy.sparse as sp
+from gurobipy import Model, GRB
+import profiling
+
+
+def levelarrays(leveldic, K):
+    '''Integer-coded view of one level: positions of each eligible triple and the
+    sparse expressions y (classroom x timeslot) and w (professor x timeslot) over X'''
+    arrays = {}
+    I, J, T = leveldic["I"], leveldic["J"], leveldic["T"]
+    triples = leveldic["IJT"]
+    n = len(triples)
+    arrays["n"] = n
+    arrays["sec"] = I.get_indexer([e[0] for e in triples])
+    arrays["room"] = J.get_indexer([e[1] for e in triples])
+    arrays["slot"] = T.get_indexer([e[2] for e in triples])
+    arrays["U"] = leveldic["U_ij"].values[arrays["sec"],arrays["room"]].astype(float)
+    # Section assignment rows: one row per section over its eligible triples
+    arrays["assign"] = sp.csr_matrix((np.ones(n),(arrays["sec"],np.arange(n))),shape=(len(I),n))
+    # Professor x triple incidence through L_k
+    kpos, ipos = [], []
+    for kp, k in enumerate(K):
+        sections = I.get_indexer(leveldic["L_k"][k])
+        kpos.extend([kp]*len(sections))
+        ipos.extend(sections.tolist())
+    teaches = sp.csr_matrix((np.ones(len(kpos)),(kpos,ipos)),shape=(len(K),len(I)))
+    taught = (teaches @ arrays["assign"]).tocoo()
+    arrays["taught_k"] = taught.row
+    arrays["taught_e"] = taught.col
+    nT = len(T)
+    arrays["y"] = sp.csr_matrix((np.ones(n),(arrays["room"]*nT+arrays["slot"],np.arange(n))),shape=(len(J)*nT,n))
+    arrays["w"] = sp.csr_matrix((taught.data,(taught.row*nT+arrays["slot"][taught.col],taught.col)),shape=(len(K)*nT,n))
+    return arrays
+
+
+def grouprows(groups, units, slots, cols, ncols):
+    '''Rows "at most one class per group" restricted to each unit (classroom or professor).
+    groups is a boolean (group x timeslot) matrix; entry e belongs to unit units[e], uses
+    timeslot slots[e] and column cols[e]. As in optimize.build_model(), each group is cut
+    down to the unit's non-empty timeslots, duplicates are dropped and rows with a single
+    entry are skipped.'''
+    rows, columns = [], []
+    nrows = 0
+    order = np.argsort(units, kind="stable")
+    bounds = np.flatnonzero(np.diff(units[order]))+1
+    for chunk in np.split(order, bounds) if len(order) else []:
+        nonempty, position = np.unique(slots[chunk], return_inverse=True)
+        restricted = np.unique(groups[:, nonempty], axis=0)
+        counts = restricted @ np.bincount(position, minlength=len(nonempty))
+        restricted = restricted[counts > 1]
+        r, c = np.nonzero(restricted[:, position])
+        rows.append(r+nrows)
+        columns.append(cols[chunk][c])
+        nrows += restricted.shape[0]
+    if not rows:
+        return sp.csr_matrix((0, ncols))
+    rows = np.concatenate(rows)
+    return sp.csr_matrix((np.ones(len(rows)),(rows,np.concatenate(columns))),shape=(nrows,ncols))
+
+
+def groupmatrix(groups, nslots):
+    '''Boolean (group x timeslot) matrix from lists of timeslot positions'''
+    matrix = np.zeros((len(groups), nslots), dtype=bool)
+    for n, group in enumerate(groups):
+        matrix[n, group] = True
+    return matrix
+
+
+def build_model(instance,weight1=1,weight2=1,weight3=0.2,cliques=True,profile=None,tight=False,env=None):
+    '''PART 2.1-2.4 assembled as sparse matrices; see the module docstring.
+    tight=True replaces the big-M rows linking H and Z to X in Constraints 5 and 6 by one row per
+    timeslot (larger model, see benchmark_formulations.py).
+    env is the Gurobi environment of the model (default: the shared default environment); models
+    solved concurrently on several threads each need their own.'''
+    ug = dict(instance["ug"])
+    g = dict(instance["g"])
+    leveldics = [ug,g]
+    N = instance["N"]
+    S = instance["S"]
+    K = ug["K"]
+    nK, nS = len(K), len(S)
+    timings = {}
+    # (family, MConstr, row labels or None) of every block, e.g. to read an IIS back per family
+    constraints = []
+
+    # 2.1 [Set Variables]
+    start_time = profiling.mark()
+    for leveldic in leveldics:
+        leveldic["arrays"] = levelarrays(leveldic, K)
+        leveldic["nM"] = len(leveldic["Mpairs"])
+    layout = [("X_ug",ug["arrays"]["n"]),("X_g",g["arrays"]["n"]),("H_ug",nK*ug["nM"]),("H_g",nK*g["nM"]),
+              ("r",nK),("Z",nK*nS),("q",nK),("U",1),("R",1),("Q",1)]
+    offset = dict(zip([name for name, _ in layout],np.cumsum([0]+[size for _, size in layout])))
+    ncols = offset["Q"]+1
+    vtype = np.full(ncols, GRB.BINARY)
+    vtype[offset["U"]] = vtype[offset["R"]] = GRB.CONTINUOUS
+    vtype[offset["Q"]] = GRB.INTEGER
+    ub = np.ones(ncols)
+    ub[[offset["U"],offset["R"],offset["Q"]]] = GRB.INFINITY
+    # H[k,t1_t2] is 0 unless professor k can teach both t1 and t2, e.g. when k has no sections at the level
+    for leveldic in leveldics:
+        nT, pairs = len(leveldic["T"]), leveldic["Mpairs"]
+        kk = np.repeat(np.arange(nK),leveldic["nM"])
+        nonempty = leveldic["arrays"]["w"].getnnz(axis=1) > 0
+        leveldic["pairable"] = nonempty[kk*nT+np.tile(pairs[:,0],nK)] & nonempty[kk*nT+np.tile(pairs[:,1],nK)]
+        ub[offset["H_"+leveldic["level"]]+np.flatnonzero(~leveldic["pairable"])] = 0
+    mod = Model(env=env)
+    x = mod.addMVar(ncols, lb=0, ub=ub, vtype=vtype)
+    allvars = x.tolist()
+    for leveldic in leveldics:
+        name = leveldic["level"]
+        leveldic["X"] = dict(zip(leveldic["IJT"],allvars[offset["X_"+name]:offset["X_"+name]+leveldic["arrays"]["n"]]))
+        keys = [(k,t1_t2) for k in K for t1_t2 in leveldic["M"]["t1_t2"]]
+        leveldic["H"] = dict(zip(keys,allvars[offset["H_"+name]:offset["H_"+name]+len(keys)]))
+    r = dict(zip(K,allvars[offset["r"]:offset["r"]+nK]))
+    Z = dict(zip([(k,s) for k in K for s in S],allvars[offset["Z"]:offset["Z"]+nK*nS]))
+    q = dict(zip(K,allvars[offset["q"]:offset["q"]+nK]))
+    U, R, Q = allvars[offset["U"]], allvars[offset["R"]], allvars[offset["Q"]]
+    timings["Variables"] = {"seconds":profiling.record(profile,"Variables",start_time,columns=int(ncols))["wall"],"columns":int(ncols)}
+
+    def block(nrows, **parts):
+        return sp.hstack([parts[name] if name in parts else sp.csr_matrix((nrows,size)) for name, size in layout],format="csr")
+
+    def identity(n, scale=1):
+        return sp.identity(n, format="csr")*scale
+
+    def add(family, A, sense, rhs, labels=None):
+        timings.setdefault(family,{"seconds":0,"rows":0,"nonzeros":0})
+        if A.shape[0] == 0:
+            return
+        rows = mod.addMConstr(A, x, sense, np.full(A.shape[0],rhs,dtype=float))
+        constraints.append((family,rows,labels))
+        timings[family]["rows"] += A.shape[0]
+        timings[family]["nonzeros"] += A.nnz
+
+    def timed(family, start_time):
+        timings.setdefault(family,{"seconds":0,"rows":0,"nonzeros":0})
+        timings[family]["seconds"] += profiling.record(profile,family,start_time,rows=timings[family]["rows"],nonzeros=timings[family]["nonzeros"])["wall"]
+        print('Set {} --> {:.2f} seconds elapsed, {} rows, {} nonzeros'.format(family,timings[family]["seconds"],timings[family]["rows"],timings[family]["nonzeros"]))
+
+    # 2.2 [Set the objective]
+    start_time = profiling.mark()
+    obj = np.zeros(ncols)
+    obj[offset["U"]], obj[offset["Q"]], obj[offset["R"]] = weight1, -weight2, weight3
+    mod.setObjective(obj @ x, GRB.MAXIMIZE)
+
+    # 2.3 [Define U in the objective Function]
+    row = block(1, X_ug=sp.csr_matrix(-ug["arrays"]["U"]/N), X_g=sp.csr_matrix(-g["arrays"]["U"]/N), U=sp.csr_matrix([[1.0]]))
+    add("Objective", row, '=', 0)
+    timed("Objective", start_time)
+
+    # 2.4.1 [Constraint 1] every section gets exactly one eligible triple
+    start_time = profiling.mark()
+    for leveldic in leveldics:
+        A = leveldic["arrays"]["assign"]
+        add("Constraint 1", block(A.shape[0], **{"X_"+leveldic["level"]:A}), '=', 1, [(leveldic["level"],i) for i in leveldic["I"]])
+    timed("Constraint 1", start_time)
+
+    # 2.4.2 [Constraint 2] at most one class per classroom in each clique (or slot and overlapping pair)
+    start_time = profiling.mark()
+    for leveldic in leveldics:
+        arrays = leveldic["arrays"]
+        nT = len(leveldic["T"])
+        if cliques:
+            groups = [leveldic["T"].get_indexer(clique) for clique in leveldic["cliques"]]
+        else:
+            groups = [[t] for t in range(nT)] + leveldic["Opairs"].tolist()
+        A = grouprows(groupmatrix(groups,nT),arrays["room"],arrays["slot"],np.arange(arrays["n"]),arrays["n"])
+        rhs = 1
+        if "roomcount" in leveldic:
+            # Room types (roomtypes.py): a type holds as many classes per clique as it has classrooms
+            rhs = leveldic["roomcount"][arrays["room"][A.indices[A.indptr[:-1]]]]
+            keep = A.getnnz(axis=1) > rhs
+            A, rhs = A[keep], rhs[keep]
+        add("Constraint 2", block(A.shape[0], **{"X_"+leveldic["level"]:A}), '<', rhs)
+    timed("Constraint 2", start_time)
+
+    # 2.4.3 [Constraint 3] holds by construction of the eligible triples
+
+    # 2.4.4 [Constraint 4] at most one class per professor in each cross-level clique (or slot and overlapping pair)
+    start_time = profiling.mark()
+    nug, ng = len(ug["T"]), len(g["T"])
+    if cliques:
+        groups = [list(ug["T"].get_indexer(ugslots))+list(g["T"].get_indexer(gslots)+nug) for ugslots, gslots in instance["cross_cliques"]]
+    else:
+        crosspairs = np.column_stack([ug["T"].get_indexer(instance["cross_conflict"]["ugindex"]),g["T"].get_indexer(instance["cross_conflict"]["gindex"])])
+        groups = [[t] for t in range(nug+ng)] + ug["Opairs"].tolist() + (g["Opairs"]+nug).tolist() + (crosspairs+[0,nug]).reshape(-1,2).tolist()
+    ua, ga = ug["arrays"], g["arrays"]
+    units = np.concatenate([ua["taught_k"],ga["taught_k"]])
+    slots = np.concatenate([ua["slot"][ua["taught_e"]],ga["slot"][ga["taught_e"]]+nug])
+    cols = np.concatenate([ua["taught_e"],ga["taught_e"]+ua["n"]])
+    A = grouprows(groupmatrix(groups,nug+ng),units,slots,cols,ua["n"]+ga["n"])
+    add("Constraint 4", block(A.shape[0], X_ug=A[:,:ua["n"]], X_g=A[:,ua["n"]:]), '<', 1)
+    timed("Constraint 4", start_time)
+
+    # 2.4.5 [Constraint 5] H[k,t1_t2] is 1 exactly when professor k teaches both t1 and t2
+    start_time = profiling.mark()
+    Hsum = {}
+    pairsbound = np.zeros(nK)
+    for leveldic in leveldics:
+        name = leveldic["level"]
+        nT, nM = len(leveldic["T"]), leveldic["nM"]
+        pairs = leveldic["Mpairs"]
+        kk = np.repeat(np.arange(nK),nM)
+        # Only pairs where professor k can teach both timeslots get rows, the other H are fixed to 0 in 2.1
+        pairable = leveldic["pairable"]
+        nP = int(pairable.sum())
+        Hp = identity(nK*nM)[pairable]
+        ends = [sp.csr_matrix((np.ones(nK*nM),(np.arange(nK*nM),kk*nT+np.tile(pairs[:,end],nK))),shape=(nK*nM,nK*nT))[pairable] @ leveldic["arrays"]["w"]
+                for end in [0,1]]
+        if tight:
+            # H is the AND of w[k,t1] and w[k,t2], both at most 1 by Constraint 4
+            add("Constraint 5", block(nP, **{"X_"+name:-ends[0],"H_"+name:Hp}), '<', 0)
+            add("Constraint 5", block(nP, **{"X_"+name:-ends[1],"H_"+name:Hp}), '<', 0)
+            add("Constraint 5", block(nP, **{"X_"+name:ends[0]+ends[1],"H_"+name:-Hp}), '<', 1)
+        else:
+            both = ends[0]+ends[1]
+            add("Constraint 5", block(nP, **{"X_"+name:-both,"H_"+name:3*Hp}), '<', 1)
+            add("Constraint 5", block(nP, **{"X_"+name:both,"H_"+name:-N*Hp}), '<', 1)
+        # Professor k has at most min(|M|, |L_k| choose 2) back-to-back pairs at this level
+        taught = np.array([len(leveldic["L_k"][k]) for k in K])
+        pairsbound += np.minimum(nM,taught*(taught-1)//2)
+        Hsum["H_"+name] = sp.kron(identity(nK),sp.csr_matrix(np.ones((1,nM))),format="csr")
+    add("Constraint 5", block(nK, r=identity(nK), **{key:-value for key, value in Hsum.items()}), '<', 0)
+    add("Constraint 5", block(nK, r=sp.diags(-pairsbound,format="csr"), **Hsum), '<', 0)
+    add("Constraint 5", block(1, r=sp.csr_matrix(np.ones((1,nK))), R=sp.csr_matrix([[-1.0]])), '=', 0)
+    timed("Constraint 5", start_time)
+
+    # 2.4.6 [Constraint 6] Z[k,s] is 1 exactly when professor k teaches on weekday s, q[k] when on 3 or more days
+    start_time = profiling.mark()
+    days = {}
+    for leveldic in leveldics:
+        name = leveldic["level"]
+        nT = len(leveldic["T"])
+        weekday = np.zeros((nS,nT))
+        for n, s in enumerate(S):
+            weekday[n, leveldic["T"].get_indexer(leveldic["V"][s])] = 1
+        days["X_"+name] = sp.kron(identity(nK),sp.csr_matrix(weekday),format="csr") @ leveldic["arrays"]["w"]
+        if tight:
+            # Z[k,s] is at least w[k,t] for every timeslot t on weekday s where k can teach
+            day, slot = np.nonzero(weekday)
+            wrows = (np.arange(nK)[:,None]*nT+slot[None,:]).ravel()
+            zcols = (np.arange(nK)[:,None]*nS+day[None,:]).ravel()
+            W = leveldic["arrays"]["w"][wrows]
+            keep = W.getnnz(axis=1) > 0
+            W, zcols = W[keep], zcols[keep]
+            add("Constraint 6", block(W.shape[0], Z=sp.csr_matrix((-np.ones(len(zcols)),(np.arange(len(zcols)),zcols)),shape=(len(zcols),nK*nS)),
+                                      **{"X_"+name:W}), '<', 0)
+    add("Constraint 6", block(nK*nS, Z=identity(nK*nS), **{key:-value for key, value in days.items()}), '<', 0)
+    if not tight:
+        add("Constraint 6", block(nK*nS, Z=identity(nK*nS,-N), **days), '<', 0)
+    Zsum = sp.kron(identity(nK),sp.csr_matrix(np.ones((1,nS))),format="csr")
+    add("Constraint 6", block(nK, Z=-Zsum, q=identity(nK,3)), '<', 0)
+    # Professor k teaches on at most the D_k weekdays that have a timeslot k can teach
+    possible = (sum(value.getnnz(axis=1) for value in days.values()) > 0).reshape(nK,nS).sum(axis=1)
+    add("Constraint 6", block(nK, Z=Zsum, q=sp.diags(-np.maximum(possible-2,0).astype(float),format="csr")), '<', 2)
+    add("Constraint 6", block(1, q=sp.csr_matrix(np.ones((1,nK))), Q=sp.csr_matrix([[-1.0]])), '=', 0)
+    timed("Constraint 6", start_time)
+
+    return {"mod":mod,"ug":ug,"g":g,"U":U,"R":R,"Q":Q,"r":r,"q":q,"Z":Z,"x":x,"offset":offset,
+            "weights":(weight1,weight2,weight3),"timings":timings,"constraints":constraints}
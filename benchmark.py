@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+'''Scaling benchmark of optimize() on synthetic instances (generate.py).
+
+Every case generates a workbook, then records
+    - Preprocess: preprocess() time, without the instance cache
+    - Build: assembly.build_model() time
+    - Solve: Gurobi time, capped by timelimit
+    - Variables, Constraints, Nonzeros: model size
+    - PeakRSS: peak resident memory of the case in MB
+Each case runs in a freshly spawned interpreter and PeakRSS is read from its own high-water
+mark (profiling.peak_rss()), so it is the peak of that case alone, including the interpreter
+and its imports. A forked worker would start with the resident memory of this process, and
+ru_maxrss would even report the peak of this process after a spawn.
+
+Results are compared with a stored baseline (JSON, one entry per case). A case is
+flagged when a model size grows, or when a time or PeakRSS grows by more than
+tolerance (and by more than noise seconds for times). Without a baseline file, or
+with "update", the results are stored as the new baseline.
+
+    python benchmark.py resultsFile baselineFile(optional) update(optional)
+resultsFile is a .csv table of all cases and their regressions.'''
+
+import os
+import json
+import time
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from gurobipy import GurobiError
+import optimize as opt
+import assembly
+import generate
+import profiling
+
+# sections, classrooms per level, start times per day, sections per instructor, share of cross-level instructors
+CASES = [dict(sections=25,rooms=3,starts=2,load=3,cross=0.1),
+         dict(sections=50,rooms=5,starts=4,load=3,cross=0.1),
+         dict(sections=100,rooms=10,starts=4,load=3,cross=0.1),
+         dict(sections=200,rooms=20,starts=6,load=3,cross=0.1),
+         dict(sections=200,rooms=20,starts=6,load=5,cross=0.3),
+         dict(sections=400,rooms=40,starts=6,load=3,cross=0.1)]
+TIMES = ["Preprocess","Build","Solve"]
+SIZES = ["Variables","Constraints","Nonzeros"]
+
+
+def case_name(case):
+    return 's{sections}-r{rooms}-t{starts}-l{load}-c{cross}'.format(**case)
+
+
+def run_case(case,directory,timelimit=60):
+    '''Generate, preprocess, build and solve one case; runs inside a worker process'''
+    inputFile = os.path.join(directory,case_name(case)+'.xlsx')
+    generate.generate(inputFile,case["sections"],case["rooms"],case["starts"],load=case["load"],cross=case["cross"],seed=case.get("seed",0))
+    row = dict(case,Case=case_name(case))
+    start_time = time.time()
+    instance = opt.preprocess(inputFile)
+    row["Preprocess"] = time.time()-start_time
+    start_time = time.time()
+    model = assembly.build_model(instance)
+    mod = model["mod"]
+    mod.update()
+    row["Build"] = time.time()-start_time
+    row.update({"Variables":mod.NumVars,"Constraints":mod.NumConstrs,"Nonzeros":mod.NumNZs})
+    mod.setParam('OutputFlag',False)
+    mod.setParam('TimeLimit',timelimit)
+    start_time = time.time()
+    try:
+        mod.optimize()
+        row["Status"] = mod.Status
+        row["Solve"] = time.time()-start_time
+    except GurobiError as error:
+        row["Status"] = str(error)
+        row["Solve"] = np.nan
+    row["PeakRSS"] = profiling.peak_rss()
+    return row
+
+
+def regressions(row,baseline,tolerance=0.25,noise=0.05):
+    '''Metrics of row that regressed against the baseline entry of its case'''
+    flagged = []
+    for metric in SIZES:
+        if metric in baseline and row[metric] > baseline[metric]:
+            flagged.append(metric)
+    for metric in TIMES+["PeakRSS"]:
+        if baseline.get(metric) is None or np.isnan(row[metric]):
+            continue
+        limit = baseline[metric]*(1+tolerance)
+        if metric in TIMES:
+            limit = max(limit,baseline[metric]+noise)
+        if row[metric] > limit:
+            flagged.append(metric)
+    return flagged
+
+
+def benchmark(resultsFile,baselineFile='benchmark_baseline.json',cases=CASES,timelimit=60,tolerance=0.25,update=False):
+    '''Run every case, write the results table and flag regressions against baselineFile.
+    Returns the results table; its Regressions column lists the regressed metrics of each case.'''
+    rows = []
+    with tempfile.TemporaryDirectory() as directory:
+        for case in cases:
+            with ProcessPoolExecutor(1,mp_context=multiprocessing.get_context('spawn')) as pool:
+                row = pool.submit(run_case,case,directory,timelimit).result()
+            print('{Case} --> preprocess {Preprocess:.1f}s, build {Build:.1f}s, solve {Solve:.1f}s, '
+                  '{Variables} variables, {Constraints} constraints, {Nonzeros} nonzeros, {PeakRSS:.0f} MB'.format(**row))
+            rows.append(row)
+    baseline = {}
+    if os.path.exists(baselineFile):
+        with open(baselineFile) as f:
+            baseline = json.load(f)
+    for row in rows:
+        row["Regressions"] = ','.join(regressions(row,baseline.get(row["Case"],{}),tolerance))
+        if row["Regressions"]:
+            print('REGRESSION {} --> {}'.format(row["Case"],row["Regressions"]))
+    table = pd.DataFrame(rows)
+    table.to_csv(resultsFile,index=False)
+    if update or not baseline:
+        baseline.update({row["Case"]:{metric:(None if pd.isna(row[metric]) else row[metric]) for metric in TIMES+SIZES+["PeakRSS"]}
+                         for row in rows})
+        with open(baselineFile,'w') as f:
+            json.dump(baseline,f,indent=1)
+        print(f'Baseline stored in "{baselineFile}"')
+    return table
+
+
+if __name__=='__main__':
+    import sys
+    if len(sys.argv) < 2 or len(sys.argv) > 4:
+        print('Correct syntax: python benchmark.py resultsFile baselineFile(optional) update(optional)')
+    else:
+        baselineFile = sys.argv[2] if len(sys.argv) >= 3 else 'benchmark_baseline.json'
+        table = benchmark(sys.argv[1],baselineFile,update=len(sys.argv)==4 and sys.argv[3]=='update')
+        print(f'Results in "{sys.argv[1]}"')
+        sys.exit(1 if (table["Regressions"] != '').any() else 0)
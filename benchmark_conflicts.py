@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+'''Benchmark of the conflict-index engine (conflicts.py) against the original
+pairwise loops of optimize() sections 1.2 and 1.3.
+Both are run on the Timeslots_UG and Timeslots_G sheets of the same workbook;
+the script checks that O, cross_conflict, M and ug_g_consecutive hold exactly
+the same pairs in the same order and prints the time each approach took.
+
+    python benchmark_conflicts.py inputFile [repeat]'''
+
+import time
+import itertools as it
+from datetime import datetime, date
+import pandas as pd
+import conflicts
+
+
+def sameday(day1,day2):
+    return day1 == day2 or day1 == day2[0] or day1 == day2[-1] or day1[0] == day2 or day1[-1] == day2
+
+def samesession(session1,session2):
+    return (session1 == session2 or\
+            (session1 == "Full Semester" and session2 == "First Half")or\
+            (session1 == "Full Semester" and session2 == "Second Half")or\
+            (session1 == "First Half" and session2 == "Full Semester")or\
+            (session1 == "Second Half" and session2 == "Full Semester"))
+
+def overlapping(start1,end1,start2,end2):
+    return (start1 == start2 or end1 == end2 or \
+            (start1 > start2 and start1 < end2) or \
+            (start2 > start1 and start2 < end1) or \
+            (end1 > start2 and end1 < end2) or \
+            (end2 > start1 and end2 < end1))
+
+def legacy(ugslots,gslots):
+    '''Sections 1.2 and 1.3 of optimize() as originally written, returning label pairs'''
+    result = {}
+    for name, slots in [("ug",ugslots),("g",gslots)]:
+        result[name+"_O"] = []
+        result[name+"_M"] = []
+        for t1, t2 in it.combinations(slots.index, 2):
+            t1_start = slots.loc[t1,"StartTime"]
+            t1_end = slots.loc[t1,"EndTime"]
+            t2_start = slots.loc[t2,"StartTime"]
+            t2_end = slots.loc[t2,"EndTime"]
+            t1_day = slots.loc[t1,"Day"]
+            t2_day = slots.loc[t2,"Day"]
+            t1_session = slots.loc[t1,"Session"]
+            t2_session = slots.loc[t2,"Session"]
+            if overlapping(t1_start,t1_end,t2_start,t2_end) and sameday(t1_day,t2_day) and samesession(t1_session,t2_session):
+                result[name+"_O"].append((t1,t2))
+            if (t1_start == t2_end or t1_end == t2_start) and sameday(t1_day,t2_day) and samesession(t1_session,t2_session):
+                result[name+"_M"].append((t1,t2))
+    result["cross_conflict"] = []
+    result["ug_g_consecutive"] = []
+    for ugindex in ugslots.index:
+        for gindex in gslots.index:
+            ug_start = ugslots.loc[ugindex,"StartTime"]
+            ug_end = ugslots.loc[ugindex,"EndTime"]
+            g_start = gslots.loc[gindex,"StartTime"]
+            g_end = gslots.loc[gindex,"EndTime"]
+            ug_day = ugslots.loc[ugindex,"Day"]
+            g_day = gslots.loc[gindex,"Day"]
+            ug_session = ugslots.loc[ugindex,"Session"]
+            g_session = gslots.loc[gindex,"Session"]
+            if not (sameday(ug_day,g_day) and samesession(ug_session,g_session)):
+                continue
+            if overlapping(ug_start,ug_end,g_start,g_end):
+                result["cross_conflict"].append((ugindex,gindex))
+            duration_1 = (datetime.combine(date.today(), ug_start) - datetime.combine(date.today(), g_end)).total_seconds()/60
+            duration_2 = (datetime.combine(date.today(), g_start) - datetime.combine(date.today(), ug_end)).total_seconds()/60
+            if (duration_1 < 30 and duration_1>=0) or (duration_2 < 30 and duration_2>=0):
+                result["ug_g_consecutive"].append((ugindex,gindex))
+    return result
+
+def vectorized(ugslots,gslots):
+    '''The same relations computed with conflicts.py, returning label pairs'''
+    result = {}
+    code = {"ug":conflicts.encode_timeslots(ugslots),"g":conflicts.encode_timeslots(gslots)}
+    index = {"ug":ugslots.index.values,"g":gslots.index.values}
+    def labels(pairs,first,second):
+        return list(zip(index[first][pairs[:,0]].tolist(),index[second][pairs[:,1]].tolist()))
+    for name in ["ug","g"]:
+        result[name+"_O"] = labels(conflicts.overlap_pairs(code[name]),name,name)
+        result[name+"_M"] = labels(conflicts.consecutive_pairs(code[name]),name,name)
+    result["cross_conflict"] = labels(conflicts.overlap_pairs(code["ug"],code["g"]),"ug","g")
+    result["ug_g_consecutive"] = labels(conflicts.consecutive_pairs(code["ug"],code["g"],max_break=30),"ug","g")
+    return result
+
+def benchmark(inputFile,repeat=3):
+    ugslots = pd.read_excel(inputFile,sheet_name='Timeslots_UG',index_col=0)
+    gslots = pd.read_excel(inputFile,sheet_name='Timeslots_G',index_col=0)
+    print('{} undergraduate timeslots, {} graduate timeslots'.format(ugslots.shape[0],gslots.shape[0]))
+    start_time = time.time()
+    old = legacy(ugslots,gslots)
+    legacy_time = time.time()-start_time
+    new_time = float("inf")
+    for _ in range(repeat):
+        start_time = time.time()
+        new = vectorized(ugslots,gslots)
+        new_time = min(new_time,time.time()-start_time)
+    matches = True
+    for key in old:
+        same = old[key] == new[key]
+        matches = matches and same
+        print('{:<18} {:>8} pairs  {}'.format(key,len(old[key]),'match' if same else 'MISMATCH ({} vectorized pairs)'.format(len(new[key]))))
+    print('Pairwise loops --> {:.3f} seconds'.format(legacy_time))
+    print('Conflict index --> {:.3f} seconds (best of {})'.format(new_time,repeat))
+    print('Speedup: {:.0f}x'.format(legacy_time/max(new_time,1e-9)))
+    return matches
+
+if __name__=='__main__':
+    import sys, os
+    if len(sys.argv)!=2 and len(sys.argv)!=3:
+        print('Correct syntax: python benchmark_conflicts.py inputFile repeat(optional)')
+    elif not os.path.exists(sys.argv[1]):
+        print(f'File "{sys.argv[1]}" not found!')
+    else:
+        repeat = int(sys.argv[2]) if len(sys.argv)==3 else 3
+        sys.exit(0 if benchmark(sys.argv[1],repeat) else 1)
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+'''Benchmark of the per-timeslot rows linking H and Z to X in Constraints 5 and 6
+(assembly.build_model(tight=True)) against the default big-M rows with M = N. Both
+bound the pair and day counts of every professor by min(|M|, |L_k| choose 2) and
+D_k, which adds no rows. Both formulations are built from the same instance and solved to optimality, and
+for each the script records
+    - LP: bound of the LP relaxation
+    - Root: best bound at the end of the root node (after Gurobi's cuts)
+    - Nodes: branch-and-bound nodes explored
+    - Time: time to optimality in seconds, capped by timelimit
+    - Objective: optimal value, which must be the same for both
+The script exits with status 1 when the objectives differ.
+
+    python benchmark_formulations.py inputFile(s) [resultsFile.csv]'''
+
+import time
+import pandas as pd
+from gurobipy import GRB, GurobiError
+import optimize as opt
+import assembly
+import profiling
+
+
+def root_bound(bound):
+    '''Gurobi callback keeping the best bound seen while the node count is still 0 in bound["Root"]'''
+    def trace(model,where):
+        if where == GRB.Callback.MIP and model.cbGet(GRB.Callback.MIP_NODCNT) == 0:
+            bound["Root"] = profiling.finite(model.cbGet(GRB.Callback.MIP_OBJBND))
+    return trace
+
+
+def solve(instance,tight,timelimit=600):
+    '''Build and solve one formulation; returns its row of the comparison table'''
+    start_time = time.time()
+    model = assembly.build_model(instance,tight=tight)
+    mod = model["mod"]
+    mod.update()
+    row = {"Formulation":"tight" if tight else "big-M","Build":time.time()-start_time,
+           "Constraints":mod.NumConstrs,"Nonzeros":mod.NumNZs}
+    mod.setParam('OutputFlag',False)
+    mod.setParam('TimeLimit',timelimit)
+    relaxed = mod.relax()
+    relaxed.optimize()
+    row["LP"] = relaxed.ObjVal if relaxed.Status == GRB.OPTIMAL else None
+    bound = {"Root":None}
+    mod.optimize(root_bound(bound))
+    # Solved at the root: the callback may not run again after the last bound update
+    row["Root"] = mod.ObjBound if mod.NodeCount == 0 else bound["Root"]
+    row.update({"Nodes":mod.NodeCount,"Time":mod.Runtime,"Status":mod.Status,
+                "Objective":mod.ObjVal if mod.SolCount > 0 else None})
+    return row
+
+
+def benchmark(inputFiles,resultsFile=None,timelimit=600):
+    rows = []
+    for inputFile in inputFiles:
+        instance = opt.load_instance(inputFile)
+        for tight in [False,True]:
+            try:
+                row = solve(instance,tight,timelimit)
+            except GurobiError as error:
+                print('{} --> {}'.format(inputFile,error))
+                break
+            rows.append(dict(row,Instance=inputFile))
+    table = pd.DataFrame(rows,columns=["Instance","Formulation","Constraints","Nonzeros","Build","LP","Root",
+                                       "Nodes","Time","Status","Objective"])
+    with pd.option_context('display.width',200,'display.float_format','{:.3f}'.format):
+        print(table.to_string(index=False))
+    if resultsFile is not None:
+        table.to_csv(resultsFile,index=False)
+    matches = True
+    for inputFile, runs in table.groupby("Instance"):
+        solved = runs[runs["Status"] == GRB.OPTIMAL]
+        if len(solved) == 2 and abs(solved["Objective"].iloc[0]-solved["Objective"].iloc[1]) > 1e-6:
+            print('{} --> MISMATCH of the optimal values'.format(inputFile))
+            matches = False
+    return matches
+
+if __name__=='__main__':
+    import sys, os
+    inputFiles = [argument for argument in sys.argv[1:] if not argument.endswith('.csv')]
+    resultsFile = sys.argv[-1] if len(sys.argv) > 1 and sys.argv[-1].endswith('.csv') else None
+    missing = [inputFile for inputFile in inputFiles if not os.path.exists(inputFile)]
+    if not inputFiles:
+        print('Correct syntax: python benchmark_formulations.py inputFile(s) resultsFile.csv(optional)')
+    elif missing:
+        print(f'File "{missing[0]}" not found!')
+    else:
+        matches = benchmark(inputFiles,resultsFile)
+        if resultsFile is not None:
+            print(f'Results in "{resultsFile}"')
+        sys.exit(0 if matches else 1)
@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+'''Timeslot conflict-index engine used by optimize().
+
+Every timeslot is encoded once as a handful of integer arrays:
+    - day: bitmask over the weekdays in the Day string (M=1, T=2, W=4, H=8, F=16);
+      any other letter raises ValueError
+    - ends: bitmask of the first and last character of the Day string
+    - single: whether the Day string is a single weekday
+    - session: bitmask of the covered halves (First Half=1, Second Half=2, Full Semester=3)
+    - start, end: StartTime and EndTime in integer minutes after midnight
+The overlap (O) and consecutive (M) relations are then computed for all pairs
+at once with NumPy broadcasting, in blocks of rows so memory stays bounded on
+large slot grids. Pairs are returned as (n, 2) int32 arrays of positions into
+the timeslot index, in the same order the pairwise loops produced them.'''
+
+import numpy as np
+import pandas as pd
+
+DAYS = {'M':1,'T':2,'W':4,'H':8,'F':16}
+SESSIONS = {"First Half":1,"Second Half":2,"Full Semester":3}
+BLOCK = 1024
+
+
+def to_minutes(value):
+    '''Convert a StartTime/EndTime cell (datetime.time, Timestamp or "HH:MM[:SS]") to minutes after midnight'''
+    if isinstance(value, str):
+        value = pd.Timestamp(value)
+    return value.hour*60 + value.minute
+
+
+def encode_timeslots(timeslots):
+    '''Encode a Timeslots_UG/Timeslots_G frame into the integer arrays described above'''
+    days = timeslots["Day"].astype(str).to_list()
+    # An unknown letter would get an empty day mask and never overlap anything, so it is an input error
+    unknown = sorted({d for day in days for d in day if d not in DAYS})
+    if unknown or '' in days:
+        raise ValueError('Empty or unknown day codes {} in the Day column of the timeslots (expected letters of {})'.format(unknown,''.join(DAYS)))
+    sessions = timeslots["Session"].to_list()
+    # Sessions outside the three known ones only match themselves, as in the original loops
+    sessionbits = dict(SESSIONS)
+    for session in sessions:
+        if session not in sessionbits:
+            sessionbits[session] = 1 << (len(sessionbits)+1)
+    code = {}
+    code["day"] = np.array([sum(DAYS[d] for d in set(day)) for day in days], dtype=np.int32)
+    code["ends"] = np.array([DAYS[day[0]]|DAYS[day[-1]] for day in days], dtype=np.int32)
+    code["single"] = np.array([len(day) == 1 for day in days])
+    code["session"] = np.array([sessionbits[session] for session in sessions], dtype=np.int32)
+    code["start"] = np.array([to_minutes(t) for t in timeslots["StartTime"]], dtype=np.int32)
+    code["end"] = np.array([to_minutes(t) for t in timeslots["EndTime"]], dtype=np.int32)
+    return code
+
+
+def _rows(code, rows):
+    return {key: value[rows, None] for key, value in code.items()}
+
+
+def _same_day(a, b):
+    # Same day pattern, or a single day that is the first or last day of the other pattern
+    return (a["day"] == b["day"]) | \
+           (a["single"] & ((a["day"] & b["ends"]) != 0)) | \
+           (b["single"] & ((b["day"] & a["ends"]) != 0))
+
+
+def _same_session(a, b):
+    # Full Semester meets both halves; First Half and Second Half never meet
+    return (a["session"] & b["session"]) != 0
+
+
+def _overlap(a, b):
+    return (a["start"] < b["end"]) & (b["start"] < a["end"]) & _same_day(a, b) & _same_session(a, b)
+
+
+def _consecutive(a, b, max_break):
+    if max_break is None:
+        touching = (a["start"] == b["end"]) | (a["end"] == b["start"])
+    else:
+        break1 = a["start"] - b["end"]
+        break2 = b["start"] - a["end"]
+        touching = ((break1 >= 0) & (break1 < max_break)) | ((break2 >= 0) & (break2 < max_break))
+    return touching & _same_day(a, b) & _same_session(a, b)
+
+
+def _pairs(relation, a, b=None):
+    '''Evaluate relation over all row x column pairs block by block.
+    With b=None the pairs are within one level and only t1 < t2 is kept.'''
+    within = b is None
+    if within:
+        b = a
+    n = len(a["day"])
+    found = []
+    for first in range(0, n, BLOCK):
+        rows = np.arange(first, min(first+BLOCK, n))
+        mask = relation(_rows(a, rows), b)
+        if within:
+            mask &= np.arange(n)[None, :] > rows[:, None]
+        r, c = np.nonzero(mask)
+        found.append(np.column_stack([r+first, c]))
+    if not found:
+        return np.empty((0, 2), dtype=np.int32)
+    return np.concatenate(found).astype(np.int32)
+
+
+def overlap_pairs(a, b=None):
+    '''Pairs of overlapping timeslots (O), within a level or across two levels'''
+    return _pairs(_overlap, a, b)
+
+
+def consecutive_pairs(a, b=None, max_break=None):
+    '''Pairs of back-to-back timeslots (M). By default one slot must end exactly when
+    the other starts; with max_break the break between them may be 0 up to max_break minutes'''
+    return _pairs(lambda x, y: _consecutive(x, y, max_break), a, b)
+
+
+def maximal_cliques(n, pairs):
+    '''Maximal cliques of the conflict graph on timeslot positions 0..n-1 with edges pairs.
+    Every edge lies in at least one clique and isolated timeslots form cliques of one, so
+    "at most one per clique" rows replace both the per-slot and the pairwise conflict rows.
+    Overlap graphs are interval graphs per day and session and have few maximal cliques,
+    so Bron-Kerbosch with pivoting over a degree ordering enumerates them quickly.'''
+    adjacency = [set() for _ in range(n)]
+    for a, b in np.asarray(pairs).tolist():
+        adjacency[a].add(b)
+        adjacency[b].add(a)
+    cliques = []
+    def expand(clique, candidates, excluded):
+        if not candidates and not excluded:
+            cliques.append(sorted(clique))
+            return
+        pivot = max(candidates | excluded, key=lambda v: len(adjacency[v] & candidates))
+        for v in list(candidates - adjacency[pivot]):
+            expand(clique+[v], candidates & adjacency[v], excluded & adjacency[v])
+            candidates.remove(v)
+            excluded.add(v)
+    order = sorted(range(n), key=lambda v: len(adjacency[v]))
+    position = {v:p for p, v in enumerate(order)}
+    for v in order:
+        later = {u for u in adjacency[v] if position[u] > position[v]}
+        expand([v], later, adjacency[v]-later)
+    return sorted(cliques)
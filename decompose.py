@@ -0,0 +1,289 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+'''Two-stage time-then-room decomposition of the optimize() model for large catalogs.
+
+Stage 1 assigns every section to a timeslot of its timepart, without choosing
+classrooms. Classrooms only enter through aggregated capacity counts: with the
+distinct classroom capacities c_1 < ... < c_m of a level as size bands, in every
+within-level clique of overlapping timeslots
+    # sections with seats_offered > c_(b-1)  <=  # classrooms with Capacity >= c_b
+for each band b. These are Hall's conditions for the nested "fits in the classroom"
+sets, so the sections of any clique can always be given distinct classrooms. The
+professor conflicts (Constraint 4), back-to-back classes (Constraint 5) and
+teaching days (Constraint 6) are modelled as in optimize(). U does not depend on
+the timeslots once classrooms are left out, so stage 1 optimizes weight3*R - weight2*Q.
+
+Stage 2 assigns classrooms. Sections whose timeslots are not connected through
+overlaps never compete for a classroom, so the scheduled sections of each level are
+split into the connected components of the overlap graph on their timeslots, and
+every component is solved on its own, maximizing the summed U_ij:
+    - a component whose timeslots all overlap is a weighted bipartite matching
+      between its sections and classrooms (scipy linear_sum_assignment)
+    - other components are a small assignment model with the classroom clique rows
+      of Constraint 2, which also places as many sections as it can
+The components are independent and are solved on a pool of worker processes.
+
+    python decompose.py inputFile outputFile weight1(optional) weight2(optional) weight3(optional) processes(optional) compare(optional)
+With "compare" the monolithic model is solved as well and the objective gap is reported,
+which is only practical on instances small enough to solve both ways.'''
+
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import scipy.sparse as sp
+from scipy.sparse.csgraph import connected_components
+from scipy.optimize import linear_sum_assignment
+from gurobipy import Model, GRB, quicksum
+import heuristic
+
+
+def capacity_bands(leveldic):
+    '''Size bands of a level: for every distinct classroom capacity c_b (ascending), the
+    sections that need a classroom of at least c_b and the number of such classrooms'''
+    capacity = leveldic["classrooms"]["Capacity"]
+    seats = leveldic["classes"]["seats_offered"]
+    bands = []
+    previous = -np.inf
+    for c in np.unique(capacity.values):
+        sections = [i for i in leveldic["I"] if seats[i] > previous and leveldic["J_i"][i]]
+        bands.append((sections,int((capacity >= c).sum())))
+        previous = c
+    return bands
+
+
+def assign_times(instance,weight1=1,weight2=1,weight3=0.2,timelimit=None):
+    '''Stage 1: section -> timeslot model with capacity bands instead of classrooms.
+    Returns {"ug": {section: timeslot}, "g": {...}} (empty when no solution was found)
+    and the Gurobi model.'''
+    ug, g = instance["ug"], instance["g"]
+    leveldics = {"ug":ug,"g":g}
+    N, S = instance["N"], instance["S"]
+    K = ug["K"]
+    start_time = time.time()
+    mod = Model()
+    x, w = {}, {}
+    for level, leveldic in leveldics.items():
+        x[level] = mod.addVars([(i,t) for i in leveldic["I"] for t in leveldic["T_i"][i]],vtype=GRB.BINARY)
+        for i in leveldic["I"]:
+            mod.addConstr(x[level].sum(i,'*') == 1)
+        # w[k,t]: the (level, section, timeslot) keys of the classes professor k may teach at timeslot t
+        w[level] = {}
+        for k in K:
+            for i in leveldic["L_k"][k]:
+                for t in leveldic["T_i"][i]:
+                    w[level].setdefault((k,t),[]).append((level,i,t))
+
+        # Capacity bands in every within-level clique; rows that can never bind are skipped
+        for sections, rooms in capacity_bands(leveldic):
+            seen = set()
+            for clique in leveldic["cliques"]:
+                clique = set(clique)
+                terms = tuple((i,t) for i in sections for t in leveldic["T_i"][i] if t in clique)
+                if len({i for i, _ in terms}) <= rooms or terms in seen:
+                    continue
+                seen.add(terms)
+                mod.addConstr(quicksum(x[level][e] for e in terms) <= rooms)
+
+    def xsum(keys):
+        return quicksum(x[level][i,t] for level, i, t in keys)
+
+    # Constraint 4: at most one class per professor in each cross-level clique
+    for k in K:
+        seen = set()
+        for ugslots, gslots in instance["cross_cliques"]:
+            terms = tuple(v for level, slots in [("ug",ugslots),("g",gslots)] for t in slots for v in w[level].get((k,t),[]))
+            if len(terms) > 1 and terms not in seen:
+                seen.add(terms)
+                mod.addConstr(xsum(terms) <= 1)
+
+    # Constraint 5: H only exists where professor k can teach both timeslots of the pair
+    r = mod.addVars(K,vtype=GRB.BINARY)
+    R = mod.addVar(lb=0)
+    H = {k:[] for k in K}
+    for level, leveldic in leveldics.items():
+        T = leveldic["T"]
+        for a, b in leveldic["Mpairs"]:
+            for k in K:
+                if (k,T[a]) in w[level] and (k,T[b]) in w[level]:
+                    h = mod.addVar(vtype=GRB.BINARY)
+                    middlepart = xsum(w[level][k,T[a]]) + xsum(w[level][k,T[b]]) + 1
+                    mod.addConstr(3*h <= middlepart)
+                    mod.addConstr(middlepart <= N*h+2)
+                    H[k].append(h)
+    for k in K:
+        mod.addConstr(r[k] <= quicksum(H[k]))
+        mod.addConstr(quicksum(H[k]) <= N*r[k])
+    mod.addConstr(r.sum() == R)
+
+    # Constraint 6: Z only exists where professor k can teach on weekday s
+    q = mod.addVars(K,vtype=GRB.BINARY)
+    Q = mod.addVar(vtype=GRB.INTEGER,lb=0)
+    for k in K:
+        Zk = []
+        for s in S:
+            terms = [v for level, leveldic in leveldics.items() for t in leveldic["V"][s] for v in w[level].get((k,t),[])]
+            if terms:
+                z = mod.addVar(vtype=GRB.BINARY)
+                mod.addConstr(xsum(terms) >= z)
+                mod.addConstr(xsum(terms) <= N*z)
+                Zk.append(z)
+        mod.addConstr(quicksum(Zk) >= 3*q[k])
+        mod.addConstr(quicksum(Zk) <= N*q[k]+2)
+    mod.addConstr(q.sum() == Q)
+    mod.setObjective(weight3*R-weight2*Q,sense=GRB.MAXIMIZE)
+    mod.update()
+    print('Stage 1 model size: {} variables, {} constraints, {} nonzeros'.format(mod.NumVars,mod.NumConstrs,mod.NumNZs))
+
+    if timelimit is not None:
+        mod.setParam('TimeLimit',timelimit)
+    mod.setParam('OutputFlag',False)
+    mod.optimize()
+    times = {"ug":{},"g":{}}
+    if mod.SolCount > 0:
+        for level in leveldics:
+            times[level] = {i:t for (i,t), v in x[level].items() if v.X > 0.5}
+    print('Stage 1 (timeslots) --> {:.1f} seconds elapsed, status {}'.format(time.time()-start_time,mod.Status))
+    return times, mod
+
+
+def room_tasks(instance,times):
+    '''Split the scheduled sections of each level into connected components of the
+    overlap graph on their timeslots. Every task holds what match_rooms() needs.'''
+    tasks = []
+    for level in ["ug","g"]:
+        leveldic = instance[level]
+        placed = list(times[level].items())
+        if not placed:
+            continue
+        T = leveldic["T"]
+        nT = len(T)
+        pairs = leveldic["Opairs"]
+        graph = sp.csr_matrix((np.ones(len(pairs)),(pairs[:,0],pairs[:,1])),shape=(nT,nT))
+        _, component = connected_components(graph,directed=False)
+        slotpos = T.get_indexer([t for _, t in placed])
+        for c in np.unique(component[slotpos]):
+            members = [placed[n] for n in np.flatnonzero(component[slotpos] == c)]
+            slots = {t for _, t in members}
+            rooms = sorted({j for i, _ in members for j in leveldic["J_i"][i]},key=list(leveldic["J"]).index)
+            utilization = np.full((len(members),len(rooms)),-1.0)
+            for n, (i,_) in enumerate(members):
+                for j in leveldic["J_i"][i]:
+                    utilization[n,rooms.index(j)] = leveldic["U_ij"].loc[i,j]
+            groups = {tuple(n for n, (_,t) in enumerate(members) if t in clique)
+                      for clique in map(set,leveldic["cliques"]) if slots & clique}
+            tasks.append({"level":level,"sections":members,"rooms":rooms,"U":utilization,"groups":sorted(groups)})
+    return tasks
+
+
+def match_rooms(task):
+    '''Stage 2 for one component: classroom of each section maximizing the summed U_ij.
+    Returns the (level, section, classroom, timeslot) placements.'''
+    members, rooms, utilization = task["sections"], task["rooms"], task["U"]
+    eligible = utilization >= 0
+    if len(task["groups"]) == 1 and len(task["groups"][0]) == len(members) and len(members) <= len(rooms):
+        # Every pair of sections overlaps: weighted bipartite matching
+        rows, cols = linear_sum_assignment(np.where(eligible,-utilization,1e6))
+        chosen = [(n,m) for n, m in zip(rows,cols) if eligible[n,m]]
+    else:
+        # Sections get at most one classroom so the model stays feasible; placing a section
+        # is worth more than any utilization, so as many sections as possible are placed
+        mod = Model()
+        mod.setParam('OutputFlag',False)
+        keys = list(zip(*np.nonzero(eligible)))
+        x = mod.addVars(keys,vtype=GRB.BINARY)
+        for n in range(len(members)):
+            mod.addConstr(x.sum(n,'*') <= 1)
+        for group in task["groups"]:
+            for m in range(len(rooms)):
+                terms = [x[n,m] for n in group if eligible[n,m]]
+                if len(terms) > 1:
+                    mod.addConstr(quicksum(terms) <= 1)
+        mod.setObjective(quicksum((utilization[e]+100*len(members))*x[e] for e in keys),sense=GRB.MAXIMIZE)
+        mod.optimize()
+        chosen = [e for e in keys if mod.SolCount > 0 and x[e].X > 0.5]
+    return [(task["level"],members[n][0],rooms[m],members[n][1]) for n, m in chosen]
+
+
+def assign_rooms(instance,times,processes=1):
+    '''Stage 2: classrooms for every component, on a pool of processes when processes > 1.
+    Returns the schedule {"ug": {section: (classroom, timeslot)}, "g": {...}} and the
+    (level, section) pairs left without a classroom.'''
+    start_time = time.time()
+    tasks = room_tasks(instance,times)
+    if processes > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(min(processes,len(tasks))) as pool:
+            results = list(pool.map(match_rooms,tasks,chunksize=max(1,len(tasks)//(4*processes))))
+    else:
+        results = [match_rooms(task) for task in tasks]
+    schedule = {"ug":{},"g":{}}
+    for placements in results:
+        for level, i, j, t in placements:
+            schedule[level][i] = (j,t)
+    unplaced = [(level,i) for level in ["ug","g"] for i in instance[level]["I"] if i not in schedule[level]]
+    print('Stage 2 (classrooms) --> {:.1f} seconds elapsed, {} components, {} sections without a classroom'.format(time.time()-start_time,len(tasks),len(unplaced)))
+    return schedule, unplaced
+
+
+def solve(instance,weight1=1,weight2=1,weight3=0.2,processes=1,timelimit=None):
+    '''Both stages; returns the schedule, the unplaced sections and the Objective/U/R/Q of the schedule'''
+    times, _ = assign_times(instance,weight1,weight2,weight3,timelimit)
+    schedule, unplaced = assign_rooms(instance,times,processes)
+    values = heuristic.evaluate(instance,schedule,weight1,weight2,weight3)
+    return schedule, unplaced, values
+
+
+def monolithic(instance,weight1=1,weight2=1,weight3=0.2,timelimit=None):
+    '''Objective/U/R/Q of the full optimize() model, for the gap report'''
+    import assembly
+    model = assembly.build_model(instance,weight1,weight2,weight3)
+    mod = model["mod"]
+    if timelimit is not None:
+        mod.setParam('TimeLimit',timelimit)
+    mod.setParam('OutputFlag',False)
+    mod.optimize()
+    if mod.SolCount == 0:
+        return {"Objective":np.nan,"U":np.nan,"R":np.nan,"Q":np.nan,"Bound":np.nan}
+    return {"Objective":mod.ObjVal,"U":model["U"].X,"R":model["R"].X,"Q":model["Q"].X,"Bound":mod.ObjBound}
+
+
+def decompose(instance,outputFile,weight1=1,weight2=1,weight3=0.2,processes=1,timelimit=None,compare=False,formats=None):
+    '''Decomposition mode: write the two-stage schedule in the usual output workbook layout.
+    Returns a report of the schedule with the (level, section) pairs stage 2 left without a classroom
+    under "unplaced"; they are marked in the workbook and warned about. With compare=True the
+    monolithic model is solved too and the objective gap printed and returned.'''
+    import optimize as opt
+    start_time = time.time()
+    schedule, unplaced, values = solve(instance,weight1,weight2,weight3,processes,timelimit)
+    print('Decomposition --> {:.1f} seconds elapsed, Objective {:.2f} (U {:.2f}, R {}, Q {})'.format(
+        time.time()-start_time,values["Objective"],values["U"],values["R"],values["Q"]))
+    opt.write_schedule(instance,heuristic.chosen_triples(schedule),values,(weight1,weight2,weight3),outputFile,formats)
+    if unplaced:
+        print('WARNING: incomplete schedule, sections {} have no classroom or timeslot'.format([i for _, i in unplaced]))
+    report = {"decomposition":dict(values,Runtime=time.time()-start_time,Unplaced=len(unplaced)),"unplaced":unplaced}
+    if compare:
+        start_time = time.time()
+        report["monolithic"] = dict(monolithic(instance,weight1,weight2,weight3,timelimit),Runtime=time.time()-start_time)
+        best = report["monolithic"]["Objective"]
+        report["gap"] = (best-values["Objective"])/max(abs(best),1e-9)
+        print('Monolithic --> {:.1f} seconds elapsed, Objective {:.2f}; decomposition gap {:.2%}'.format(
+            report["monolithic"]["Runtime"],best,report["gap"]))
+    return report
+
+
+if __name__=='__main__':
+    import sys, os
+    import optimize as opt
+    args = sys.argv[1:]
+    compare = bool(args) and args[-1] == 'compare'
+    if compare:
+        args = args[:-1]
+    if len(args) not in (2,5,6):
+        print('Correct syntax: python decompose.py inputFile outputFile weight1(optional) weight2(optional) weight3(optional) processes(optional) compare(optional)')
+    elif not os.path.exists(args[0]):
+        print(f'File "{args[0]}" not found!')
+    else:
+        weights = [float(weight) for weight in args[2:5]]
+        processes = int(args[5]) if len(args)==6 else 1
+        report = decompose(opt.load_instance(args[0]),args[1],*weights,processes=processes,compare=compare)
+        print(f'Results in "{args[1]}"' if not report["unplaced"] else f'Incomplete results in "{args[1]}", {len(report["unplaced"])} sections unplaced')
@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+'''Synthetic input workbooks in the schema optimize() reads.
+
+The workbook has the sheets Timeslots_G, Timeslots_UG, Classrooms_G, Classrooms_UG
+and Sections, laid out like the real ones:
+    - timeslots: one grid per level, with the given weekdays and number of start
+      times per day. Start times are a step apart (2 hours undergraduate, 1.5 hours
+      graduate); when the last double-length slot would end after 22:00 the step is
+      halved, down to 15 minutes, so back-to-back slots remain. Each start time has a two-day Full Semester slot (MW, TH;
+      timepart A) and, per weekday and session, a single-length slot (C, D, E) and a
+      double-length slot (B, F, G). The lengths are those of preprocess()
+      (undergraduate 2 and 4 hours, graduate 1.5 and 3 hours).
+    - classrooms: rooms per level with capacities drawn from capacities; the first
+      room always has the largest capacity so every section fits somewhere
+    - sections: level, units, session, seats_offered and instructors. Every instructor
+      teaches about load sections; a share cross of the instructors teach at both
+      levels, the others at one; a share coinstructor of the sections get a second
+      instructor.
+The same arguments and seed always give the same workbook.
+
+    python generate.py outputFile sections rooms(optional) starts(optional) seed(optional) load(optional) cross(optional) coinstructor(optional)'''
+
+import random
+from datetime import time
+import pandas as pd
+
+LEVELS = {"UG":{"start":8*60,"step":120,"single":120,"double":240,"units":(2,4),"prefix":"JKP"},
+          "G":{"start":8*60,"step":90,"single":90,"double":180,"units":(1.5,3),"prefix":"HOH"}}
+SESSIONS = ["Full Semester","First Half","Second Half"]
+SEATS = [20,25,35,45,60]
+CAPACITIES = [30,40,60,80]
+# Every timeslot ends by 22:00
+DAY_END = 22*60
+
+
+def clock(minutes):
+    return time(int(minutes//60),int(minutes%60))
+
+
+def step(level,starts):
+    '''Minutes between the start times of a level, halved until the last double-length slot ends by DAY_END'''
+    spec = LEVELS[level]
+    minutes = spec["step"]
+    while starts > 1 and spec["start"]+(starts-1)*minutes+spec["double"] > DAY_END:
+        if minutes % 2 or minutes//2 < 15:
+            raise ValueError('{} start times do not fit in a {} day: at most {} end by {}'.format(
+                starts,level,(DAY_END-spec["start"]-spec["double"])//minutes+1,'{:%H:%M}'.format(clock(DAY_END))))
+        minutes //= 2
+    return minutes
+
+
+def timeslots(level,starts=6,days="MTWHF"):
+    '''Timeslot grid of one level'''
+    spec = LEVELS[level]
+    minutes = step(level,starts)
+    rows = []
+    for n in range(starts):
+        start = spec["start"] + n*minutes
+        for day in [day for day in ["MW","TH"] if set(day) <= set(days)]:
+            rows.append([f'{day} {start}',day,"Full Semester",clock(start),clock(start+spec["single"])])
+        for day in days:
+            for session in SESSIONS:
+                rows.append([f'{day} {start} {session}',day,session,clock(start),clock(start+spec["single"])])
+                rows.append([f'{day} {start}L {session}',day,session,clock(start),clock(start+spec["double"])])
+    frame = pd.DataFrame(rows,columns=["Timeslots","Day","Session","StartTime","EndTime"])
+    frame.index = pd.RangeIndex(1,len(rows)+1,name="slot")
+    return frame
+
+
+def classrooms(level,rooms,rnd,capacities=CAPACITIES):
+    capacity = [max(capacities)] + [rnd.choice(capacities) for _ in range(rooms-1)]
+    index = pd.Index([f'{LEVELS[level]["prefix"]}{100+n}' for n in range(rooms)],name="room")
+    return pd.DataFrame({"Capacity":capacity},index=index)
+
+
+def sections(count,rnd,load=3,cross=0.1,coinstructor=0.1,undergrad=0.6,seats=SEATS):
+    '''Sections table; instructors are dealt out round robin per level so loads stay even'''
+    professors = ['Prof{}'.format(n) for n in range(max(2,round(count/load)))]
+    rnd.shuffle(professors)
+    ncross = round(cross*len(professors))
+    nug = round(undergrad*(len(professors)-ncross))
+    teaching = {"UG":professors[:ncross+nug] or professors,"G":professors[:ncross]+professors[ncross+nug:] or professors}
+    dealt = {"UG":0,"G":0}
+    rows = []
+    for n in range(count):
+        level = "UG" if rnd.random() < undergrad else "G"
+        single, double = LEVELS[level]["units"]
+        units = rnd.choice([single,double])
+        session = 0 if units == double else rnd.choice([0,1,2])
+        first = teaching[level][dealt[level] % len(teaching[level])]
+        dealt[level] += 1
+        second = float('nan')
+        # At least one section has a second instructor, as in the real catalogs
+        if rnd.random() < coinstructor or n == count-1:
+            second = rnd.choice([k for k in teaching[level] if k != first] or professors)
+        rows.append([10000+n,f'BUAD-{n}',level,units,session,rnd.choice(seats),first,second])
+    return pd.DataFrame(rows,columns=["section","course","level","units","session","seats_offered",
+                                      "first_instructor","second_instructor"]).set_index("section")
+
+
+def generate(outputFile,sections_count=200,rooms=20,starts=6,days="MTWHF",load=3,cross=0.1,coinstructor=0.1,seed=0):
+    '''Write a synthetic input workbook; rooms is the number of classrooms per level'''
+    rnd = random.Random(seed)
+    sheets = {"Timeslots_G":timeslots("G",starts,days),
+              "Timeslots_UG":timeslots("UG",starts,days),
+              "Classrooms_G":classrooms("G",rooms,rnd),
+              "Classrooms_UG":classrooms("UG",rooms,rnd),
+              "Sections":sections(sections_count,rnd,load,cross,coinstructor)}
+    with pd.ExcelWriter(outputFile,engine="openpyxl") as writer:
+        for name, frame in sheets.items():
+            frame.to_excel(writer,sheet_name=name)
+        # pandas writes datetime.time as text; store StartTime/EndTime as Excel times like the real workbooks
+        for name in ["Timeslots_G","Timeslots_UG"]:
+            sheet = writer.sheets[name]
+            for row, (start, end) in enumerate(zip(sheets[name]["StartTime"],sheets[name]["EndTime"]),start=2):
+                sheet.cell(row,5).value = start
+                sheet.cell(row,6).value = end
+    return sheets
+
+
+if __name__=='__main__':
+    import sys
+    if len(sys.argv) < 3 or len(sys.argv) > 9:
+        print('Correct syntax: python generate.py outputFile sections rooms(optional) starts(optional) seed(optional) '
+              'load(optional) cross(optional) coinstructor(optional)')
+    else:
+        counts = dict(zip(["sections_count","rooms","starts","seed"],[int(argument) for argument in sys.argv[2:6]]))
+        shares = dict(zip(["load","cross","coinstructor"],[float(argument) for argument in sys.argv[6:9]]))
+        try:
+            generate(sys.argv[1],**counts,**shares)
+            print(f'Instance in "{sys.argv[1]}"')
+        except ValueError as error:
+            print(error)
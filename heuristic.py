@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+'''Greedy constructive scheduler.
+
+Places sections one at a time on the preprocessed instance used by optimize():
+the largest sections first (they fit the fewest classrooms), then those whose
+instructors teach the most sections. Each section goes to the eligible
+(classroom, timeslot) of its timepart (IJT) that is free for the classroom and
+all of its instructors, including the cross-level conflicts, and that scores best
+on the same objective as the MIP:
+    weight1 * U_ij / N  +  weight3 * (instructors getting their first back-to-back pair)
+                        -  weight2 * (instructors reaching a third teaching day)
+Classrooms are tried from best to worst fit, and the search stops as soon as no
+smaller room can beat the best placement found.
+
+The schedule is used as a MIP start by optimize(..., start=True) and as the
+"fast mode" optimize(..., fast=True), which writes the usual output workbook
+without calling the solver:
+
+    python heuristic.py inputFile outputFile weight1(optional) weight2(optional) weight3(optional)'''
+
+import time
+from collections import defaultdict
+from gurobipy import GRB
+
+
+def slotsets(instance):
+    '''Per-level lookups on timeslot labels: overlapping slots (including the slot itself),
+    back-to-back slots, overlapping slots of the other level, and weekdays of each slot'''
+    lookups = {}
+    for level in ["ug","g"]:
+        leveldic = instance[level]
+        T = leveldic["T"]
+        overlaps = {t:{t} for t in T}
+        for a, b in leveldic["Opairs"]:
+            overlaps[T[a]].add(T[b])
+            overlaps[T[b]].add(T[a])
+        consecutive = {t:set() for t in T}
+        for a, b in leveldic["Mpairs"]:
+            consecutive[T[a]].add(T[b])
+            consecutive[T[b]].add(T[a])
+        days = {t:set() for t in T}
+        for s in instance["S"]:
+            for t in leveldic["V"][s]:
+                days[t].add(s)
+        lookups[level] = {"overlaps":overlaps,"consecutive":consecutive,"days":days,"cross":{t:set() for t in T}}
+    for ugt, gt in zip(instance["cross_conflict"]["ugindex"],instance["cross_conflict"]["gindex"]):
+        lookups["ug"]["cross"][ugt].add(gt)
+        lookups["g"]["cross"][gt].add(ugt)
+    return lookups
+
+
+def instructors(instance):
+    '''Instructors of every (level, section) and the number of sections each instructor teaches'''
+    teachers = defaultdict(list)
+    load = defaultdict(int)
+    for level in ["ug","g"]:
+        for k, sections in instance[level]["L_k"].items():
+            for i in sections:
+                teachers[level,i].append(k)
+                load[k] += 1
+    return teachers, load
+
+
+def fits(leveldic):
+    '''U_ij of every eligible (section, classroom) of a level as {section: {classroom: U_ij}}, read
+    from the table in one NumPy lookup'''
+    pairs = [(i,j) for i in leveldic["I"] for j in leveldic["J_i"][i]]
+    values = leveldic["U_ij"].values[leveldic["I"].get_indexer([i for i, _ in pairs]),
+                                     leveldic["J"].get_indexer([j for _, j in pairs])]
+    fit = {i:{} for i in leveldic["I"]}
+    for (i,j), value in zip(pairs,values.tolist()):
+        fit[i][j] = value
+    return fit
+
+
+def construct(instance,weight1=1,weight2=1,weight3=0.2):
+    '''Greedy schedule of every section. Returns the schedule {"ug": {section: (classroom, timeslot)},
+    "g": {...}} and the list of (level, section) that could not be placed anywhere.'''
+    N = instance["N"]
+    other = {"ug":"g","g":"ug"}
+    lookups = slotsets(instance)
+    teachers, load = instructors(instance)
+    fit = {level:fits(instance[level]) for level in ["ug","g"]}
+    order = []
+    for level in ["ug","g"]:
+        seats = instance[level]["classes"]["seats_offered"]
+        for i in instance[level]["I"]:
+            order.append((-seats[i],-max([load[k] for k in teachers[level,i]],default=0),len(instance[level]["T_i"][i]),level,i))
+    order.sort(key=lambda key: key[:3])
+
+    schedule = {"ug":{},"g":{}}
+    unplaced = []
+    roombusy = {level:defaultdict(set) for level in ["ug","g"]}
+    profbusy = {level:defaultdict(set) for level in ["ug","g"]}
+    profdays = defaultdict(set)
+    backtoback = set()
+    for _, _, _, level, i in order:
+        leveldic = instance[level]
+        lookup = lookups[level]
+        ks = teachers[level,i]
+        # Timeslots free for every instructor, with the pairs gained and days added; they do not depend on the classroom
+        free = []
+        for t in leveldic["T_i"][i]:
+            if any(not profbusy[level][k].isdisjoint(lookup["overlaps"][t]) or
+                   not profbusy[other[level]][k].isdisjoint(lookup["cross"][t]) for k in ks):
+                continue
+            gained = sum(1 for k in ks if k not in backtoback and not profbusy[level][k].isdisjoint(lookup["consecutive"][t]))
+            extra = sum(1 for k in ks if len(profdays[k]) < 3 <= len(profdays[k] | lookup["days"][t]))
+            free.append((t,gained,extra))
+        rooms = sorted(leveldic["J_i"][i],key=lambda j: -fit[level][i][j]) if free else []
+        bonus = weight3*len(ks)
+        best = None
+        for j in rooms:
+            base = weight1*fit[level][i][j]/N
+            if best is not None and base + bonus <= best[0]:
+                break
+            for t, gained, extra in free:
+                if not roombusy[level][j].isdisjoint(lookup["overlaps"][t]):
+                    continue
+                score = base + weight3*gained - weight2*extra
+                if best is None or score > best[0]:
+                    best = (score,j,t)
+        if best is None:
+            unplaced.append((level,i))
+            continue
+        _, j, t = best
+        schedule[level][i] = (j,t)
+        roombusy[level][j].add(t)
+        for k in ks:
+            if not profbusy[level][k].isdisjoint(lookup["consecutive"][t]):
+                backtoback.add(k)
+            profbusy[level][k].add(t)
+            profdays[k] |= lookup["days"][t]
+    return schedule, unplaced
+
+
+def evaluate(instance,schedule,weight1=1,weight2=1,weight3=0.2):
+    '''Objective, U, R and Q of a schedule, counted the same way as in the MIP'''
+    lookups = slotsets(instance)
+    teachers, _ = instructors(instance)
+    utilization = 0
+    profbusy = defaultdict(set)
+    profdays = defaultdict(set)
+    for level in ["ug","g"]:
+        leveldic = instance[level]
+        placed = list(schedule[level].items())
+        utilization += leveldic["U_ij"].values[leveldic["I"].get_indexer([i for i, _ in placed]),
+                                               leveldic["J"].get_indexer([j for _, (j,_) in placed])].sum()
+        for i, (j,t) in placed:
+            for k in teachers[level,i]:
+                profbusy[k].add((level,t))
+                profdays[k] |= lookups[level]["days"][t]
+    U = utilization/instance["N"]
+    R = sum(1 for k, busy in profbusy.items()
+            if any((level,t2) in busy for level, t in busy for t2 in lookups[level]["consecutive"][t]))
+    Q = sum(1 for days in profdays.values() if len(days) >= 3)
+    return {"Objective":weight1*U-weight2*Q+weight3*R,"U":U,"R":R,"Q":Q}
+
+
+def set_start(model,schedule):
+    '''Use a schedule as MIP start: X is 1 on the scheduled triples and 0 elsewhere.
+    Sections the schedule leaves out keep an undefined start so Gurobi can complete them.'''
+    for level in ["ug","g"]:
+        X = model[level]["X"]
+        placed = schedule[level]
+        keys = list(X.keys())
+        starts = [GRB.UNDEFINED if i not in placed else float(placed[i] == (j,t)) for (i,j,t) in keys]
+        model["mod"].setAttr('Start',[X[e] for e in keys],starts)
+
+
+def chosen_triples(schedule):
+    '''The (section, classroom, timeslot) triples of a schedule, per level'''
+    return {level:[(i,j,t) for i, (j,t) in schedule[level].items()] for level in ["ug","g"]}
+
+
+def fast(instance,outputFile,weight1=1,weight2=1,weight3=0.2,formats=None):
+    '''Fast mode: write the greedy schedule in the usual output workbook layout. The greedy pass can
+    leave sections unplaced on feasible instances; they are listed as "Unplaced" in the workbook,
+    warned about and returned with the schedule.'''
+    import optimize as opt
+    start_time = time.time()
+    schedule, unplaced = construct(instance,weight1,weight2,weight3)
+    values = evaluate(instance,schedule,weight1,weight2,weight3)
+    print('Greedy Schedule --> {:.1f} seconds elapsed, {} sections could not be placed'.format(time.time()-start_time,len(unplaced)))
+    opt.write_schedule(instance,chosen_triples(schedule),values,(weight1,weight2,weight3),outputFile,formats)
+    if unplaced:
+        print('WARNING: incomplete schedule, sections {} are unplaced; solve without fast mode for a complete schedule'.format(
+            [i for _, i in unplaced]))
+    return schedule, unplaced
+
+
+if __name__=='__main__':
+    import sys, os
+    import optimize as opt
+    if len(sys.argv)!=3 and len(sys.argv)!=6:
+        print('Correct syntax: python heuristic.py inputFile outputFile weight1(optional) weight2(optional) weight3(optional)')
+    elif not os.path.exists(sys.argv[1]):
+        print(f'File "{sys.argv[1]}" not found!')
+    else:
+        weights = [float(weight) for weight in sys.argv[3:6]]
+        schedule, unplaced = fast(opt.load_instance(sys.argv[1]),sys.argv[2],*weights)
+        print(f'Results in "{sys.argv[2]}"' if not unplaced else f'Incomplete results in "{sys.argv[2]}", {len(unplaced)} sections unplaced')
@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+'''Incremental re-optimization from a previously published schedule.
+
+The prior output workbook of optimize() ('Undergrad Schedule' and 'Grad Schedule'
+sheets) is read back and diffed against the new input workbook. A section is
+affected when
+    - it is new, or it has no classroom/timeslot in the prior schedule
+    - its prior classroom or timeslot is no longer eligible (the classroom went
+      offline or became too small for the seats, or the section's timepart changed)
+    - its instructors changed
+The neighbourhood that is re-optimized holds the affected sections and every
+section taught by one of their instructors, old or new, because their back-to-back
+classes (R) and teaching days (Q) change with them. All other sections are fixed to
+their prior classroom and timeslot (fix=True) or only warm-started from it
+(fix=False). If fixing leaves the neighbourhood without a feasible schedule, the
+model is solved again with nothing fixed.
+
+With penalty > 0, keeping a section of the neighbourhood in its prior classroom and
+timeslot earns penalty in the objective, so the solver only moves sections when the
+schedule improves by more than penalty per moved section.
+
+    python incremental.py inputFile priorFile outputFile weight1(optional) weight2(optional) weight3(optional) penalty(optional)'''
+
+import time
+import pandas as pd
+from gurobipy import GRB
+import optimize as opt
+import assembly
+import heuristic
+
+
+def _label(value):
+    '''Normalize a cell so labels read back from Excel compare equal to the input ones'''
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value).strip()
+
+
+def read_schedule(instance,priorFile):
+    '''Prior schedule {"ug": {section: (classroom, timeslot)}, "g": {...}} on the labels of the
+    new instance, with the prior instructors of each section. Rows whose classroom or
+    timeslot does not exist in the new input are left out.'''
+    sheets = pd.read_excel(priorFile,sheet_name=['Undergrad Schedule','Grad Schedule'],index_col=0)
+    prior = {"ug":{},"g":{}}
+    teachers = {"ug":{},"g":{}}
+    for level, sheet in [("ug",'Undergrad Schedule'),("g",'Grad Schedule')]:
+        leveldic = instance[level]
+        output = sheets[sheet]
+        rooms = {_label(j):j for j in leveldic["J"]}
+        slots = {tuple(_label(v) for v in row):t
+                 for t, row in zip(leveldic["T"],leveldic["timeslots"][["Timeslots","Day","Session"]].values)}
+        for i, row in output.iterrows():
+            teachers[level][i] = {_label(k) for k in row[["First Instructor","Second Instructor"]] if not pd.isna(k)}
+            if pd.isna(row["Classroom"]):
+                continue
+            j = rooms.get(_label(row["Classroom"]))
+            t = slots.get(tuple(_label(v) for v in row[["Time","Day","Session"]]))
+            if j is not None and t is not None:
+                prior[level][i] = (j,t)
+    return prior, teachers
+
+
+def neighbourhood(instance,prior,teachers):
+    '''Diff the new instance against the prior schedule. Returns the prior schedule restricted
+    to still-eligible assignments, the sections to re-optimize per level and a diff summary.'''
+    current, _ = heuristic.instructors(instance)
+    valid = {"ug":{},"g":{}}
+    affected = {"ug":set(),"g":set()}
+    diff = {"new":0,"ineligible":0,"instructors":0,"removed":0}
+    for level in ["ug","g"]:
+        leveldic = instance[level]
+        diff["removed"] += len(set(teachers[level])-set(leveldic["I"]))
+        for i in leveldic["I"]:
+            if i not in teachers[level]:
+                diff["new"] += 1
+                affected[level].add(i)
+                continue
+            if i not in prior[level] or prior[level][i][0] not in leveldic["J_i"][i] or prior[level][i][1] not in leveldic["T_i"][i]:
+                diff["ineligible"] += 1
+                affected[level].add(i)
+            else:
+                valid[level][i] = prior[level][i]
+            if {_label(k) for k in current[level,i]} != teachers[level][i]:
+                diff["instructors"] += 1
+                affected[level].add(i)
+    professors = {_label(k) for level in ["ug","g"] for i in affected[level]
+                  for k in [*current[level,i],*teachers[level].get(i,[])]}
+    free = {level:{i for i in instance[level]["I"] if i in affected[level] or
+                   any(_label(k) in professors for k in current[level,i])} for level in ["ug","g"]}
+    return valid, free, diff
+
+
+def reoptimize(inputFile,priorFile,outputFile,weight1=1,weight2=1,weight3=0.2,penalty=0,fix=True,timelimit=None):
+    '''Re-optimize only the neighbourhood of the changes between priorFile and inputFile and
+    write the new schedule to outputFile. Returns the diff summary, with the number of moved
+    sections under "moved" when a schedule was found.'''
+    start_time_original = time.time()
+    instance = opt.load_instance(inputFile)
+    prior, teachers = read_schedule(instance,priorFile)
+    valid, free, diff = neighbourhood(instance,prior,teachers)
+    diff["neighbourhood"] = sum(len(sections) for sections in free.values())
+    print('Schedule Diff --> {new} new, {removed} removed, {ineligible} with an ineligible prior assignment, '
+          '{instructors} with new instructors; {neighbourhood} sections to re-optimize'.format(**diff))
+
+    start_time = time.time()
+    model = assembly.build_model(instance,weight1,weight2,weight3)
+    mod = model["mod"]
+    heuristic.set_start(model,valid)
+    kept = []
+    for level in ["ug","g"]:
+        X = model[level]["X"]
+        for i, (j,t) in valid[level].items():
+            X[i,j,t].Obj = penalty
+            if fix and i not in free[level]:
+                kept.append(X[i,j,t])
+    mod.update()
+    print('Build Model --> {:.1f} seconds elapsed, {} of {} sections fixed'.format(time.time()-start_time,len(kept),instance["N"]))
+
+    start_time = time.time()
+    if timelimit is not None:
+        mod.setParam('TimeLimit',timelimit)
+    mod.setParam('OutputFlag',False)
+    mod.setAttr('LB',kept,[1.0]*len(kept))
+    mod.optimize()
+    if kept and mod.SolCount == 0 and mod.Status in (GRB.INFEASIBLE,GRB.INF_OR_UNBD):
+        print('No schedule with the unaffected sections fixed, re-optimizing every section')
+        mod.setAttr('LB',kept,[0.0]*len(kept))
+        mod.optimize()
+    print('Optimize --> {:.1f} seconds elapsed'.format(time.time()-start_time))
+    if mod.SolCount == 0:
+        print('No feasible schedule found, status {}'.format(mod.Status))
+        return diff
+
+    chosen = {level:[e for e, v in model[level]["X"].items() if v.X > 0.5] for level in ["ug","g"]}
+    diff["moved"] = sum(1 for level in ["ug","g"] for (i,j,t) in chosen[level] if i in valid[level] and valid[level][i] != (j,t))
+    U, R, Q = model["U"].X, round(model["R"].X), round(model["Q"].X)
+    values = {"Objective":weight1*U-weight2*Q+weight3*R,"U":U,"R":R,"Q":Q}
+    opt.write_schedule(instance,chosen,values,(weight1,weight2,weight3),outputFile)
+    print('Incremental Re-optimization Finished in {:.1f} seconds, {} sections moved'.format(time.time()-start_time_original,diff["moved"]))
+    return diff
+
+
+if __name__=='__main__':
+    import sys, os
+    if len(sys.argv) not in (4,7,8):
+        print('Correct syntax: python incremental.py inputFile priorFile outputFile weight1(optional) weight2(optional) weight3(optional) penalty(optional)')
+    elif not os.path.exists(sys.argv[1]):
+        print(f'File "{sys.argv[1]}" not found!')
+    elif not os.path.exists(sys.argv[2]):
+        print(f'File "{sys.argv[2]}" not found!')
+    else:
+        weights = [float(weight) for weight in sys.argv[4:7]]
+        penalty = float(sys.argv[7]) if len(sys.argv)==8 else 0
+        diff = reoptimize(sys.argv[1],sys.argv[2],sys.argv[3],*weights,penalty=penalty)
+        if "moved" in diff:
+            print(f'Results in "{sys.argv[3]}"')
@@ -0,0 +1,241 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+'''Large neighbourhood search around the optimize() model.
+
+The full model is first solved from the greedy schedule for a share of the budget.
+Its incumbent is then improved one neighbourhood at a time: the sections of the
+neighbourhood are freed, every other section is fixed to its classroom and timeslot
+(lower bound 1 on its X), and the model is re-optimized from the incumbent. The
+neighbourhoods are
+    - day: the sections meeting on weekday s (V[s])
+    - instructors: the sections of a cluster of instructors (L_k), grown along
+      co-taught sections up to about size sections
+    - band: the sections of one level in the classrooms of one capacity
+The kinds take turns. With processes > 1, up to processes disjoint neighbourhoods
+of one kind are re-optimized at once in a process pool, every worker holding its own
+copy of the model. The improved schedules are merged into the incumbent one at a
+time and a merge is only kept when the merged schedule has no classroom or instructor
+clash and a better objective.
+
+The search is skipped when the initial solve is optimal. It stops when the wall-clock budget (seconds, including the initial solve) is
+spent, or when every neighbourhood in a row was re-optimized to optimality without an
+improvement. The best schedule so far is written to outputFile after every improvement.
+
+    python lns.py inputFile outputFile budget(optional) processes(optional)'''
+
+import time
+import random
+from concurrent.futures import ProcessPoolExecutor
+from gurobipy import GRB
+import assembly
+import heuristic
+
+KINDS = ["day","instructors","band"]
+# Model of a worker process, built once by _initialize()
+_worker = {}
+
+
+def days(instance,schedule):
+    '''One neighbourhood per weekday: the sections with a timeslot in V[s]'''
+    neighbourhoods = []
+    for s in instance["S"]:
+        slots = {level:set(instance[level]["V"][s]) for level in ["ug","g"]}
+        free = {level:{i for i, (j,t) in schedule[level].items() if t in slots[level]} for level in ["ug","g"]}
+        neighbourhoods.append(("day "+str(s),free))
+    return neighbourhoods
+
+
+def clusters(instance,rnd,size=30):
+    '''Instructor clusters of about size sections, grown from a random instructor along co-taught sections'''
+    teachers, load = heuristic.instructors(instance)
+    colleagues = {k:set() for k in load}
+    for ks in teachers.values():
+        for k in ks:
+            colleagues[k].update(ks)
+    remaining = list(load)
+    rnd.shuffle(remaining)
+    neighbourhoods = []
+    while remaining:
+        cluster, frontier, count = set(), [remaining[0]], 0
+        while frontier and count < size:
+            k = frontier.pop(0)
+            if k in cluster:
+                continue
+            cluster.add(k)
+            count += load[k]
+            frontier.extend(sorted(colleagues[k]-cluster,key=str))
+            if not frontier and count < size:
+                # No colleague left: continue with the next unclustered instructor
+                frontier = [k for k in remaining if k not in cluster][:1]
+        remaining = [k for k in remaining if k not in cluster]
+        free = {level:{i for k in cluster for i in instance[level]["L_k"].get(k,[])} for level in ["ug","g"]}
+        neighbourhoods.append(("instructors "+",".join(sorted(map(str,cluster))),free))
+    return neighbourhoods
+
+
+def bands(instance,schedule):
+    '''One neighbourhood per level and classroom capacity: the sections in those classrooms'''
+    neighbourhoods = []
+    for level in ["ug","g"]:
+        capacity = instance[level]["classrooms"]["Capacity"]
+        for c in sorted(set(capacity)):
+            free = {"ug":set(),"g":set()}
+            free[level] = {i for i, (j,t) in schedule[level].items() if capacity[j] == c}
+            neighbourhoods.append(('{} rooms of {} seats'.format(level,c),free))
+    return neighbourhoods
+
+
+def neighbourhoods(instance,schedule,kind,rnd,size=30):
+    if kind == "day":
+        found = days(instance,schedule)
+    elif kind == "instructors":
+        found = clusters(instance,rnd,size)
+    else:
+        found = bands(instance,schedule)
+    found = [(name,free) for name, free in found if any(free.values())]
+    rnd.shuffle(found)
+    return found
+
+
+def disjoint(found,count):
+    '''Up to count neighbourhoods of found without a section in common'''
+    batch, taken = [], {"ug":set(),"g":set()}
+    for name, free in found:
+        if len(batch) == count:
+            break
+        if all(taken[level].isdisjoint(free[level]) for level in ["ug","g"]):
+            batch.append((name,free))
+            for level in ["ug","g"]:
+                taken[level] |= free[level]
+    return batch
+
+
+def clashes(instance,schedule):
+    '''Number of classroom and instructor conflicts of a schedule, with the cross-level conflicts'''
+    lookups = heuristic.slotsets(instance)
+    teachers, _ = heuristic.instructors(instance)
+    other = {"ug":"g","g":"ug"}
+    rooms = {}
+    busy = {}
+    count = 0
+    for level in ["ug","g"]:
+        for i, (j,t) in schedule[level].items():
+            count += len(rooms.setdefault((level,j),set()) & lookups[level]["overlaps"][t])
+            rooms[level,j].add(t)
+            for k in teachers[level,i]:
+                count += len(busy.setdefault((level,k),set()) & lookups[level]["overlaps"][t])
+                count += len(busy.setdefault((other[level],k),set()) & lookups[level]["cross"][t])
+                busy[level,k].add(t)
+    return count
+
+
+def subsolve(model,schedule,free,timelimit,seed=0):
+    '''Re-optimize the sections in free with every other section fixed to schedule.
+    Returns the new (classroom, timeslot) of the freed sections, the objective and the status.'''
+    import optimize as opt
+    mod = model["mod"]
+    fixed = [model[level]["X"][(i,)+schedule[level][i]] for level in ["ug","g"] for i in schedule[level] if i not in free[level]]
+    heuristic.set_start(model,schedule)
+    mod.setAttr('LB',fixed,[1.0]*len(fixed))
+    mod.setParam('TimeLimit',max(timelimit,0.1))
+    mod.setParam('Seed',seed)
+    mod.optimize()
+    mod.setAttr('LB',fixed,[0.0]*len(fixed))
+    if mod.SolCount == 0:
+        return None, None, mod.Status
+    chosen = opt.solution_triples(model)
+    moved = {level:{i:(j,t) for (i,j,t) in chosen[level] if i in free[level]} for level in ["ug","g"]}
+    return moved, mod.ObjVal, mod.Status
+
+
+def _initialize(instance,weights,cliques):
+    _worker["model"] = assembly.build_model(instance,*weights,cliques)
+    _worker["model"]["mod"].setParam('OutputFlag',False)
+    _worker["model"]["mod"].setParam('Threads',1)
+
+
+def _subsolve(task):
+    name, schedule, free, timelimit, seed = task
+    return (name,)+subsolve(_worker["model"],schedule,free,timelimit,seed)
+
+
+def lns(instance,outputFile,weight1=1,weight2=1,weight3=0.2,budget=600,processes=1,share=0.2,subtime=10,size=30,
+        cliques=True,seed=0,formats=None):
+    '''LNS within budget seconds; writes the best schedule to outputFile after every improvement.
+    Returns the best schedule, its Objective/U/R/Q and the history of improvements, whose first entry
+    holds the status of the initial solve. Without a schedule from the initial solve nothing is
+    written and the schedule and values are None.'''
+    import optimize as opt
+    start_time = time.time()
+    deadline = start_time+budget
+    weights = (weight1,weight2,weight3)
+    rnd = random.Random(seed)
+
+    model = assembly.build_model(instance,*weights,cliques)
+    mod = model["mod"]
+    schedule, unplaced = heuristic.construct(instance,*weights)
+    heuristic.set_start(model,schedule)
+    mod.setParam('OutputFlag',False)
+    mod.setParam('TimeLimit',max(share*budget,1))
+    mod.optimize()
+    if mod.SolCount == 0:
+        print('No feasible schedule found by the initial solve, status {}'.format(mod.Status))
+        return None, None, [{"time":time.time()-start_time,"neighbourhood":"initial","status":mod.Status}]
+    current = {level:{i:(j,t) for (i,j,t) in triples} for level, triples in opt.solution_triples(model).items()}
+    values = heuristic.evaluate(instance,current,*weights)
+    history = [{"time":time.time()-start_time,"neighbourhood":"initial","objective":values["Objective"],"status":mod.Status}]
+    opt.write_schedule(instance,heuristic.chosen_triples(current),values,weights,outputFile,formats)
+    print('Initial Solve --> {:.1f} seconds elapsed, Objective {:.2f}, bound {:.2f}'.format(time.time()-start_time,values["Objective"],mod.ObjBound))
+    if mod.Status == GRB.OPTIMAL:
+        return current, values, history
+
+    pool = ProcessPoolExecutor(processes,initializer=_initialize,initargs=(instance,weights,cliques)) if processes > 1 else None
+    if pool is None:
+        _worker["model"] = model
+    total = {kind:len(neighbourhoods(instance,current,kind,rnd,size)) for kind in KINDS}
+    stale, turn, iterations = 0, 0, 0
+    try:
+        while time.time() < deadline and stale < sum(total.values()):
+            kind = KINDS[turn % len(KINDS)]
+            turn += 1
+            batch = disjoint(neighbourhoods(instance,current,kind,rnd,size),processes)
+            timelimit = min(subtime,deadline-time.time())
+            tasks = [(name,current,free,timelimit,rnd.randrange(2**30)) for name, free in batch]
+            results = list(pool.map(_subsolve,tasks)) if pool is not None else [_subsolve(task) for task in tasks]
+            iterations += len(tasks)
+            improved = False
+            for name, moved, objective, status in sorted(results,key=lambda result: -(result[2] or -float('inf'))):
+                if moved is None or objective <= values["Objective"]+1e-6:
+                    stale += status == GRB.OPTIMAL
+                    continue
+                merged = {level:{**current[level],**moved[level]} for level in ["ug","g"]}
+                candidate = heuristic.evaluate(instance,merged,*weights)
+                if candidate["Objective"] <= values["Objective"]+1e-6 or clashes(instance,merged):
+                    continue
+                current, values, improved, stale = merged, candidate, True, 0
+                history.append({"time":time.time()-start_time,"neighbourhood":name,"objective":values["Objective"]})
+                print('LNS --> {:.1f} seconds elapsed, Objective {:.2f} ({})'.format(time.time()-start_time,values["Objective"],name))
+            if improved:
+                opt.write_schedule(instance,heuristic.chosen_triples(current),values,weights,outputFile,formats)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    print('LNS Finished in {:.1f} seconds, {} sub-solves, {} improvements, Objective {:.2f} (U {:.2f}, R {}, Q {})'.format(
+        time.time()-start_time,iterations,len(history)-1,values["Objective"],values["U"],values["R"],values["Q"]))
+    return current, values, history
+
+
+if __name__=='__main__':
+    import sys, os
+    import optimize as opt
+    if len(sys.argv) < 3 or len(sys.argv) > 5:
+        print('Correct syntax: python lns.py inputFile outputFile budget(optional) processes(optional)')
+    elif not os.path.exists(sys.argv[1]):
+        print(f'File "{sys.argv[1]}" not found!')
+    else:
+        budget = float(sys.argv[3]) if len(sys.argv) >= 4 else 600
+        processes = int(sys.argv[4]) if len(sys.argv) == 5 else 1
+        schedule, values, history = lns(opt.load_instance(sys.argv[1]),sys.argv[2],budget=budget,processes=processes)
+        if schedule is not None:
+            print(f'Results in "{sys.argv[2]}"')
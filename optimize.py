@@ -4,16 +4,30 @@
 # In[ ]:
 
 
-from gurobipy import Model, GRB
+from gurobipy import Model, GRB, quicksum
 import pandas as pd
 import numpy as np
 import time
-import itertools as it
+import os
+import io
+import pickle
+import platform
+import hashlib
 from datetime import datetime, date
+import conflicts
+import assembly
+import heuristic
+import decompose
+import profiling
+import roomtypes
+import lns as search
+import partition as partitioning
+import screen as screening
 
 '''Function which takes in two input arguments:
     - inputFile: the path to the input data. (.xlsx format)
-    - outputFile: the path to the output data. (.xlsx format)
+    - outputFile: the path to the output data. (.xlsx format, or .csv/.parquet
+      for one file per output sheet)
     - weight1, weight2, weight3:  weight assigned to the three 
       evaluation metrics: average classroom utilization rate, 
       the number of professors who are allocated at least one back-to-back class 
@@ -28,12 +42,30 @@ from datetime import datetime, date
 '''The Following Coding is Composed of 2 Major Parts, Input Data
     Preperation and Gurobi Coding'''
 
-def optimize(inputFile,outputFile,weight1=1,weight2=1,weight3=0.2):
+def slotpairs(left,right,pairs,names):
+    '''Label integer timeslot pairs with their index, Timeslots, Day and Session'''
+    first, second = names
+    frame = pd.DataFrame({first:left.index.values[pairs[:,0]],second:right.index.values[pairs[:,1]]})
+    for name, slots, position in [(first,left,pairs[:,0]),(second,right,pairs[:,1])]:
+        prefix = name.replace("index","")
+        frame[prefix+"_time"] = slots["Timeslots"].values[position]
+        frame[prefix+"_day"] = slots["Day"].values[position]
+        frame[prefix+"_session"] = slots["Session"].values[position]
+    return frame
+
+# Bump whenever preprocess() changes what it stores in the instance, so cached instances are rebuilt
+PREPROCESS_VERSION = 2
+
+def preprocess(inputFile,profile=None):
+    '''PART 1: read the input workbook and prepare every set and parameter of the formulation.
+    Returns the instance dictionary used by the model builders. With a profile (see profiling.py)
+    the wall time, CPU time and memory of every step are recorded in it.'''
     # PART 1 [INPUT DATA PREPERATION] 
     
     # 1.0 Create 2 dictionaries for undergraduate and graduate to query input speperately
     print('Preprocess Data Input')
     start_time = time.time()
+    phase_start = profiling.mark()
     ug = {}
     g = {}
     level = ["ug","g"]
@@ -41,13 +73,17 @@ def optimize(inputFile,outputFile,weight1=1,weight2=1,weight3=0.2):
     ug["level"] = "ug"
     g["level"] = "g"
 
-    # 1.0 Read Input from the InputFile
-    g["timeslots"]=pd.read_excel(inputFile,sheet_name='Timeslots_G',index_col=0)
-    ug["timeslots"]=pd.read_excel(inputFile,sheet_name='Timeslots_UG',index_col=0)
-    g["classrooms"]=pd.read_excel(inputFile,sheet_name='Classrooms_G',index_col=0)
-    ug["classrooms"]=pd.read_excel(inputFile,sheet_name='Classrooms_UG',index_col=0)
-    Classes=pd.read_excel(inputFile,sheet_name='Sections',index_col=0)
+    # 1.0 Read Input from the InputFile (all five sheets in a single pass over the workbook)
+    sheets = pd.read_excel(inputFile,sheet_name=['Timeslots_G','Timeslots_UG','Classrooms_G','Classrooms_UG','Sections'],index_col=0)
+    g["timeslots"]=sheets['Timeslots_G']
+    ug["timeslots"]=sheets['Timeslots_UG']
+    g["classrooms"]=sheets['Classrooms_G']
+    ug["classrooms"]=sheets['Classrooms_UG']
+    Classes=sheets['Sections']
     
+    profiling.record(profile,"Ingestion",phase_start)
+    phase_start = profiling.mark()
+
     # 1.1 Prepare Timeslots (T) and (A-G)
     # 1.1.1 Prepare Timeslots (T)
     ug["T"] = ug["timeslots"].index
@@ -89,142 +125,45 @@ def optimize(inputFile,outputFile,weight1=1,weight2=1,weight3=0.2):
             temp = leveldic["timeslots"]
             leveldic[timepart] = list(temp.loc[temp.Timepart == timepart].index)
     
+    profiling.record(profile,"Timepart labeling",phase_start)
+    phase_start = profiling.mark()
+
     # 1.2 Prepare Time Conflicts (O)
     # 1.2.1 Create within-level conflicts (i.e. conflicts either between ug and ug timeslots or g and g timeslots)
     for leveldic in leveldics:
-        leveldic["conflicts"] = []
-        tempcombos = list(it.combinations(leveldic["T"], 2))
-        for combo in tempcombos:
-            t1 = combo[0]
-            t2 = combo[1]
-            t1_start = leveldic["timeslots"].loc[t1,"StartTime"]
-            t1_end = leveldic["timeslots"].loc[t1,"EndTime"]
-            t2_start = leveldic["timeslots"].loc[t2,"StartTime"]
-            t2_end = leveldic["timeslots"].loc[t2,"EndTime"]
-            t1_day = leveldic["timeslots"].loc[t1,"Day"]
-            t2_day = leveldic["timeslots"].loc[t2,"Day"]
-            t1_time = leveldic["timeslots"].loc[t1,"Timeslots"]
-            t2_time = leveldic["timeslots"].loc[t2,"Timeslots"]
-            t1_session = leveldic["timeslots"].loc[t1,"Session"]
-            t2_session = leveldic["timeslots"].loc[t2,"Session"]
-            if \
-            (t1_start == t2_start or t1_end == t2_end or \
-             (t1_start > t2_start and t1_start < t2_end) or \
-             (t2_start > t1_start and t2_start < t1_end) or \
-             (t1_end > t2_start and t1_end < t2_end) or \
-             (t2_end > t1_start and t2_end < t1_end)) and \
-            (t1_day == t2_day or t1_day == t2_day[0] or t1_day == t2_day[-1] or t1_day[0] == t2_day or t1_day[-1] == t2_day) and \
-            (t1_session == t2_session or\
-             (t1_session == "Full Semester" and t2_session == "First Half")or\
-             (t1_session == "Full Semester" and t2_session == "Second Half")or\
-             (t1_session == "First Half" and t2_session == "Full Semester")or\
-             (t1_session == "Second Half" and t2_session == "Full Semester")):
-                leveldic["conflicts"].append([t1,t2,t1_time,t2_time,t1_day,t2_day,t1_session,t2_session])
-        leveldic["conflicts"] = pd.DataFrame(leveldic["conflicts"])
-        leveldic["conflicts"].columns = ["t1","t2","t1_time","t2_time","t1_day","t2_day","t1_session","t2_session"]
-    ug["O"] = []
-    g["O"] = []
-    for leveldic in leveldics:
-        tempframe = leveldic["conflicts"]
-        for i in tempframe.index:
-            t1 = tempframe.loc[i,"t1"]
-            t2 = tempframe.loc[i,"t2"]
-            templist = [t1,t2]
-            leveldic["O"].append(templist)
+        leveldic["slotcode"] = conflicts.encode_timeslots(leveldic["timeslots"])
+        leveldic["Opairs"] = pairs = conflicts.overlap_pairs(leveldic["slotcode"])
+        leveldic["conflicts"] = slotpairs(leveldic["timeslots"],leveldic["timeslots"],pairs,["t1","t2"])
+        leveldic["O"] = leveldic["conflicts"][["t1","t2"]].values.tolist()
     
     # 1.2.2 Create Cross-level Conflicts (conflicts between ug timeslots and g timeslots)
-    gtemp = g["timeslots"].copy()
-    ugtemp = ug["timeslots"].copy()
-    conflict = []
-    for ugindex in ugtemp.index:
-        for gindex in gtemp.index:
-            ug_start = ugtemp.loc[ugindex,"StartTime"]
-            ug_end = ugtemp.loc[ugindex,"EndTime"]
-            g_start = gtemp.loc[gindex,"StartTime"]
-            g_end = gtemp.loc[gindex,"EndTime"]
-            ug_day = ugtemp.loc[ugindex,"Day"]
-            g_day = gtemp.loc[gindex,"Day"]
-            ug_time = ugtemp.loc[ugindex,"Timeslots"]
-            g_time = gtemp.loc[gindex,"Timeslots"]
-            ug_session = ugtemp.loc[ugindex,"Session"]
-            g_session = gtemp.loc[gindex,"Session"]
-            if \
-            (ug_start == g_start or ug_end == g_end or \
-             (ug_start > g_start and ug_start < g_end) or \
-             (g_start > ug_start and g_start < ug_end) or \
-             (ug_end > g_start and ug_end < g_end) or \
-             (g_end > ug_start and g_end < ug_end)) and \
-            (ug_day == g_day or ug_day == g_day[0] or ug_day == g_day[-1] or ug_day[0] == g_day or ug_day[-1] == g_day) and \
-            ((ug_session == g_session)or\
-             (ug_session == "Full Semester" and g_session == "First Half")or\
-             (ug_session == "Full Semester" and g_session == "Second Half")or\
-             (ug_session == "First Half" and g_session == "Full Semester")or\
-             (ug_session == "Second Half" and g_session == "Full Semester")):
-                conflict.append([ugindex,gindex,ug_time,g_time,ug_session,g_session])
-    cross_conflict =  pd.DataFrame(conflict, columns=["ugindex","gindex","ugtime","gtime","ugsession","gsession"])
+    crosspairs = conflicts.overlap_pairs(ug["slotcode"],g["slotcode"])
+    cross_conflict = slotpairs(ug["timeslots"],g["timeslots"],crosspairs,["ugindex","gindex"])
+
+    # 1.2.3 Group conflicting timeslots into maximal cliques: a classroom holds at most one class per
+    # within-level clique, and a professor teaches at most one class per cross-level clique
+    for leveldic in leveldics:
+        leveldic["cliques"] = [list(leveldic["T"][c]) for c in conflicts.maximal_cliques(len(leveldic["T"]),leveldic["Opairs"])]
+    nug = len(ug["T"])
+    tempcliques = conflicts.maximal_cliques(nug+len(g["T"]),np.concatenate([ug["Opairs"],g["Opairs"]+nug,crosspairs+[0,nug]]))
+    cross_cliques = [([ug["T"][c] for c in clique if c < nug],[g["T"][c-nug] for c in clique if c >= nug]) for clique in tempcliques]
     
     # 1.3 Prepare Consecutive Timeslots (M)
     # 1.3.1 Within-Lvel Consecutive Timeslots
     for leveldic in leveldics:
-        leveldic["M"] = []
-        tempcombos = list(it.combinations(leveldic["T"], 2))
-        for combo in tempcombos:
-            t1 = combo[0]
-            t2 = combo[1]
-            t1_start = leveldic["timeslots"].loc[t1,"StartTime"]
-            t1_end = leveldic["timeslots"].loc[t1,"EndTime"]
-            t2_start = leveldic["timeslots"].loc[t2,"StartTime"]
-            t2_end = leveldic["timeslots"].loc[t2,"EndTime"]
-            t1_day = leveldic["timeslots"].loc[t1,"Day"]
-            t2_day = leveldic["timeslots"].loc[t2,"Day"]
-            t1_time = leveldic["timeslots"].loc[t1,"Timeslots"]
-            t2_time = leveldic["timeslots"].loc[t2,"Timeslots"]
-            t1_session = leveldic["timeslots"].loc[t1,"Session"]
-            t2_session = leveldic["timeslots"].loc[t2,"Session"]
-            if \
-            (t1_start == t2_end or t1_end == t2_start) and \
-            (t1_day == t2_day or t1_day == t2_day[0] or t1_day == t2_day[-1] or t1_day[0] == t2_day or t1_day[-1] == t2_day) and \
-            (t1_session == t2_session or\
-             (t1_session == "Full Semester" and t2_session == "First Half")or\
-             (t1_session == "Full Semester" and t2_session == "Second Half")or\
-             (t1_session == "First Half" and t2_session == "Full Semester")or\
-             (t1_session == "Second Half" and t2_session == "Full Semester")):
-                leveldic["M"].append([t1,t2,t1_time,t2_time,t1_day,t2_day,t1_session,t2_session])
-        leveldic["M"] = pd.DataFrame(leveldic["M"])
-        leveldic["M"].columns = ["t1","t2","t1_time","t2_time","t1_day","t2_day","t1_session","t2_session"]
+        leveldic["Mpairs"] = pairs = conflicts.consecutive_pairs(leveldic["slotcode"])
+        leveldic["M"] = slotpairs(leveldic["timeslots"],leveldic["timeslots"],pairs,["t1","t2"])
         leveldic["M"]["t1"] = leveldic["M"]["t1"].astype(str)
         leveldic["M"]["t2"] = leveldic["M"]["t2"].astype(str)
         leveldic["M"]["t1_t2"] = leveldic["M"]["t1"] + '-' + leveldic["M"]["t2"]
 
-    # 1.3.2 Cross-Level Consecutive Timeslots
-    ug_g_consecutive = []
-    for ugindex in ugtemp.index:
-        for gindex in gtemp.index:
-            ug_start = ugtemp.loc[ugindex,"StartTime"]
-            ug_end = ugtemp.loc[ugindex,"EndTime"]
-            g_start = gtemp.loc[gindex,"StartTime"]
-            g_end = gtemp.loc[gindex,"EndTime"]
-            ug_day = ugtemp.loc[ugindex,"Day"]
-            g_day = gtemp.loc[gindex,"Day"]
-            ug_time = ugtemp.loc[ugindex,"Timeslots"]
-            g_time = gtemp.loc[gindex,"Timeslots"]
-            ug_session = ugtemp.loc[ugindex,"Session"]
-            g_session = gtemp.loc[gindex,"Session"]
-            duration_1 = datetime.combine(date.today(), ug_start) - datetime.combine(date.today(), g_end)
-            duration_1 = duration_1.total_seconds()/60
-            duration_2 = datetime.combine(date.today(), g_start) - datetime.combine(date.today(), ug_end)
-            duration_2 = duration_2.total_seconds()/60
-            if \
-            ((duration_1 < 30 and duration_1>=0) or (duration_2 < 30 and duration_2>=0)) and \
-            (ug_day == g_day or ug_day == g_day[0] or ug_day == g_day[-1] or ug_day[0] == g_day or ug_day[-1] == g_day) and \
-            ((ug_session == g_session)or\
-             (ug_session == "Full Semester" and g_session == "First Half")or\
-             (ug_session == "Full Semester" and g_session == "Second Half")or\
-             (ug_session == "First Half" and g_session == "Full Semester")or\
-             (ug_session == "Second Half" and g_session == "Full Semester")):
-                ug_g_consecutive.append([ugindex,gindex,ug_time,g_time,ug_session,g_session])
-    ug_g_consecutive =  pd.DataFrame(ug_g_consecutive, columns=["ugindex","gindex","ugtime","gtime","ugsession","gsession"])
+    # 1.3.2 Cross-Level Consecutive Timeslots (less than 30 minutes apart)
+    pairs = conflicts.consecutive_pairs(ug["slotcode"],g["slotcode"],max_break=30)
+    ug_g_consecutive = slotpairs(ug["timeslots"],g["timeslots"],pairs,["ugindex","gindex"])
     
+    profiling.record(profile,"Conflict sets",phase_start)
+    phase_start = profiling.mark()
+
     # 1.4 Prepare Classes (I) and Classes Partitions (a/b/c/d)
     g["classes"] = Classes[Classes.level == "G"] 
     ug["classes"] = Classes[Classes.level == "UG"] 
@@ -244,65 +183,128 @@ def optimize(inputFile,outputFile,weight1=1,weight2=1,weight3=0.2):
     ug["J"]=ug["classrooms"].index
     
     # 1.6 Prepare Professors(K) and (𝐿𝑘)
-    temp1 = list(Classes["first_instructor"].unique())
-    temp2 = list(Classes["second_instructor"].unique())
-    temp2.remove(np.nan)
-    ug["K"] = np.unique(np.array(temp1+temp2))
-    g["K"] = np.unique(np.array(temp1+temp2))
-    ug["L_k"] = {}
-    g["L_k"] = {}
+    # One (section, instructor) row per first and second instructor, grouped once per level in section order
+    # Empty instructor cells are not instructors; a catalog may have no empty second_instructor at all
+    temp = pd.concat([Classes["first_instructor"],Classes["second_instructor"]]).dropna()
+    ug["K"] = np.unique(np.array(list(temp.unique())))
+    g["K"] = np.unique(np.array(list(temp.unique())))
     for leveldic in leveldics:
-        for k in leveldic["K"]:
-            tempframe = leveldic["classes"].reset_index()
-            condition = (tempframe.first_instructor == k)|(tempframe.second_instructor == k)
-            templist = tempframe.loc[condition,"section"].to_list()
-            leveldic["L_k"][k] = templist
+        tempclass = leveldic["classes"]
+        teaching = pd.DataFrame({"section":np.tile(tempclass.index.values,2),
+                                 "position":np.tile(np.arange(len(tempclass)),2),
+                                 "instructor":np.concatenate([tempclass["first_instructor"].values,tempclass["second_instructor"].values])})
+        teaching = teaching.dropna(subset=["instructor"]).drop_duplicates(["section","instructor"]).sort_values("position",kind="stable")
+        grouped = teaching.groupby("instructor",sort=False)["section"].agg(list).to_dict()
+        leveldic["L_k"] = {k:grouped.get(k,[]) for k in leveldic["K"]}
     
+    profiling.record(profile,"Classes, classrooms and professors",phase_start)
+    phase_start = profiling.mark()
+
     # 1.7 Prepare Utilization Rate (𝑈𝑖𝑗), Capacity Fit (𝑧𝑖𝑗) and Total Number of Classes (N)
+    # Broadcast seats (sections) against capacities (classrooms) into one section x classroom matrix
     for leveldic in leveldics:
-        leveldic["U_ij"] = pd.DataFrame(0,columns = leveldic["J"], index = leveldic["I"])
-        leveldic["Z_ij"] = pd.DataFrame(0,columns = leveldic["J"], index = leveldic["I"])
-        tempclass = leveldic["classes"]
-        temproom = leveldic["classrooms"]
-        for section in leveldic["I"]:
-            for room in leveldic["J"]:
-                seats = tempclass.loc[section,"seats_offered"]
-                capacity = temproom.loc[room,"Capacity"]
-                if seats <= capacity:
-                    leveldic["U_ij"].loc[section,room] = seats/capacity*100
-                    leveldic["Z_ij"].loc[section,room] = 1
+        seats = leveldic["classes"]["seats_offered"].values.astype(float)[:,None]
+        capacity = leveldic["classrooms"]["Capacity"].values.astype(float)[None,:]
+        fit = seats <= capacity
+        leveldic["U_ij"] = pd.DataFrame(np.where(fit,seats/capacity*100,0),columns = leveldic["J"], index = leveldic["I"])
+        leveldic["Z_ij"] = pd.DataFrame(fit.astype(int),columns = leveldic["J"], index = leveldic["I"])
     N = ug["classes"].shape[0] + g["classes"].shape[0]
     
+    profiling.record(profile,"U_ij/Z_ij",phase_start)
+    phase_start = profiling.mark()
+
     # 1.8 Define Weekdays(𝑆); Prepare Timeslots Partitioned by Weekdays (𝑉𝑠)
+    # A timeslot falls on the weekdays of the first and last letter of its Day (MW -> M and W);
+    # daymask holds them as one bit per weekday of S
     S =['M','T','W','H','F']
-    weekdays=['M','T','W','H','F']
     for leveldic in leveldics:
-        leveldic["V"] = {}
-        for weekday in S:
-            leveldic["V"][weekday]=[]
+        day = leveldic["timeslots"]["Day"].astype(str)
+        first, last = day.str[0].values, day.str[-1].values
+        leveldic["daymask"] = sum(((first == weekday)|(last == weekday)).astype(int) << n for n, weekday in enumerate(S))
+        leveldic["V"] = {weekday:list(leveldic["T"][(leveldic["daymask"] >> n) & 1 == 1]) for n, weekday in enumerate(S)}
+
+    profiling.record(profile,"Weekdays",phase_start)
+    phase_start = profiling.mark()
+
+    # 1.9 Prepare Eligible Assignments (IJT): the (section, classroom, timeslot) triples allowed by the
+    # section's timepart (Constraint 1) and by the classroom capacity (Constraint 3)
+    partitionparts = {"a":["A","B"],"b":["C"],"c":["D","F"],"d":["E","G"]}
     for leveldic in leveldics:
-        for weekday in S:
-            temp = leveldic["timeslots"]
-            for tempt in temp.index:
-                matchweekday = ((temp.loc[tempt,'Day'] == weekday) or (temp.loc[tempt,'Day'] == weekday[0]) or\
-                    (temp.loc[tempt,'Day'] == weekday[-1]) or (temp.loc[tempt,'Day'][0] == weekday) or\
-                    (temp.loc[tempt,'Day'][-1] == weekday))
-                if matchweekday:
-                    leveldic["V"][weekday].append(tempt) 
+        leveldic["T_i"] = {i:list(leveldic["T"]) for i in leveldic["I"]}
+        for partition, parts in partitionparts.items():
+            tempslots = [t for part in parts for t in leveldic[part]]
+            for i in leveldic[partition]:
+                leveldic["T_i"][i] = tempslots
+        fit = leveldic["Z_ij"].values == 1
+        leveldic["J_i"] = {i:list(leveldic["J"][row]) for i, row in zip(leveldic["I"],fit)}
+        leveldic["IJT"] = [(i,j,t) for i in leveldic["I"] for j in leveldic["J_i"][i] for t in leveldic["T_i"][i]]
+    profiling.record(profile,"Eligible assignments",phase_start)
     print('Data Preprocessing Finished --> {:.1f} minutes elapsed'.format((time.time()-start_time)/60))
     print('You input {} classes, {} undergraduate timeslots,{} graudate timeslots, {} undergraduate classrooms and {} graduate classrooms'.format(Classes.shape[0],ug["T"].shape[0],g["T"].shape[0],ug["J"].shape[0],g["J"].shape[0]))
-    
-    print('Optimization Starts')
-    # PART 2 [Gurobi Coding]
-    start_time_original = time.time()
-    
+    return {"ug":ug,"g":g,"Classes":Classes,"N":N,"S":S,"cross_conflict":cross_conflict,
+            "ug_g_consecutive":ug_g_consecutive,"cross_cliques":cross_cliques}
+
+def cache_versions():
+    '''Versions the cached instances depend on: the preprocessing code, and the Python, pandas and
+    NumPy versions that pickled its DataFrames and arrays'''
+    return 'preprocess-v{} python-{} pandas-{} numpy-{}'.format(PREPROCESS_VERSION,platform.python_version(),
+                                                                pd.__version__,np.__version__)
+
+def load_instance(inputFile,cache_dir=None,profile=None):
+    '''Return the preprocessed instance of inputFile, from the on-disk cache when possible.
+    The cache file is keyed by the SHA-256 of the workbook content and cache_versions(),
+    so editing the workbook, the preprocessing code or upgrading Python, pandas or NumPy
+    invalidates it. cache_dir defaults to .schedule_cache next to the workbook. profile is
+    passed on to preprocess().
+    The cache files are pickles and loading a pickle can run arbitrary code: only use a
+    cache_dir that nobody else can write to, and pass cache=False to optimize() otherwise.'''
+    with open(inputFile,'rb') as f:
+        content = f.read()
+    key = hashlib.sha256(content)
+    key.update(cache_versions().encode())
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(os.path.abspath(inputFile)),'.schedule_cache')
+    cacheFile = os.path.join(cache_dir,key.hexdigest()+'.pkl')
+    if os.path.exists(cacheFile):
+        start_time = time.time()
+        with profiling.phase(profile,"Load cached instance"):
+            with open(cacheFile,'rb') as f:
+                instance = pickle.load(f)
+        print('Load Preprocessed Data --> {:.1f} seconds elapsed'.format(time.time()-start_time))
+        return instance
+    instance = preprocess(io.BytesIO(content),profile)
+    os.makedirs(cache_dir,exist_ok=True)
+    tempFile = '{}.{}.tmp'.format(cacheFile,os.getpid())
+    with open(tempFile,'wb') as f:
+        pickle.dump(instance,f,protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tempFile,cacheFile)
+    return instance
+
+def build_model(instance,weight1=1,weight2=1,weight3=0.2,cliques=True,profile=None,tight=False):
+    '''PART 2.1-2.4: build the Gurobi model with LinExpr sums over the X tupledicts.
+    tight=True replaces the big-M rows linking H and Z to X in Constraints 5 and 6 by one row per
+    timeslot (larger model, see benchmark_formulations.py).
+    The level dictionaries of the returned model are copies of the instance ones extended
+    with the variables X, H and the expressions y and w, so the instance can be reused.
+    With a profile every step is recorded in it (see profiling.py).'''
+    ug = dict(instance["ug"])
+    g = dict(instance["g"])
+    leveldics = [ug,g]
+    N = instance["N"]
+    S = instance["S"]
+    cross_conflict = instance["cross_conflict"]
+    cross_cliques = instance["cross_cliques"]
+
     # 2.1 [Set Variables]
+    # X only exists for eligible triples, so Constraint 3 and the timepart part of Constraint 1 hold by construction
     start_time = time.time()
+    phase_start = profiling.mark()
     mod=Model()
+    dense = sum(len(leveldic["I"])*len(leveldic["J"])*len(leveldic["T"]) for leveldic in leveldics)
+    sparse = sum(len(leveldic["IJT"]) for leveldic in leveldics)
+    print('X has {} eligible (section, classroom, timeslot) triples out of {} ({:.1%})'.format(sparse,dense,sparse/max(dense,1)))
     for leveldic in leveldics:
-        leveldic["X"] = mod.addVars(leveldic["I"],leveldic["J"],leveldic["T"],vtype=GRB.BINARY)
-        leveldic["y"] = mod.addVars(leveldic["J"],leveldic["T"])
-        leveldic["w"] = mod.addVars(leveldic["K"],leveldic["T"])
+        leveldic["X"] = mod.addVars(leveldic["IJT"],vtype=GRB.BINARY)
         leveldic["H"] = mod.addVars(leveldic["K"],leveldic["M"]["t1_t2"],vtype=GRB.BINARY)
     U = mod.addVar(lb = 0)
     r = mod.addVars(leveldic["K"],vtype=GRB.BINARY)
@@ -310,180 +312,431 @@ def optimize(inputFile,outputFile,weight1=1,weight2=1,weight3=0.2):
     Q = mod.addVar(vtype=GRB.INTEGER, lb=0)
     Z = mod.addVars(leveldic["K"],S,vtype=GRB.BINARY)
     q = mod.addVars(leveldic["K"],vtype=GRB.BINARY)
+    # y[j,t]: classes held in classroom j at timeslot t; w[k,t]: classes professor k teaches at timeslot t
+    for leveldic in leveldics:
+        leveldic["y"] = {(j,t):leveldic["X"].sum('*',j,t) for j in leveldic["J"] for t in leveldic["T"]}
+        leveldic["w"] = {(k,t):quicksum(leveldic["X"].sum(i,'*',t) for i in leveldic["L_k"][k])
+                         for k in leveldic["K"] for t in leveldic["T"]}
     print('Set Variables --> {:.1f} minutes elapsed'.format((time.time()-start_time)/60))
+    profiling.record(profile,"Variables",phase_start)
 
     # 2.2 [Set the objective]
-    start_time = time.time() 
+    start_time = time.time()
+    phase_start = profiling.mark()
     mod.setObjective(weight1*U-weight2*Q+weight3*R,sense=GRB.MAXIMIZE)
 
     # 2.3 [Define U in the objective Function]
-    mod.addConstr(U == (sum(g["U_ij"].loc[i,j]*g["X"][i,j,t] for i in g["I"] for j in g["J"] for t in g["T"])+\
-                        sum(ug["U_ij"].loc[i,j]*ug["X"][i,j,t] for i in ug["I"] for j in ug["J"] for t in ug["T"]))/N)
+    mod.addConstr(U == quicksum(leveldic["U_ij"].loc[i,j]*leveldic["X"][i,j,t]
+                                for leveldic in leveldics for (i,j,t) in leveldic["IJT"])/N)
     print('Set Objective --> {:.1f} minutes elapsed'.format((time.time()-start_time)/60))
+    profiling.record(profile,"Objective",phase_start)
 
     # 2.4 [Add the constraints]
     # 2.4.1 [Constraint 1]
     start_time = time.time()
+    phase_start = profiling.mark()
     for leveldic in leveldics:
-        for i in leveldic["a"]:
-            A_B = leveldic["A"] + leveldic["B"]
-            mod.addConstr(sum(leveldic["X"][i,j,t] for j in leveldic["J"] for t in A_B) == 1)
-        for i in leveldic["b"]:
-            C = leveldic["C"]
-            mod.addConstr(sum(leveldic["X"][i,j,t] for j in leveldic["J"] for t in C) == 1)
-        for i in leveldic["c"]:
-            D_F = leveldic["D"] + leveldic["F"]
-            mod.addConstr(sum(leveldic["X"][i,j,t] for j in leveldic["J"] for t in D_F) == 1)
-        for i in leveldic["d"]:  
-            E_G = leveldic["E"] + leveldic["G"]
-            mod.addConstr(sum(leveldic["X"][i,j,t] for j in leveldic["J"] for t in E_G) == 1)
         for i in leveldic["I"]:
-            mod.addConstr(sum(leveldic["X"][i,j,t] for j in leveldic["J"] for t in leveldic["T"]) == 1)
+            mod.addConstr(leveldic["X"].sum(i,'*','*') == 1)
     print('Set Constraint 1 --> {:.1f} minutes elapsed'.format((time.time()-start_time)/60))
+    profiling.record(profile,"Constraint 1",phase_start)
 
     # 2.4.2 [Constraint 2]
+    # Rows without any eligible X are always satisfied and are skipped
     start_time = time.time()
+    phase_start = profiling.mark()
     for leveldic in leveldics:
-        for j in leveldic["J"]:
-            for t in leveldic["T"]:
-                mod.addConstr(sum(leveldic["X"][i,j,t] for i in leveldic["I"]) <= 1,name = f'Con2_{j}_{t}')
-    for leveldic in leveldics:
-        for j in leveldic["J"]:
-            for t in leveldic["T"]:
-                leveldic["y"][j,t] = sum(leveldic["X"][i,j,t] for i in leveldic["I"])
-        for j in leveldic["J"]:
-            for o in leveldic["O"]:
-                mod.addConstr(leveldic["y"][j,o[0]]+leveldic["y"][j,o[1]]<=1)
+        if cliques:
+            # At most one class per classroom in each within-level clique, skipping duplicate restricted cliques
+            for j in leveldic["J"]:
+                seen = set()
+                for n, clique in enumerate(leveldic["cliques"]):
+                    clique = tuple(t for t in clique if leveldic["y"][j,t].size())
+                    if clique in seen:
+                        continue
+                    seen.add(clique)
+                    tempsum = quicksum(leveldic["y"][j,t] for t in clique)
+                    if tempsum.size() > 1:
+                        mod.addConstr(tempsum <= 1,name = f'Con2_{j}_C{n}')
+        else:
+            # A single X is at most 1 by its bound, so only slots with two or more eligible X get a row
+            for j in leveldic["J"]:
+                for t in leveldic["T"]:
+                    if leveldic["y"][j,t].size() > 1:
+                        mod.addConstr(leveldic["y"][j,t] <= 1,name = f'Con2_{j}_{t}')
+            for j in leveldic["J"]:
+                for o in leveldic["O"]:
+                    if leveldic["y"][j,o[0]].size() and leveldic["y"][j,o[1]].size():
+                        mod.addConstr(leveldic["y"][j,o[0]]+leveldic["y"][j,o[1]]<=1)
     print('Set Constraint 2 --> {:.1f} minutes elapsed'.format((time.time()-start_time)/60))
+    profiling.record(profile,"Constraint 2",phase_start)
 
     # 2.4.3 [Constraint 3]
-    start_time = time.time()
-    for leveldic in leveldics:
-        for i in leveldic["I"]:
-            for j in leveldic["J"]:
-                mod.addConstr(sum(leveldic["X"][i,j,t] for t in leveldic["T"]) <= leveldic["Z_ij"].loc[i,j])
-    print('Set Constraint 3 --> {:.1f} minutes elapsed'.format((time.time()-start_time)/60))
+    # Classroom capacity is enforced by only creating X for classrooms with Z_ij == 1 (see 1.9)
 
     # 2.4.4 [Constraint 4]
     start_time = time.time()
-    # 2.4.4.1 When teaching either ug/g classes, oen professor can't be assigned to one timeslot in two different classrooms
-    for leveldic in leveldics:
-        for t in leveldic["T"]:
+    phase_start = profiling.mark()
+    if cliques:
+        # 2.4.4.1-2.4.4.3 at once: at most one class per professor in each cross-level clique.
+        # Cliques restricted to the professor's non-empty slots often coincide, so duplicates are skipped
+        for k in ug["K"]:
+            seen = set()
+            for ugslots, gslots in cross_cliques:
+                ugslots = tuple(t for t in ugslots if ug["w"][k,t].size())
+                gslots = tuple(t for t in gslots if g["w"][k,t].size())
+                if (ugslots,gslots) in seen:
+                    continue
+                seen.add((ugslots,gslots))
+                tempsum = quicksum(ug["w"][k,t] for t in ugslots) + quicksum(g["w"][k,t] for t in gslots)
+                if tempsum.size() > 1:
+                    mod.addConstr(tempsum <= 1)
+    else:
+        # 2.4.4.1 When teaching either ug/g classes, oen professor can't be assigned to one timeslot in two different classrooms
+        for leveldic in leveldics:
+            for t in leveldic["T"]:
+                for k in leveldic["K"]:
+                    if leveldic["w"][k,t].size() > 1:
+                        mod.addConstr(leveldic["w"][k,t]<= 1)
+
+        # 2.4.4.2 When teaching either ug/g classes, oen professor can't be assigned to two overlapping timeslots
+        for leveldic in leveldics:
             for k in leveldic["K"]:
-                mod.addConstr(sum(leveldic["X"][i,j,t] for i in leveldic["L_k"][k] for j in leveldic["J"])<= 1)
+                for o in leveldic["O"]:
+                    if leveldic["w"][k,o[0]].size() and leveldic["w"][k,o[1]].size():
+                        mod.addConstr(leveldic["w"][k,o[0]]+leveldic["w"][k,o[1]]<=1)
 
-    # 2.4.4.2 When teaching either ug/g classes, oen professor can't be assigned to two overlapping timeslots
-    for leveldic in leveldics:
-        for k in leveldic["K"]:
-            for t in leveldic["T"]:
-                leveldic["w"][k,t] = sum(leveldic["X"][i,j,t] for i in leveldic["L_k"][k] for j in leveldic["J"])
-        for k in leveldic["K"]:
-            for o in leveldic["O"]:
-                mod.addConstr(leveldic["w"][k,o[0]]+leveldic["w"][k,o[1]]<=1)
-
-    # 2.4.4.3 When teaching both ug/g classes, one professor can't be assigned to two overlapping timeslots (Reconcile conflict between ug/g timeslots)
-    tempcross = cross_conflict[["ugindex","gindex"]].values.tolist()
-    totK = ug["K"] #ug["K"] == g["K"] == K
-    for cross in tempcross:
-        for k in totK:
-            ugtime = cross[0]
-            gtime = cross[1]
-            mod.addConstr(sum(ug["X"][i,j,ugtime] for i in ug["L_k"][k] for j in ug["J"]) + 
-                          sum(g["X"][i,j,gtime] for i in g["L_k"][k] for j in g["J"])<=1)
+        # 2.4.4.3 When teaching both ug/g classes, one professor can't be assigned to two overlapping timeslots (Reconcile conflict between ug/g timeslots)
+        tempcross = cross_conflict[["ugindex","gindex"]].values.tolist()
+        totK = ug["K"] #ug["K"] == g["K"] == K
+        for cross in tempcross:
+            for k in totK:
+                ugtime = cross[0]
+                gtime = cross[1]
+                if ug["w"][k,ugtime].size() and g["w"][k,gtime].size():
+                    mod.addConstr(ug["w"][k,ugtime] + g["w"][k,gtime]<=1)
     print('Set Constraint 4 --> {:.1f} minutes elapsed'.format((time.time()-start_time)/60))
+    profiling.record(profile,"Constraint 4",phase_start)
 
     # 2.4.5 [Constraint 5]
+    # The pair count of professor k is bounded by min(|M|, |L_k| choose 2) per level instead of N
+    # tight: H is the AND of w[k,t1] and w[k,t2] (each at most 1 by Constraint 4)
     start_time = time.time()
+    phase_start = profiling.mark()
+    pairsbound = {k:0 for k in ug["K"]}
     for leveldic in leveldics:
-        tempcon = leveldic["M"]
         for k in leveldic["K"]:
-            for t1_t2 in tempcon["t1_t2"].to_list():
-                t1 = int(tempcon.loc[tempcon.t1_t2 == t1_t2,"t1"].values[0])
-                t2 = int(tempcon.loc[tempcon.t1_t2 == t1_t2,"t2"].values[0])
-                middlepart = (sum(leveldic["X"][i,j,t1] for i in leveldic["L_k"][k] for j in leveldic["J"]) +\
-                              sum(leveldic["X"][i,j,t2] for i in leveldic["L_k"][k] for j in leveldic["J"])+1)
-                mod.addConstr(3*leveldic["H"][k,t1_t2] <= middlepart)
-                mod.addConstr(middlepart <= N*leveldic["H"][k,t1_t2]+2)
+            for t1, t2, t1_t2 in leveldic["M"][["t1","t2","t1_t2"]].itertuples(index=False):
+                first, second = leveldic["w"][k,int(t1)], leveldic["w"][k,int(t2)]
+                # k can not teach both timeslots, e.g. without sections at this level: no rows, H is 0
+                if not first.size() or not second.size():
+                    leveldic["H"][k,t1_t2].UB = 0
+                    continue
+                if tight:
+                    mod.addConstr(leveldic["H"][k,t1_t2] <= first)
+                    mod.addConstr(leveldic["H"][k,t1_t2] <= second)
+                    mod.addConstr(first + second <= leveldic["H"][k,t1_t2] + 1)
+                else:
+                    mod.addConstr(3*leveldic["H"][k,t1_t2] <= first + second + 1)
+                    mod.addConstr(first + second + 1 <= N*leveldic["H"][k,t1_t2]+2)
+            taught = len(leveldic["L_k"][k])
+            pairsbound[k] += min(len(leveldic["M"]),taught*(taught-1)//2)
 
     for k in leveldic["K"]:
         temp = (sum(ug["H"][k,t1_t2] for t1_t2 in ug["M"]["t1_t2"].to_list()) + \
                 sum(g["H"][k,t1_t2] for t1_t2 in g["M"]["t1_t2"].to_list()))
         mod.addConstr(r[k] <= temp)
-        mod.addConstr(temp <= N*r[k])
+        mod.addConstr(temp <= pairsbound[k]*r[k])
 
     mod.addConstr(sum(r[k] for k in ug["K"])== R)
     print('Set Constraint 5 --> {:.1f} minutes elapsed'.format((time.time()-start_time)/60))
+    profiling.record(profile,"Constraint 5",phase_start)
 
     # 2.4.6 [Constraint 6]
+    # The day count of professor k is bounded by the D_k weekdays on which k can teach at all instead of N
+    # tight: Z[k,s] is at least every w[k,t] of weekday s
     start_time = time.time()
+    phase_start = profiling.mark()
+    possible = {k:0 for k in ug["K"]}
     for k in leveldic["K"]:
         for s in S:
-            tempug = sum(ug["X"][i,j,t] for i in ug["L_k"][k] for j in ug["J"] for t in ug["V"][s])
-            tempg = sum(g["X"][i,j,t] for i in g["L_k"][k] for j in g["J"] for t in g["V"][s])
+            tempug = quicksum(ug["w"][k,t] for t in ug["V"][s])
+            tempg = quicksum(g["w"][k,t] for t in g["V"][s])
             mod.addConstr(tempug + tempg >=Z[k,s])
-            mod.addConstr(tempug + tempg <=Z[k,s]*N)
+            if tight:
+                for level in leveldics:
+                    for t in level["V"][s]:
+                        if level["w"][k,t].size():
+                            mod.addConstr(level["w"][k,t] <= Z[k,s])
+            else:
+                mod.addConstr(tempug + tempg <=Z[k,s]*N)
+            possible[k] += (tempug.size() + tempg.size()) > 0
 
     for k in leveldic["K"]:
         mod.addConstr(sum(Z[k,s] for s in S)>=3*q[k])
-        mod.addConstr(sum(Z[k,s] for s in S)<=N*q[k]+2)
+        mod.addConstr(sum(Z[k,s] for s in S)<=max(possible[k]-2,0)*q[k]+2)
 
     mod.addConstr(sum(q[k] for k in ug["K"]) == Q)
     print('Set Constraint 6 --> {:.1f} minutes elapsed'.format((time.time()-start_time)/60))
+    profiling.record(profile,"Constraint 6",phase_start)
+    return {"mod":mod,"ug":ug,"g":g,"U":U,"R":R,"Q":Q,"r":r,"q":q,"Z":Z,"weights":(weight1,weight2,weight3)}
+
+def set_weights(model,weight1,weight2,weight3):
+    '''Change the weighting of U, Q and R in the objective of a built model, leaving every constraint in place'''
+    model["U"].Obj = weight1
+    model["Q"].Obj = -weight2
+    model["R"].Obj = weight3
+    model["weights"] = (weight1,weight2,weight3)
+
+# Extra output formats: one file per sheet next to the output file, e.g. schedule_undergrad.csv
+FORMATS = {"xlsx":None,"csv":"to_csv","parquet":"to_parquet"}
+
+def schedule_frame(instance,level,chosen):
+    '''The schedule sheet of one level: the chosen (section, classroom, timeslot) triples joined
+    with the classes, classrooms and timeslots tables. Sections without a triple keep their course,
+    units, seats and instructors, with "Unplaced" as classroom and empty timeslot cells.'''
+    leveldic = instance[level]
+    frame = pd.DataFrame(list(chosen),columns=["section","room","slot"])
+    frame = frame.join(leveldic["classes"],on="section").join(leveldic["classrooms"],on="room").join(leveldic["timeslots"],on="slot")
+    utilization = leveldic["U_ij"].values[leveldic["I"].get_indexer(frame["section"]),leveldic["J"].get_indexer(frame["room"])]
+    output = pd.DataFrame({"Course":frame["course"].values,
+                           "Classroom":frame["room"].values,
+                           "Time":frame["Timeslots"].values,
+                           "Session":frame["Session"].values,
+                           "Day":frame["Day"].values,
+                           "StartTime":frame["StartTime"].values,
+                           "EndTime":frame["EndTime"].values,
+                           "Units":frame["units"].values,
+                           "Seats Offered":frame["seats_offered"].values,
+                           "Classroom Capacity":frame["Capacity"].values,
+                           "Utilization Rate":utilization,
+                           "First Instructor":frame["first_instructor"].values,
+                           "Second Instructor":frame["second_instructor"].values},index=frame["section"].values)
+    output = output.reindex(leveldic["I"])
+    output.index.name = leveldic["I"].name
+    unplaced = output["Classroom"].isna().values
+    if unplaced.any():
+        classes = leveldic["classes"][unplaced]
+        for column, source in [("Course","course"),("Units","units"),("Seats Offered","seats_offered"),
+                               ("First Instructor","first_instructor"),("Second Instructor","second_instructor")]:
+            output.loc[unplaced,column] = classes[source].values
+        output.loc[unplaced,"Classroom"] = "Unplaced"
+    return output
+
+def write_schedule(instance,chosen,values,weights,outputFile,formats=None):
+    '''Write the output workbook. chosen maps each level ("ug"/"g") to the (section, classroom, timeslot)
+    triples of its schedule, values holds the Objective, U, R and Q of the schedule.
+    Sections without a triple are listed with "Unplaced" as classroom (see schedule_frame()) and
+    counted in an extra Unplaced row of the summary. Returns that count.
+    formats lists the files to write among "xlsx", "csv" and "parquet" (default: the extension of
+    outputFile). The workbook goes to outputFile, csv and parquet files get one file per sheet
+    named after outputFile, e.g. out_summary.csv, out_undergrad.csv and out_grad.csv.'''
+    weight1, weight2, weight3 = weights
+    summary = [[f"Objective","Scheduling Score, {}*U-{}*Q+{}*R".format(weight1,weight2,weight3),round(values["Objective"],2)],
+               ["U","Average Utilization Rate, in %",round(values["U"],2)],
+               ["R","# of professors with >=1 back-to-back class",round(values["R"],0)],
+               ["Q","# of professors has to work >2 days a week",values["Q"]]]
+    frames = {level:schedule_frame(instance,level,chosen[level]) for level in ["ug","g"]}
+    unplaced = sum(len(instance[level]["I"])-len({e[0] for e in chosen[level]}) for level in ["ug","g"])
+    if unplaced:
+        summary.append(["Unplaced","# of sections without a classroom and timeslot",unplaced])
+    summary = pd.DataFrame(summary)
+    summary.columns = ["Variable","Desciption","Optimal Value"]
+    sheets = {"summary":('Summary',summary,False),
+              "undergrad":('Undergrad Schedule',frames["ug"],True),
+              "grad":('Grad Schedule',frames["g"],True)}
+    base, extension = os.path.splitext(outputFile)
+    if formats is None:
+        formats = [extension.lstrip('.').lower() if extension.lstrip('.').lower() in FORMATS else "xlsx"]
+    for fmt in formats:
+        if FORMATS[fmt] is None:
+            with pd.ExcelWriter(outputFile) as writer:
+                for sheet, frame, index in sheets.values():
+                    frame.to_excel(writer,sheet_name = sheet,index=index)
+            continue
+        for name, (_, frame, index) in sheets.items():
+            getattr(frame,FORMATS[fmt])(f'{base}_{name}.{fmt}',index=index)
+    return unplaced
+
+def solution_triples(model):
+    '''The (section, classroom, timeslot) triples chosen in a solved model, per level.
+    The values of X are read in one bulk query per level and the chosen triples selected with NumPy.'''
+    chosen = {}
+    for level in ["ug","g"]:
+        X = model[level]["X"]
+        if len(X) == 0:
+            chosen[level] = []
+            continue
+        values = np.array(model["mod"].getAttr('X',list(X.values())))
+        keys = list(X.keys())
+        chosen[level] = [keys[n] for n in np.flatnonzero(values > 0.5)]
+    return chosen
 
-    # 2.5 [Optimize]
+def solution_values(model):
+    return {"Objective":model["mod"].objval,"U":model["U"].x,"R":model["R"].x,"Q":model["Q"].x}
+
+def write_solution(model,outputFile,formats=None):
+    '''PART 2.6: extract the optimal schedule of every section from the solved model and write the output workbook'''
+    write_schedule(model,solution_triples(model),solution_values(model),model["weights"],outputFile,formats)
+
+def failure(model,run,outputFile):
+    '''Status of a solved model without schedule, with the IIS when infeasible (also stored in the profile)'''
+    mod = model["mod"]
+    print('No feasible schedule found, status {}'.format(mod.Status))
+    failed = {"status":mod.Status}
+    if mod.Status in (GRB.INFEASIBLE,GRB.INF_OR_UNBD):
+        with profiling.phase(run,"IIS"):
+            failed["iis"] = screening.explain(model)
+    if run is not None:
+        run["failure"] = failed
+        run["model"] = profiling.model_stats(mod)
+        profiling.write(run,os.path.splitext(outputFile)[0]+'.profile.json')
+    return failed
+
+def optimize(inputFile,outputFile,weight1=1,weight2=1,weight3=0.2,cliques=True,builder="matrix",cache=True,
+             start=True,timelimit=None,fast=False,decomposition=False,processes=1,formats=None,profile=False,
+             aggregate_rooms=False,tight=False,lns=False,partition=False,screen=True,compare=False):
+    '''With screen=True the instance is checked for infeasibility before the model is built (see
+    screen.py) and optimize() stops with a report of the violated groups; an infeasible model that
+    passes the screening is reported through its IIS instead of a solution.
+    Returns None when a schedule was written, otherwise the violated groups of the screening or the
+    solver status (with the IIS when infeasible). With fast=True or decomposition=True a schedule that
+    leaves sections unplaced is still written, and {"unplaced": [(level, section), ...]} is returned.
+    With decomposition=True and compare=True the monolithic model is solved as well and the objective
+    gap of the decomposition is printed (and stored in the profile), see decompose.py.
+    With cache=True the preprocessed instance is kept as a pickle in .schedule_cache next to the
+    workbook (see load_instance()). Loading a pickle can run arbitrary code, so use cache=False
+    for workbooks in directories that others can write to.
+    With partition=True independent components of the instance are solved as separate models on
+    processes processes and merged (see partition.py). The sections of a level nearly always share
+    classrooms, so the split is at most into the two levels, when no instructor teaches at both.
+    When a component has no schedule nothing is written, and the status of the first such component
+    is returned with the statuses of all of them.
+    With lns=True the model is solved by large neighbourhood search (see lns.py) on processes
+    processes, within timelimit seconds (default 600); the status of the initial solve is returned
+    when it finds no schedule.
+    tight=True links H and Z to X with one row per timeslot instead of the big-M rows of Constraints 5
+    and 6; the model grows and the LP bound does not improve on the benchmarked instances (see
+    benchmark_formulations.py).
+    With aggregate_rooms=True classrooms of equal capacity are solved as room types and disaggregated
+    afterwards (see roomtypes.py; always with the matrix builder).
+    With profile=True (off by default; "profile" on the command line) the phases of the run, the
+    model statistics and the incumbent/bound trace of the solve are written as JSON next to the
+    output file (outputFile base name + .profile.json)'''
+    start_time_original = time.time()
+    run = profiling.new_profile(inputFile=inputFile,outputFile=outputFile,weights=[weight1,weight2,weight3],
+                                builder=builder,cliques=cliques,tight=tight,started=datetime.now().isoformat()) if profile else None
+    instance = load_instance(inputFile,profile=run) if cache else preprocess(inputFile,run)
+    if screen and not fast:
+        start_time = time.time()
+        with profiling.phase(run,"Screening") as counts:
+            violations = screening.screen(instance)
+            counts["violations"] = len(violations)
+        print('Feasibility Screening --> {:.1f} seconds elapsed'.format(time.time()-start_time))
+        if violations:
+            screening.report(violations)
+            if run is not None:
+                run["violations"] = violations
+                profiling.write(run,os.path.splitext(outputFile)[0]+'.profile.json')
+            return violations
+    if fast or decomposition or lns or partition:
+        result = None
+        with profiling.phase(run,"Greedy schedule" if fast else "Decomposition" if decomposition else "LNS" if lns else "Partition") as counts:
+            if fast:
+                _, unplaced = heuristic.fast(instance,outputFile,weight1,weight2,weight3,formats)
+                counts["unplaced"] = len(unplaced)
+                if unplaced:
+                    result = {"unplaced":unplaced}
+            elif lns:
+                schedule, _, history = search.lns(instance,outputFile,weight1,weight2,weight3,600 if timelimit is None else timelimit,
+                                                  processes,cliques=cliques,formats=formats)
+                if schedule is None:
+                    result = {"status":history[0]["status"]}
+            elif partition:
+                values, components = partitioning.solve(instance,outputFile,weight1,weight2,weight3,processes,timelimit,cliques,formats)
+                if values is None:
+                    statuses = [component["status"] for component in components if "chosen" not in component]
+                    result = {"status":statuses[0],"components":[component["status"] for component in components]}
+            else:
+                report = decompose.decompose(instance,outputFile,weight1,weight2,weight3,processes,timelimit,compare,formats)
+                counts["unplaced"] = len(report["unplaced"])
+                if run is not None:
+                    run["decomposition"] = {key:value for key, value in report.items() if key != "unplaced"}
+                if report["unplaced"]:
+                    result = {"unplaced":report["unplaced"]}
+        if run is not None:
+            profiling.write(run,os.path.splitext(outputFile)[0]+'.profile.json')
+        return result
+
+    print('Optimization Starts')
+    # PART 2 [Gurobi Coding]
+    start_time = time.time()
+    full = instance
+    if aggregate_rooms:
+        with profiling.phase(run,"Room types"):
+            instance = roomtypes.aggregate(full)
+    if builder == "matrix" or aggregate_rooms:
+        model = assembly.build_model(instance,weight1,weight2,weight3,cliques,profile=run,tight=tight)
+    else:
+        model = build_model(instance,weight1,weight2,weight3,cliques,profile=run,tight=tight)
+    mod = model["mod"]
+    mod.update()
+    print('Model size: {} variables, {} constraints, {} nonzeros'.format(mod.NumVars,mod.NumConstrs,mod.NumNZs))
+    print('Build Model --> {:.1f} minutes elapsed'.format((time.time()-start_time)/60))
+
+    # 2.5 [Optimize] from the greedy schedule as MIP start, within the time limit in seconds if given
     start_time = time.time()
+    if start:
+        with profiling.phase(run,"MIP start") as counts:
+            schedule, unplaced = heuristic.construct(full,weight1,weight2,weight3)
+            heuristic.set_start(model,roomtypes.typed(instance,schedule) if aggregate_rooms else schedule)
+            counts["unplaced"] = len(unplaced)
+        print('Set MIP Start --> {:.1f} seconds elapsed, {} sections could not be placed'.format(time.time()-start_time,len(unplaced)))
+    if timelimit is not None:
+        mod.setParam('TimeLimit',timelimit)
     mod.setParam('OutputFlag',False) 
-    mod.optimize()
+    with profiling.phase(run,"Solve"):
+        if run is not None:
+            mod.optimize(profiling.callback(run))
+        else:
+            mod.optimize()
     print('Optimize --> {:.1f} minutes elapsed'.format((time.time()-start_time)/60))
+    if mod.SolCount == 0:
+        return failure(model,run,outputFile)
 
     # 2.6 [Optimal solution]
     start_time = time.time()
-    for leveldic in leveldics:
-        leveldic["output"] = pd.DataFrame(index = leveldic["I"])
-        for i in leveldic["I"]:
-            for j in leveldic["J"]:
-                for t in leveldic["T"]:
-                    if leveldic["X"][i,j,t].x:
-                        leveldic["output"].loc[i,"Course"] = leveldic["classes"].loc[i,"course"]
-                        leveldic["output"].loc[i,"Classroom"] = j
-                        leveldic["output"].loc[i,"Time"] = leveldic["timeslots"].loc[t,"Timeslots"]
-                        leveldic["output"].loc[i,"Session"] = leveldic["timeslots"].loc[t,"Session"]
-                        leveldic["output"].loc[i,"Day"] = leveldic["timeslots"].loc[t,"Day"]
-                        leveldic["output"].loc[i,"StartTime"] = leveldic["timeslots"].loc[t,"StartTime"]
-                        leveldic["output"].loc[i,"EndTime"] = leveldic["timeslots"].loc[t,"EndTime"]
-                        leveldic["output"].loc[i,"Units"] = leveldic["classes"].loc[i,"units"]
-                        leveldic["output"].loc[i,"Seats Offered"] = leveldic["classes"].loc[i,"seats_offered"]
-                        leveldic["output"].loc[i,"Classroom Capacity"] = leveldic["classrooms"].loc[j,"Capacity"]
-                        leveldic["output"].loc[i,"Utilization Rate"] = leveldic["U_ij"].loc[i,j]
-                        leveldic["output"].loc[i,"First Instructor"] = leveldic["classes"].loc[i,"first_instructor"]
-                        leveldic["output"].loc[i,"Second Instructor"] = leveldic["classes"].loc[i,"second_instructor"]
-    summary = [[f"Objective","Scheduling Score, {}*U-{}*Q+{}*R".format(weight1,weight2,weight3),round(mod.objval,2)],
-               ["U","Average Utilization Rate, in %",round(U.x,2)],
-               ["R","# of professors with >=1 back-to-back class",round(R.x,0)],
-               ["Q","# of professors has to work >2 days a week",Q.x]]
-    summary = pd.DataFrame(summary)
-    summary.columns = ["Variable","Desciption","Optimal Value"]
-    writer=pd.ExcelWriter(outputFile)
-    summary.to_excel(writer,sheet_name = 'Summary',index=0)
-    ug["output"].to_excel(writer,sheet_name = 'Undergrad Schedule')
-    g["output"].to_excel(writer,sheet_name = 'Grad Schedule')
-    writer.save()
+    with profiling.phase(run,"Extraction"):
+        if aggregate_rooms:
+            model = roomtypes.write_solution(model,full,instance,outputFile,formats,cliques,timelimit,tight)
+        else:
+            write_solution(model,outputFile,formats)
+    if model["mod"].SolCount == 0:
+        return failure(model,run,outputFile)
     print('Write Solution--> {:.1f} minutes elapsed'.format((time.time()-start_time)/60))
     print('Successfully Finished Optimization in {:.1f} minutes'.format((time.time()-start_time_original)/60))
+    if run is not None:
+        run["model"] = profiling.model_stats(model["mod"])
+        run["run"]["wall"] = time.time()-start_time_original
+        profiling.write(run,os.path.splitext(outputFile)[0]+'.profile.json')
     
 if __name__=='__main__':
-    import sys, os
-    if len(sys.argv)!=3 and len(sys.argv)!=6:
-        print('Correct syntax: python optimize.py inputFile outputFile weight1(optional) weight2(optional) weight3(optional)')
+    import sys
+    args = sys.argv[1:]
+    profile = bool(args) and args[-1] == 'profile'
+    if profile:
+        args = args[:-1]
+    if len(args)!=2 and len(args)!=5:
+        print('Correct syntax: python optimize.py inputFile outputFile weight1(optional) weight2(optional) weight3(optional) profile(optional)')
     else:
-        inputFile=sys.argv[1]
-        outputFile=sys.argv[2]
-        if len(sys.argv)==6:
-            weight1 = sys.argv[3]
-            weight2 = sys.argv[4]
-            weight3 = sys.argv[5]
+        inputFile=args[0]
+        outputFile=args[1]
+        weights = [float(weight) for weight in args[2:5]]
         if os.path.exists(inputFile):
-            optimize(inputFile,outputFile)
-            print(f'Results in "{outputFile}"')
+            result = optimize(inputFile,outputFile,*weights,profile=profile)
+            if result is None:
+                print(f'Results in "{outputFile}"')
+            elif "unplaced" in result:
+                print(f'Incomplete results in "{outputFile}", {len(result["unplaced"])} sections unplaced')
         else:
             print(f'File "{inputFile}" not found!')
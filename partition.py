@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+'''Partitioning of the optimize() model into independent sub-models.
+
+Two sections only interact in the model when they share an instructor (Constraints
+4, 5 and 6, through w, r, Z and q) or can use the same classroom (Constraint 2);
+the undergraduate and graduate levels have their own classrooms, so the levels are
+only coupled through the instructors teaching at both. components() finds the
+connected components of the graph of sections, instructors and classrooms, and
+subinstance() restricts the instance to one component: its sections, their
+instructors (K and L_k) and the tables indexed by section. N stays the total
+number of sections, so U, R and Q of the components add up to those of the full
+schedule and the objective of the partitioned model equals the monolithic one.
+
+solve() optimizes every component on its own core and merges the schedules into one
+output workbook. When everything is connected it solves the single model instead.
+
+This is not a general decomposition: nearly all sections of a level share some
+classroom, so each level almost always forms one component. In practice the split
+only happens between the levels, when no instructor teaches at both, and the two
+components are solved side by side with little speed-up over the single model.
+
+    python partition.py inputFile outputFile processes(optional) timelimit(optional)'''
+
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import scipy.sparse as sp
+from scipy.sparse.csgraph import connected_components
+import assembly
+import heuristic
+
+
+def components(instance):
+    '''Connected components of the section / instructor / classroom graph. Returns one
+    {"ug": [sections], "g": [sections]} per component, largest first.'''
+    K = instance["ug"]["K"]
+    sections = [(level,i) for level in ["ug","g"] for i in instance[level]["I"]]
+    position = {node:n for n, node in enumerate(sections)}
+    rooms = {(level,j):n for n, (level,j) in enumerate((level,j) for level in ["ug","g"] for j in instance[level]["J"])}
+    kpos = {k:n for n, k in enumerate(K)}
+    offset = {"rooms":len(sections),"professors":len(sections)+len(rooms)}
+    rows, cols = [], []
+    for level in ["ug","g"]:
+        leveldic = instance[level]
+        for k, taught in leveldic["L_k"].items():
+            rows.extend(position[level,i] for i in taught)
+            cols.extend([offset["professors"]+kpos[k]]*len(taught))
+        for i in leveldic["I"]:
+            rows.extend([position[level,i]]*len(leveldic["J_i"][i]))
+            cols.extend(offset["rooms"]+rooms[level,j] for j in leveldic["J_i"][i])
+    n = offset["professors"]+len(K)
+    graph = sp.csr_matrix((np.ones(len(rows)),(rows,cols)),shape=(n,n))
+    _, labels = connected_components(graph,directed=False)
+    groups = {}
+    for (level,i), label in zip(sections,labels[:len(sections)]):
+        groups.setdefault(label,{"ug":[],"g":[]})[level].append(i)
+    return sorted(groups.values(),key=lambda group: -len(group["ug"])-len(group["g"]))
+
+
+def subinstance(instance,component):
+    '''Copy of instance restricted to the sections of component and their instructors'''
+    sub = dict(instance)
+    professors = {k for level in ["ug","g"] for k, taught in instance[level]["L_k"].items()
+                  if set(taught) & set(component[level])}
+    K = np.array([k for k in instance["ug"]["K"] if k in professors])
+    for level in ["ug","g"]:
+        leveldic = dict(instance[level])
+        I = leveldic["I"][leveldic["I"].isin(component[level])]
+        leveldic["I"] = I
+        leveldic["classes"] = leveldic["classes"].loc[I]
+        for part in ["a","b","c","d"]:
+            leveldic[part] = leveldic[part][leveldic[part].isin(I)]
+        leveldic["K"] = K
+        leveldic["L_k"] = {k:[i for i in leveldic["L_k"][k] if i in set(I)] for k in K}
+        leveldic["U_ij"] = leveldic["U_ij"].loc[I]
+        leveldic["Z_ij"] = leveldic["Z_ij"].loc[I]
+        leveldic["T_i"] = {i:leveldic["T_i"][i] for i in I}
+        leveldic["J_i"] = {i:leveldic["J_i"][i] for i in I}
+        members = set(I)
+        leveldic["IJT"] = [e for e in leveldic["IJT"] if e[0] in members]
+        sub[level] = leveldic
+    sub["Classes"] = instance["Classes"].loc[list(component["ug"])+list(component["g"])]
+    return sub
+
+
+def solve_component(task):
+    '''Build and solve the model of one component from its greedy schedule; runs inside a worker process'''
+    import optimize as opt
+    sub, weights, cliques, timelimit = task
+    model = assembly.build_model(sub,*weights,cliques)
+    mod = model["mod"]
+    schedule, _ = heuristic.construct(sub,*weights)
+    heuristic.set_start(model,schedule)
+    mod.setParam('OutputFlag',False)
+    if timelimit is not None:
+        mod.setParam('TimeLimit',timelimit)
+    mod.optimize()
+    result = {"status":mod.Status,"runtime":mod.Runtime,"sections":len(sub["ug"]["I"])+len(sub["g"]["I"])}
+    if mod.SolCount > 0:
+        result.update({"chosen":opt.solution_triples(model),"values":opt.solution_values(model),"bound":mod.ObjBound})
+    return result
+
+
+def solve(instance,outputFile,weight1=1,weight2=1,weight3=0.2,processes=1,timelimit=None,cliques=True,formats=None):
+    '''Solve the components of instance concurrently and write the merged schedule.
+    Returns the Objective/U/R/Q of the merged schedule and the results of the components,
+    or None when a component has no feasible schedule.'''
+    import optimize as opt
+    start_time = time.time()
+    weights = (weight1,weight2,weight3)
+    parts = components(instance)
+    print('Partition --> {:.1f} seconds elapsed, {} components of {} sections'.format(
+        time.time()-start_time,len(parts),', '.join(str(len(part["ug"])+len(part["g"])) for part in parts)))
+    tasks = [(subinstance(instance,part) if len(parts) > 1 else instance,weights,cliques,timelimit) for part in parts]
+    if processes > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(min(processes,len(tasks))) as pool:
+            results = list(pool.map(solve_component,tasks))
+    else:
+        results = [solve_component(task) for task in tasks]
+    print('Optimize Components --> {:.1f} seconds elapsed'.format(time.time()-start_time))
+    if any("chosen" not in result for result in results):
+        print('No feasible schedule found for a component, status {}'.format([result["status"] for result in results]))
+        return None, results
+    chosen = {level:[e for result in results for e in result["chosen"][level]] for level in ["ug","g"]}
+    U = sum(result["values"]["U"] for result in results)
+    R = sum(result["values"]["R"] for result in results)
+    Q = sum(result["values"]["Q"] for result in results)
+    values = {"Objective":weight1*U-weight2*Q+weight3*R,"U":U,"R":R,"Q":Q}
+    opt.write_schedule(instance,chosen,values,weights,outputFile,formats)
+    print('Partitioned Optimization Finished in {:.1f} seconds, Objective {:.2f}, bound {:.2f}'.format(
+        time.time()-start_time,values["Objective"],sum(result["bound"] for result in results)))
+    return values, results
+
+
+if __name__=='__main__':
+    import sys, os
+    import optimize as opt
+    if len(sys.argv) < 3 or len(sys.argv) > 5:
+        print('Correct syntax: python partition.py inputFile outputFile processes(optional) timelimit(optional)')
+    elif not os.path.exists(sys.argv[1]):
+        print(f'File "{sys.argv[1]}" not found!')
+    else:
+        processes = int(sys.argv[3]) if len(sys.argv) >= 4 else 1
+        timelimit = float(sys.argv[4]) if len(sys.argv) == 5 else None
+        values, results = solve(opt.load_instance(sys.argv[1]),sys.argv[2],processes=processes,timelimit=timelimit)
+        if values is not None:
+            print(f'Results in "{sys.argv[2]}"')
@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+'''Phase profiling and solver telemetry for optimize().
+
+A profile is a plain dictionary
+    {"run": {...}, "phases": [...], "model": {...}, "trace": [...]}
+    - phases: one entry per phase (ingestion, timepart labeling, conflict sets,
+      U_ij/Z_ij, every constraint family, the solve, extraction, ...) with its wall
+      time, CPU time, resident memory after the phase and memory delta, in seconds
+      and MB, plus phase specific counts such as rows and nonzeros
+    - model: model statistics and the final solver status, objective, bound and gap
+    - trace: incumbent, bound and gap over the solve, from a Gurobi callback
+The functions accept profile=None and then only measure, so the instrumented code
+runs unchanged when profiling is off. write() stores the profile as JSON.'''
+
+import os
+import json
+import time
+import resource
+from contextlib import contextmanager
+from gurobipy import GRB
+
+
+def new_profile(**run):
+    return {"run":run,"phases":[],"model":{},"trace":[]}
+
+
+def rss():
+    '''Current resident memory in MB (peak resident memory where /proc is not available)'''
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1])*os.sysconf('SC_PAGE_SIZE')/2**20
+    except (OSError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024
+
+
+def peak_rss():
+    '''Peak resident memory of this process in MB. /proc/self/status (VmHWM) is reset by exec, while
+    ru_maxrss is kept across exec and so also covers the parent of a spawned process.'''
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])/1024
+    except (OSError, ValueError):
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024
+
+
+def mark():
+    '''Starting point of a phase'''
+    return {"wall":time.time(),"cpu":time.process_time(),"rss":rss()}
+
+
+def record(profile,name,start,**counts):
+    '''Close the phase started at mark() start and append it to profile; returns the phase entry'''
+    memory = rss()
+    entry = {"phase":name,"wall":time.time()-start["wall"],"cpu":time.process_time()-start["cpu"],
+             "rss":memory,"memory_delta":memory-start["rss"]}
+    entry.update(counts)
+    if profile is not None:
+        profile["phases"].append(entry)
+    return entry
+
+
+@contextmanager
+def phase(profile,name,**counts):
+    start = mark()
+    yield counts
+    record(profile,name,start,**counts)
+
+
+def model_stats(mod):
+    '''Size of a built model and, once solved, its final status, objective, bound and gap'''
+    stats = {"variables":mod.NumVars,"constraints":mod.NumConstrs,"nonzeros":mod.NumNZs,
+             "binaries":mod.NumBinVars,"integers":mod.NumIntVars}
+    try:
+        stats.update({"status":mod.Status,"runtime":mod.Runtime,"nodes":mod.NodeCount,"solutions":mod.SolCount})
+        if mod.SolCount > 0:
+            stats.update({"objective":mod.ObjVal,"bound":mod.ObjBound,"gap":mod.MIPGap})
+    except AttributeError:
+        pass
+    return stats
+
+
+def finite(value):
+    # Gurobi reports a missing incumbent or bound as +-GRB.INFINITY
+    return None if abs(value) >= GRB.INFINITY else value
+
+
+def gap(incumbent,bound):
+    if incumbent is None or bound is None:
+        return None
+    return abs(bound-incumbent)/max(abs(incumbent),1e-10)
+
+
+def callback(profile):
+    '''Gurobi callback appending (time, incumbent, bound, gap, nodes) to profile["trace"]
+    whenever the incumbent or the bound changes'''
+    def trace(model,where):
+        if where == GRB.Callback.MIP:
+            incumbent = model.cbGet(GRB.Callback.MIP_OBJBST)
+            bound = model.cbGet(GRB.Callback.MIP_OBJBND)
+            nodes = model.cbGet(GRB.Callback.MIP_NODCNT)
+        elif where == GRB.Callback.MIPSOL:
+            incumbent = model.cbGet(GRB.Callback.MIPSOL_OBJBST)
+            bound = model.cbGet(GRB.Callback.MIPSOL_OBJBND)
+            nodes = model.cbGet(GRB.Callback.MIPSOL_NODCNT)
+        else:
+            return
+        incumbent, bound = finite(incumbent), finite(bound)
+        last = profile["trace"][-1] if profile["trace"] else None
+        if last is None or last["incumbent"] != incumbent or last["bound"] != bound:
+            profile["trace"].append({"time":model.cbGet(GRB.Callback.RUNTIME),"incumbent":incumbent,"bound":bound,
+                                     "gap":gap(incumbent,bound),"nodes":nodes})
+    return trace
+
+
+def plain(value):
+    '''JSON form of NumPy scalars and anything else json does not know, as default= of json.dump'''
+    return value.item() if hasattr(value, "item") else str(value)
+
+
+def write(profile,profileFile):
+    '''Store profile as JSON'''
+    with open(profileFile,'w') as f:
+        json.dump(profile,f,indent=1,default=plain)
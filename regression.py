@@ -0,0 +1,242 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+'''Regression checks of the rewritten parts of optimize() on generated workbooks
+(see generate.py). Each check compares a rewrite with the code it replaced, or with
+a known answer:
+    - conflicts: the conflict-index engine against the pairwise loops of
+      benchmark_conflicts.py, and unknown day codes raising ValueError
+    - assembly: the matrix builder (assembly.py) against the LinExpr builder of
+      optimize.py, row by row, for every setting of cliques and tight
+    - preprocess: L_k, U_ij, Z_ij, V, J_i and IJT of preprocess() against the
+      loops they replaced (sections 1.6-1.9), also when every section has a second
+      instructor
+    - screen: the screening on feasible and infeasible workbooks, on workbooks with
+      the sections of one level only (screened, built and solved end to end) and on
+      an instructor whose sections all lack a timeslot
+    - incremental: incremental.reoptimize() against its own prior schedule, which
+      must find nothing to re-optimize and keep the objective and every assignment
+The workbooks are written to a temporary directory. The script exits with status 1
+when a check fails.
+
+    python regression.py check(s)(optional)'''
+
+import os
+import tempfile
+import traceback
+import contextlib
+import numpy as np
+import pandas as pd
+import openpyxl
+import conflicts
+import assembly
+import benchmark_conflicts
+import generate
+import incremental
+import optimize as opt
+import screen
+
+# Small enough for a size-limited Gurobi license
+FIXTURE = {"sections_count":40,"rooms":4,"starts":2,"seed":1}
+
+
+def fixture(directory,**arguments):
+    '''Path of a generated workbook in directory, written once per set of arguments'''
+    arguments = dict(FIXTURE,**arguments)
+    inputFile = os.path.join(directory,'_'.join('{}{}'.format(key,value) for key, value in sorted(arguments.items()))+'.xlsx')
+    if not os.path.exists(inputFile):
+        generate.generate(inputFile,**arguments)
+    return inputFile
+
+
+def check_conflicts(directory):
+    inputFile = fixture(directory)
+    ugslots = pd.read_excel(inputFile,sheet_name='Timeslots_UG',index_col=0)
+    gslots = pd.read_excel(inputFile,sheet_name='Timeslots_G',index_col=0)
+    old = benchmark_conflicts.legacy(ugslots,gslots)
+    new = benchmark_conflicts.vectorized(ugslots,gslots)
+    for key in old:
+        assert old[key] == new[key], '{}: {} pairs in the loops, {} in the conflict index'.format(key,len(old[key]),len(new[key]))
+    for day in ["MX",""]:
+        slots = ugslots.head(2).copy()
+        slots["Day"] = ["M",day]
+        try:
+            conflicts.encode_timeslots(slots)
+        except ValueError:
+            continue
+        raise AssertionError('day code "{}" was accepted'.format(day))
+
+
+def keyed(model):
+    '''Name of every variable of a built model, e.g. ("X","ug",(i,j,t)) or ("r",k)'''
+    names = {}
+    for level in ["ug","g"]:
+        for family in ["X","H"]:
+            names.update({var.index:(family,level,key) for key, var in model[level][family].items()})
+    for family in ["r","q","Z"]:
+        names.update({var.index:(family,key) for key, var in model[family].items()})
+    names.update({model[family].index:(family,) for family in ["U","R","Q"]})
+    return names
+
+
+def rows(model):
+    '''The constraints of a built model as a sorted list of (sense, rhs, terms) with >= rows turned
+    into <= rows, so models that add the same rows in another order or form compare equal (-0.0 is
+    written as 0.0, as the rows are sorted by their repr)'''
+    mod = model["mod"]
+    mod.update()
+    names = keyed(model)
+    A = mod.getA().tocsr()
+    found = []
+    for n, constraint in enumerate(mod.getConstrs()):
+        sign = -1 if constraint.Sense == '>' else 1
+        cols = A.indices[A.indptr[n]:A.indptr[n+1]]
+        terms = tuple(sorted((names[c],round(sign*v,9)+0.0) for c, v in zip(cols,A.data[A.indptr[n]:A.indptr[n+1]])))
+        found.append(('=' if constraint.Sense == '=' else '<',round(sign*constraint.RHS,9)+0.0,terms))
+    return sorted(found,key=repr)
+
+
+def columns(model):
+    '''Bounds, type and objective coefficient of every variable of a built model, by name'''
+    names = keyed(model)
+    return sorted((names[var.index],var.LB,var.UB,var.VType,var.Obj) for var in model["mod"].getVars())
+
+
+def check_assembly(directory):
+    instance = opt.load_instance(fixture(directory),cache_dir=directory)
+    for cliques in [True,False]:
+        for tight in [True,False]:
+            with open(os.devnull,'w') as devnull, contextlib.redirect_stdout(devnull):
+                matrix = assembly.build_model(instance,cliques=cliques,tight=tight)
+                linexpr = opt.build_model(instance,cliques=cliques,tight=tight)
+            new, old = rows(matrix), rows(linexpr)
+            assert new == old, 'cliques={} tight={}: {} matrix rows, {} LinExpr rows, {} differ'.format(
+                cliques,tight,len(new),len(old),len(set(new) ^ set(old)))
+            new, old = columns(matrix), columns(linexpr)
+            assert new == old, 'cliques={} tight={}: {} variables differ in bounds, type or objective'.format(
+                cliques,tight,len(set(new) ^ set(old)))
+
+
+def legacy_sets(instance):
+    '''L_k, U_ij, Z_ij, V and J_i of every level computed with the loops of sections 1.6-1.9 of the
+    original preprocess(), from the tables of the instance'''
+    legacy = {}
+    for level in ["ug","g"]:
+        leveldic = instance[level]
+        tempframe = leveldic["classes"].reset_index()
+        L_k = {}
+        for k in leveldic["K"]:
+            condition = (tempframe.first_instructor == k)|(tempframe.second_instructor == k)
+            L_k[k] = tempframe.loc[condition,"section"].to_list()
+        U_ij = pd.DataFrame(0.0,columns = leveldic["J"], index = leveldic["I"])
+        Z_ij = pd.DataFrame(0,columns = leveldic["J"], index = leveldic["I"])
+        for section in leveldic["I"]:
+            for room in leveldic["J"]:
+                seats = leveldic["classes"].loc[section,"seats_offered"]
+                capacity = leveldic["classrooms"].loc[room,"Capacity"]
+                if seats <= capacity:
+                    U_ij.loc[section,room] = seats/capacity*100
+                    Z_ij.loc[section,room] = 1
+        V = {}
+        for weekday in instance["S"]:
+            temp = leveldic["timeslots"]
+            V[weekday] = [t for t in temp.index if temp.loc[t,'Day'] == weekday or temp.loc[t,'Day'][0] == weekday or
+                          temp.loc[t,'Day'][-1] == weekday]
+        J_i = {i:list(Z_ij.columns[Z_ij.loc[i].values == 1]) for i in leveldic["I"]}
+        IJT = [(i,j,t) for i in leveldic["I"] for j in J_i[i] for t in leveldic["T_i"][i]]
+        legacy[level] = {"L_k":L_k,"U_ij":U_ij,"Z_ij":Z_ij,"V":V,"J_i":J_i,"IJT":IJT}
+    return legacy
+
+
+def check_preprocess(directory):
+    for arguments in [{},{"seed":2,"coinstructor":0.5,"cross":0.5},{"sections_count":30,"rooms":3,"days":"MWF","seed":3},
+                      {"coinstructor":1.0}]:
+        with open(os.devnull,'w') as devnull, contextlib.redirect_stdout(devnull):
+            instance = opt.preprocess(fixture(directory,**arguments))
+        for level, old in legacy_sets(instance).items():
+            new = instance[level]
+            for key in ["L_k","V","J_i","IJT"]:
+                assert new[key] == old[key], '{} {} differs from the loops ({})'.format(level,key,arguments)
+            for key in ["U_ij","Z_ij"]:
+                assert new[key].index.equals(old[key].index) and new[key].columns.equals(old[key].columns), \
+                    '{} {} is labeled differently from the loops ({})'.format(level,key,arguments)
+                assert np.allclose(new[key].values,old[key].values), '{} {} differs from the loops ({})'.format(level,key,arguments)
+
+
+def level_only(inputFile,level):
+    '''Copy of a workbook keeping the sections of one level ("UG" or "G") only'''
+    workbook = openpyxl.load_workbook(inputFile)
+    sheet = workbook["Sections"]
+    column = [cell.value for cell in sheet[1]].index("level")+1
+    for row in range(sheet.max_row,1,-1):
+        if sheet.cell(row,column).value != level:
+            sheet.delete_rows(row)
+    outputFile = '{}_{}.xlsx'.format(os.path.splitext(inputFile)[0],level)
+    workbook.save(outputFile)
+    return outputFile
+
+
+def check_screen(directory):
+    with open(os.devnull,'w') as devnull, contextlib.redirect_stdout(devnull):
+        feasible = opt.preprocess(fixture(directory))
+        crowded = opt.preprocess(fixture(directory,rooms=2))
+    assert screen.screen(feasible) == [], 'violations found on a feasible workbook'
+    assert any(violation["check"] == "classrooms" for violation in screen.screen(crowded)), 'too few classrooms not found'
+    # One level only: screened, built and solved (small enough for a size-limited license)
+    for level in ["UG","G"]:
+        inputFile = level_only(fixture(directory,sections_count=14,rooms=2,seed=0),level)
+        with open(os.devnull,'w') as devnull, contextlib.redirect_stdout(devnull):
+            result = opt.optimize(inputFile,os.path.join(directory,'out.xlsx'),cache=False)
+        assert result is None, '{} sections only: {}'.format(level,result)
+    # Every section of an instructor without a timeslot: only reported by the eligibility check
+    instance = dict(feasible,ug=dict(feasible["ug"]))
+    k = max(instance["ug"]["K"],key=lambda k: len(instance["ug"]["L_k"][k]))
+    instance["ug"]["T_i"] = {**instance["ug"]["T_i"],**{i:[] for i in instance["ug"]["L_k"][k]}}
+    violations = screen.screen(instance)
+    assert [violation["check"] for violation in violations] == ["eligibility"], violations
+    assert set(violations[0]["sections"]) == set(instance["ug"]["L_k"][k]), violations
+
+
+def check_incremental(directory):
+    # Small enough to solve with a size-limited license
+    inputFile = fixture(directory,sections_count=14,rooms=2,seed=0)
+    priorFile, outputFile = os.path.join(directory,'prior.xlsx'), os.path.join(directory,'incremental.xlsx')
+    with open(os.devnull,'w') as devnull, contextlib.redirect_stdout(devnull):
+        assert opt.optimize(inputFile,priorFile) is None, 'no prior schedule'
+        diff = incremental.reoptimize(inputFile,priorFile,outputFile)
+    assert diff == {"new":0,"ineligible":0,"instructors":0,"removed":0,"neighbourhood":0,"moved":0}, diff
+    prior = pd.read_excel(priorFile,sheet_name=None,index_col=0)
+    output = pd.read_excel(outputFile,sheet_name=None,index_col=0)
+    assert np.allclose(prior["Summary"]["Optimal Value"],output["Summary"]["Optimal Value"]), \
+        'objective {} before, {} after'.format(prior["Summary"]["Optimal Value"].tolist(),output["Summary"]["Optimal Value"].tolist())
+    for sheet in ['Undergrad Schedule','Grad Schedule']:
+        assigned = ["Classroom","Time","Day","Session"]
+        assert prior[sheet][assigned].sort_index().equals(output[sheet][assigned].sort_index()), '{} changed'.format(sheet)
+
+
+CHECKS = {"conflicts":check_conflicts,"assembly":check_assembly,"preprocess":check_preprocess,"screen":check_screen,
+          "incremental":check_incremental}
+
+
+def run(names=None):
+    '''Run the named checks (default: all); returns the names of the failed ones'''
+    failed = []
+    with tempfile.TemporaryDirectory() as directory:
+        for name in names or CHECKS:
+            try:
+                CHECKS[name](directory)
+                print('{:<12} passed'.format(name))
+            except Exception:
+                print('{:<12} FAILED'.format(name))
+                traceback.print_exc()
+                failed.append(name)
+    return failed
+
+
+if __name__=='__main__':
+    import sys
+    unknown = [name for name in sys.argv[1:] if name not in CHECKS]
+    if unknown:
+        print('Correct syntax: python regression.py check(s)(optional), checks among {}'.format(', '.join(CHECKS)))
+    else:
+        sys.exit(1 if run(sys.argv[1:]) else 0)
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+'''Room-type aggregation of the optimize() model.
+
+U_ij and Z_ij only depend on the classroom Capacity, so classrooms of equal capacity
+are interchangeable and X[i,j,t] carries a copy of every solution per permutation of
+them. aggregate() collapses the classrooms of each level into one room type per
+capacity: X[i,c,t] then says that section i meets at timeslot t in some classroom of
+type c, and Constraint 2 becomes "at most n_c classes of type c per clique", with n_c
+the number of classrooms of the type (see assembly.build_model()). U, R and Q do not
+depend on which classroom of a type is used, so the aggregated model has the same
+optimum whenever its schedule can be disaggregated.
+
+disaggregate() gives every section a concrete classroom of its type with the
+classroom stage of the decomposition (decompose.assign_rooms()). Slot overlaps are not
+always an interval graph, so in rare cases the counts per clique can not be realized;
+those schedules are finished by solving the full model from the disaggregated part.'''
+
+import numpy as np
+import pandas as pd
+import assembly
+import heuristic
+import decompose
+
+
+def aggregate(instance):
+    '''Copy of instance with the classrooms of each level replaced by room types. Every level
+    keeps the classrooms of each type under "rooms" and the type of each classroom under "roomtype".'''
+    aggregated = dict(instance)
+    for level in ["ug","g"]:
+        leveldic = dict(instance[level])
+        capacity = leveldic["classrooms"]["Capacity"]
+        rooms = {}
+        for j in leveldic["J"]:
+            rooms.setdefault('{} seats'.format(capacity[j]),[]).append(j)
+        types = pd.Index(list(rooms),name=leveldic["J"].name)
+        first = [rooms[c][0] for c in types]
+        leveldic["rooms"] = rooms
+        leveldic["roomtype"] = {j:c for c, members in rooms.items() for j in members}
+        leveldic["roomcount"] = np.array([len(rooms[c]) for c in types])
+        leveldic["classrooms"] = pd.DataFrame({"Capacity":capacity[first].values,"Rooms":leveldic["roomcount"]},index=types)
+        leveldic["J"] = types
+        leveldic["U_ij"] = leveldic["U_ij"][first].set_axis(types,axis=1)
+        leveldic["Z_ij"] = leveldic["Z_ij"][first].set_axis(types,axis=1)
+        leveldic["J_i"] = {i:list(dict.fromkeys(leveldic["roomtype"][j] for j in instance[level]["J_i"][i])) for i in leveldic["I"]}
+        leveldic["IJT"] = [(i,c,t) for i in leveldic["I"] for c in leveldic["J_i"][i] for t in leveldic["T_i"][i]]
+        aggregated[level] = leveldic
+    print('Room types: {} undergraduate classrooms in {} types, {} graduate classrooms in {} types'.format(
+        len(instance["ug"]["J"]),len(aggregated["ug"]["J"]),len(instance["g"]["J"]),len(aggregated["g"]["J"])))
+    return aggregated
+
+
+def typed(aggregated,schedule):
+    '''A schedule on classrooms mapped to room types, e.g. the greedy schedule as MIP start'''
+    return {level:{i:(aggregated[level]["roomtype"][j],t) for i, (j,t) in schedule[level].items()} for level in ["ug","g"]}
+
+
+def disaggregate(instance,aggregated,chosen,processes=1):
+    '''Concrete classrooms for the (section, room type, timeslot) triples in chosen. Returns the
+    schedule {"ug": {section: (classroom, timeslot)}, "g": {...}} and the sections left without one.'''
+    restricted = dict(instance)
+    times = {}
+    for level in ["ug","g"]:
+        leveldic = dict(instance[level])
+        rooms = aggregated[level]["rooms"]
+        leveldic["J_i"] = dict(leveldic["J_i"])
+        leveldic["J_i"].update({i:rooms[c] for (i,c,t) in chosen[level]})
+        restricted[level] = leveldic
+        times[level] = {i:t for (i,c,t) in chosen[level]}
+    return decompose.assign_rooms(restricted,times,processes)
+
+
+def write_solution(model,instance,aggregated,outputFile,formats=None,cliques=True,timelimit=None,tight=False):
+    '''PART 2.6 for a solved aggregated model: disaggregate and write the output workbook.
+    Returns the model the schedule was taken from; when the full model of the fallback finds no
+    schedule within timelimit nothing is written and that model is returned unsolved (SolCount 0).'''
+    import optimize as opt
+    schedule, unplaced = disaggregate(instance,aggregated,opt.solution_triples(model))
+    if not unplaced:
+        opt.write_schedule(instance,heuristic.chosen_triples(schedule),opt.solution_values(model),model["weights"],outputFile,formats)
+        return model
+    print('{} sections could not get a classroom of their room type, re-optimizing with every classroom'.format(len(unplaced)))
+    full = assembly.build_model(instance,*model["weights"],cliques,tight=tight)
+    heuristic.set_start(full,schedule)
+    if timelimit is not None:
+        full["mod"].setParam('TimeLimit',timelimit)
+    full["mod"].setParam('OutputFlag',False)
+    full["mod"].optimize()
+    if full["mod"].SolCount == 0:
+        return full
+    opt.write_solution(full,outputFile,formats)
+    return full
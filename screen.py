@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+'''Feasibility screening of a preprocessed instance before the model is built.
+
+Every check is a necessary condition of the optimize() model, so a violation
+proves the instance infeasible and names the groups to fix:
+    - eligibility: sections without a classroom large enough, or without a timeslot
+      of their timepart
+    - classrooms: per level, size band and union of timeparts, the sections that
+      need a classroom of at least c seats against (classrooms of at least c seats)
+      x (cliques needed to cover their timeslots). Overlapping timeslots form a
+      clique, and a classroom holds at most one class per clique.
+    - matching: per level, a maximum bipartite matching of sections to (classroom,
+      clique) pairs, with the timeslots partitioned into cliques. Every schedule is
+      such a matching, so sections left unmatched can not all be scheduled.
+    - instructors: per instructor, a maximum matching of the sections taught to the
+      cross-level cliques (no instructor teaches two classes in one clique), then a
+      bounded exact search for pairwise non-overlapping timeslots of those sections
+When the screening passes and the solver still proves the model infeasible,
+explain() computes an irreducible infeasible subsystem (IIS) and reports it per
+constraint family, with the sections of the Constraint 1 rows.
+
+    python screen.py inputFile'''
+
+import itertools as it
+import numpy as np
+import scipy.sparse as sp
+from scipy.sparse.csgraph import maximum_bipartite_matching
+import decompose
+import heuristic
+
+# Timeslot parts of every timepart of the sections (1.9 of preprocess())
+TIMEPARTS = {"a":["A","B"],"b":["C"],"c":["D","F"],"d":["E","G"]}
+
+
+def cover(cliques,slots):
+    '''Greedy partition of slots into parts of cliques; an upper bound on the number of
+    pairwise non-overlapping timeslots among slots'''
+    left = set(slots)
+    parts = []
+    while left:
+        best = max(cliques,key=lambda clique: len(left.intersection(clique)))
+        part = left.intersection(best) or {next(iter(left))}
+        parts.append(part)
+        left -= part
+    return parts
+
+
+def matching(demand,nsupply,rows,cols):
+    '''Size of a maximum bipartite matching and the unmatched demand nodes; rows and cols are
+    the demand and supply positions of the edges'''
+    if not demand:
+        return 0, []
+    graph = sp.csr_matrix((np.ones(len(rows)),(rows,cols)),shape=(len(demand),max(nsupply,1)))
+    matched = maximum_bipartite_matching(graph,perm_type='column')
+    return int((matched >= 0).sum()), [demand[n] for n in np.flatnonzero(matched < 0)]
+
+
+def eligibility(instance):
+    violations = []
+    for level in ["ug","g"]:
+        leveldic = instance[level]
+        for what, key in [("classroom","J_i"),("timeslot","T_i")]:
+            sections = [i for i in leveldic["I"] if not leveldic[key][i]]
+            if sections:
+                violations.append({"check":"eligibility","level":level,"group":"no eligible "+what,
+                                   "demand":len(sections),"capacity":0,"sections":sections})
+    return violations
+
+
+def classrooms(instance):
+    '''Counting bound per size band and union of timeparts, only reporting the smallest violating unions'''
+    violations = []
+    for level in ["ug","g"]:
+        leveldic = instance[level]
+        groups = {part:set(leveldic[part]) for part in TIMEPARTS}
+        capacities = sorted(set(leveldic["classrooms"]["Capacity"]))
+        for c, (sections, rooms) in zip(capacities,decompose.capacity_bands(leveldic)):
+            violated = []
+            for size in range(1,len(TIMEPARTS)+1):
+                for union in it.combinations(TIMEPARTS,size):
+                    if any(set(smaller) <= set(union) for smaller in violated):
+                        continue
+                    members = [i for i in sections if any(i in groups[part] for part in union)]
+                    if not members:
+                        continue
+                    slots = {t for i in members for t in leveldic["T_i"][i]}
+                    capacity = rooms*len(cover(leveldic["cliques"],slots))
+                    if len(members) > capacity:
+                        violated.append(union)
+                        violations.append({"check":"classrooms","level":level,
+                                           "group":'{}+ seats, timeslots {}'.format(c,'/'.join(p for part in union for p in TIMEPARTS[part])),
+                                           "demand":len(members),"capacity":capacity,"sections":members})
+    return violations
+
+
+def roommatching(instance):
+    violations = []
+    for level in ["ug","g"]:
+        leveldic = instance[level]
+        # A level without sections (e.g. an undergraduate-only workbook) has nothing to match
+        if not len(leveldic["I"]):
+            continue
+        part = {t:n for n, slots in enumerate(cover(leveldic["cliques"],leveldic["T"])) for t in slots}
+        nparts = max(part.values(),default=-1)+1
+        sections = list(leveldic["I"])
+        # Sections of one timepart share their T_i list, so its cliques are looked up once
+        partsof = {}
+        rows, cols = [], []
+        for n, i in enumerate(sections):
+            slots = leveldic["T_i"][i]
+            if id(slots) not in partsof:
+                partsof[id(slots)] = np.unique([part[t] for t in slots]).astype(int)
+            columns = (leveldic["J"].get_indexer(leveldic["J_i"][i])[:,None]*nparts+partsof[id(slots)][None,:]).ravel()
+            rows.append(np.full(len(columns),n))
+            cols.append(columns)
+        size, unmatched = matching(sections,len(leveldic["J"])*nparts,np.concatenate(rows),np.concatenate(cols))
+        if unmatched:
+            violations.append({"check":"matching","level":level,"group":"sections x (classroom, clique)",
+                               "demand":len(sections),"capacity":size,"sections":unmatched})
+    return violations
+
+
+def schedulable(sections,instance,lookups,limit=100000):
+    '''Whether the (level, section) pairs can all get pairwise non-overlapping timeslots of their
+    timepart, by backtracking over at most limit nodes; None when the search is cut off'''
+    order = sorted(sections,key=lambda section: len(instance[section[0]]["T_i"][section[1]]))
+    other = {"ug":"g","g":"ug"}
+    busy = {"ug":set(),"g":set()}
+    nodes = [0]
+    def place(n):
+        if n == len(order):
+            return True
+        level, i = order[n]
+        for t in instance[level]["T_i"][i]:
+            nodes[0] += 1
+            if nodes[0] > limit:
+                return None
+            if busy[level].isdisjoint(lookups[level]["overlaps"][t]) and busy[other[level]].isdisjoint(lookups[level]["cross"][t]):
+                busy[level].add(t)
+                found = place(n+1)
+                busy[level].discard(t)
+                if found is not False:
+                    return found
+        return False
+    return place(0)
+
+
+def instructors(instance):
+    '''Matching bound per instructor, then an exact search when the bound passes'''
+    ug, g = instance["ug"], instance["g"]
+    slots = [("ug",t) for t in ug["T"]]+[("g",t) for t in g["T"]]
+    cliques = [[("ug",t) for t in ugslots]+[("g",t) for t in gslots] for ugslots, gslots in instance["cross_cliques"]]
+    part = {slot:n for n, members in enumerate(cover(cliques,slots)) for slot in members}
+    lookups = heuristic.slotsets(instance)
+    violations = []
+    for k in ug["K"]:
+        # Sections without a timeslot are reported by eligibility()
+        sections = [(level,i) for level in ["ug","g"] for i in instance[level]["L_k"].get(k,[]) if instance[level]["T_i"][i]]
+        if len(sections) < 2:
+            continue
+        edges = np.array(sorted({(n,part[level,t]) for n, (level,i) in enumerate(sections) for t in instance[level]["T_i"][i]}))
+        size, unmatched = matching(sections,len(set(part.values())),edges[:,0],edges[:,1])
+        if unmatched:
+            violations.append({"check":"instructors","level":"ug+g","group":'instructor {}'.format(k),
+                               "demand":len(sections),"capacity":size,"sections":[i for level, i in sections]})
+        elif schedulable(sections,instance,lookups) is False:
+            violations.append({"check":"instructors","level":"ug+g","group":'instructor {} (no pairwise non-overlapping timeslots)'.format(k),
+                               "demand":len(sections),"capacity":None,"sections":[i for level, i in sections]})
+    return violations
+
+
+def screen(instance):
+    '''All checks; returns the violations, an empty list when none is found'''
+    violations = eligibility(instance)+classrooms(instance)+instructors(instance)
+    # The matching subsumes the counting bounds, so it only adds to the report when they pass
+    if not any(violation["check"] in ("eligibility","classrooms") for violation in violations):
+        violations += roommatching(instance)
+    return violations
+
+
+def report(violations):
+    print('Infeasible input, {} violated groups:'.format(len(violations)))
+    for violation in violations:
+        places = 'for {} places'.format(violation["capacity"]) if violation["capacity"] is not None else 'can not all be placed'
+        print('  [{}] {} {}: {} sections {} --> sections {}'.format(violation["check"],violation["level"],violation["group"],
+                                                                     violation["demand"],places,violation["sections"]))
+
+
+def explain(model):
+    '''IIS of an infeasible model, as {family: rows in the IIS}; Constraint 1 rows are listed
+    by section under "sections". Models without row families only report the row count.'''
+    mod = model["mod"]
+    mod.computeIIS()
+    iis = {}
+    if "constraints" not in model:
+        iis["rows"] = sum(constraint.IISConstr for constraint in mod.getConstrs())
+    for family, rows, labels in model.get("constraints",[]):
+        member = np.asarray(rows.IISConstr).astype(bool)
+        if member.any():
+            iis[family] = iis.get(family,0)+int(member.sum())
+        if labels is not None:
+            iis.setdefault("sections",[]).extend(label for label, inside in zip(labels,member) if inside)
+    iis["bounds"] = sum(var.IISLB+var.IISUB for var in mod.getVars())
+    print('Infeasible model, irreducible infeasible subsystem: {}'.format(iis))
+    return iis
+
+
+if __name__=='__main__':
+    import sys, os
+    import optimize as opt
+    if len(sys.argv)!=2:
+        print('Correct syntax: python screen.py inputFile')
+    elif not os.path.exists(sys.argv[1]):
+        print(f'File "{sys.argv[1]}" not found!')
+    else:
+        violations = screen(opt.load_instance(sys.argv[1]))
+        if violations:
+            report(violations)
+        else:
+            print('No violations found')
+        sys.exit(1 if violations else 0)
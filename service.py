@@ -0,0 +1,335 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+'''Local scheduling service keeping preprocessed instances and built models in memory.
+
+Every workbook gets a session with its instance (load_instance()), the model
+(assembly.build_model()) and the planner's changes: weights, pinned sections and
+classrooms taken offline. A request changes the resident model in place and re-solves
+it from the last schedule instead of preprocessing and building again:
+    - weights: set_weights() on the objective
+    - pin/unpin: lower bound 1/0 on X[i,j,t] of the pinned classroom and timeslot
+    - offline/online: upper bound 0/1 on every X of the classroom
+HTTP/JSON endpoints, one request per connection:
+    GET  /status   the sessions and their state
+    POST /load     {"inputFile": path}
+                   preprocess, screen (screen.py) and build the model of a workbook
+    POST /solve    {"inputFile": path, "weights": [w1,w2,w3],
+                    "pin": {"ug": {section: [classroom, timeslot]}, "g": {...}},
+                    "unpin": {"ug": [sections], "g": [...]},
+                    "offline": {"ug": [classrooms], "g": [...]}, "online": {...},
+                    "timelimit": seconds, "outputFile": path}
+                   everything but inputFile is optional; the answer is streamed as one JSON
+                   object per line: "queued", "started", "progress" (incumbent, bound and gap
+                   whenever they change), then "result" with the schedule, or "error"
+Labels are matched on their text, so sections and timeslots may be sent as numbers or
+strings. Requests on one workbook are queued in arrival order; the solves run on a pool
+of workers threads, each solve limited to threads/workers solver threads. Gurobi environments
+are not thread-safe, so every session builds and solves its model in its own environment.
+
+    python service.py port(optional) workers(optional) threads(optional)'''
+
+import os
+import json
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from gurobipy import GRB, Env
+import optimize as opt
+import assembly
+import heuristic
+import profiling
+import screen
+
+STATUS = {200:"OK",400:"Bad Request",404:"Not Found",405:"Method Not Allowed",422:"Unprocessable Entity",500:"Internal Server Error"}
+
+
+def new_session(inputFile,threads=1):
+    '''Preprocess, screen and build the model of a workbook. Returns the session, or the
+    screening violations when the workbook is infeasible.'''
+    start_time = time.time()
+    instance = opt.load_instance(inputFile)
+    violations = screen.screen(instance)
+    if violations:
+        return None, violations
+    env = Env(empty=True)
+    env.setParam('OutputFlag',0)
+    env.start()
+    model = assembly.build_model(instance,env=env)
+    mod = model["mod"]
+    mod.setParam('Threads',threads)
+    mod.update()
+    session = {"inputFile":inputFile,"mtime":os.path.getmtime(inputFile),"instance":instance,"model":model,"env":env,
+               "pins":{"ug":{},"g":{}},"offline":{"ug":set(),"g":set()},"schedule":None,"solves":0}
+    # Text of every label, and the X of every classroom for taking it offline
+    session["labels"] = {level:{kind:{str(label):label for label in instance[level][key]} for kind, key in
+                                [("section","I"),("classroom","J"),("timeslot","T")]} for level in ["ug","g"]}
+    session["rooms"] = {level:{} for level in ["ug","g"]}
+    for level in ["ug","g"]:
+        for (i,j,t), var in model[level]["X"].items():
+            session["rooms"][level].setdefault(j,[]).append(var)
+    schedule, unplaced = heuristic.construct(instance,*model["weights"])
+    session["schedule"] = schedule
+    session["build"] = time.time()-start_time
+    print('Session {} --> {:.1f} seconds elapsed, {} variables, {} constraints'.format(inputFile,session["build"],mod.NumVars,mod.NumConstrs))
+    return session, []
+
+
+def close_session(session):
+    '''Free the model and the Gurobi environment of a session that is no longer used'''
+    session["model"]["mod"].dispose()
+    session["env"].dispose()
+
+
+def label(session,level,kind,value):
+    try:
+        return session["labels"][level][kind][str(value)]
+    except KeyError:
+        raise ValueError('unknown {} {} {}'.format(level,kind,value))
+
+
+def apply_changes(session,request):
+    '''Apply the weights, pins and classroom changes of a request to the resident model. Every
+    label is resolved and every pin checked first, so a rejected request leaves the
+    model and the session unchanged.'''
+    model = session["model"]
+    weights = None
+    if "weights" in request:
+        weights = [float(weight) for weight in request["weights"]]
+        if len(weights) != 3:
+            raise ValueError('weights must be [weight1, weight2, weight3]')
+    unpins = [(level,label(session,level,"section",value)) for level, sections in request.get("unpin",{}).items() for value in sections]
+    pins = []
+    for level, items in request.get("pin",{}).items():
+        for value, (room, slot) in items.items():
+            e = (label(session,level,"section",value),label(session,level,"classroom",room),label(session,level,"timeslot",slot))
+            if e not in model[level]["X"]:
+                raise ValueError('section {} can not meet in classroom {} at timeslot {}'.format(*e))
+            pins.append((level,e))
+    rooms = [(level,label(session,level,"classroom",value),bound) for change, bound in [("offline",0),("online",1)]
+             for level, values in request.get(change,{}).items() for value in values]
+
+    # Nothing below can fail
+    if weights is not None:
+        opt.set_weights(model,*weights)
+    for level, i in unpins:
+        if i in session["pins"][level]:
+            model[level]["X"][(i,)+session["pins"][level].pop(i)].LB = 0
+    for level, e in pins:
+        i = e[0]
+        if i in session["pins"][level]:
+            model[level]["X"][(i,)+session["pins"][level][i]].LB = 0
+        model[level]["X"][e].LB = 1
+        session["pins"][level][i] = e[1:]
+    for level, j, bound in rooms:
+        for var in session["rooms"][level].get(j,[]):
+            var.UB = bound
+        (session["offline"][level].add if bound == 0 else session["offline"][level].discard)(j)
+
+
+def solve(session,timelimit,progress):
+    '''Re-solve the resident model from the last schedule; progress is called with every
+    change of incumbent or bound. Runs on a worker thread.'''
+    model = session["model"]
+    mod = model["mod"]
+    start = {level:{i:(j,t) for i, (j,t) in session["schedule"][level].items() if j not in session["offline"][level]}
+             for level in ["ug","g"]}
+    heuristic.set_start(model,start)
+    mod.setParam('TimeLimit',GRB.INFINITY if timelimit is None else timelimit)
+    last = {}
+    def trace(model_,where):
+        if where != GRB.Callback.MIP:
+            return
+        incumbent = profiling.finite(model_.cbGet(GRB.Callback.MIP_OBJBST))
+        bound = profiling.finite(model_.cbGet(GRB.Callback.MIP_OBJBND))
+        if (incumbent,bound) != last.get("values"):
+            last["values"] = (incumbent,bound)
+            progress({"event":"progress","time":model_.cbGet(GRB.Callback.RUNTIME),"incumbent":incumbent,
+                      "bound":bound,"gap":profiling.gap(incumbent,bound)})
+    mod.optimize(trace)
+    session["solves"] += 1
+    result = {"event":"result","status":mod.Status,"runtime":mod.Runtime}
+    if mod.SolCount == 0:
+        if mod.Status in (GRB.INFEASIBLE,GRB.INF_OR_UNBD):
+            result["iis"] = screen.explain(model)
+        return result
+    chosen = opt.solution_triples(model)
+    session["schedule"] = {level:{i:(j,t) for (i,j,t) in chosen[level]} for level in ["ug","g"]}
+    values = opt.solution_values(model)
+    result.update(values)
+    result["bound"] = mod.ObjBound
+    result["schedule"] = {level:[{"section":i,"classroom":j,"timeslot":t,
+                                  "time":session["instance"][level]["timeslots"].loc[t,"Timeslots"]} for (i,j,t) in chosen[level]]
+                          for level in ["ug","g"]}
+    return result
+
+
+class Service:
+    '''Sessions, the queue of every session and the solver pool'''
+
+    def __init__(self,workers=2,threads=4):
+        self.pool = ThreadPoolExecutor(workers)
+        self.threads = max(1,threads//workers)
+        self.sessions = {}
+        self.locks = {}
+        self.waiting = {}
+
+    async def session(self,inputFile,send):
+        '''The session of inputFile, built on a worker when missing or when the workbook changed.
+        Must be called holding the lock of inputFile.'''
+        if not os.path.exists(inputFile):
+            raise FileNotFoundError(f'File "{inputFile}" not found!')
+        session = self.sessions.get(inputFile)
+        if session is None or session["mtime"] != os.path.getmtime(inputFile):
+            if session is not None:
+                await send({"event":"reloaded","reason":"workbook changed, pins and offline classrooms are reset"})
+            if session is not None:
+                close_session(self.sessions.pop(inputFile))
+            session, violations = await asyncio.get_running_loop().run_in_executor(self.pool,new_session,inputFile,self.threads)
+            if violations:
+                raise InfeasibleInput(violations)
+            self.sessions[inputFile] = session
+        return session
+
+    async def run(self,inputFile,send,work):
+        '''Queue work(session) behind the earlier requests on the same workbook'''
+        lock = self.locks.setdefault(inputFile,asyncio.Lock())
+        self.waiting[inputFile] = self.waiting.get(inputFile,0)+1
+        try:
+            await send({"event":"queued","ahead":self.waiting[inputFile]-1})
+            async with lock:
+                await send({"event":"started"})
+                session = await self.session(inputFile,send)
+                return await work(session)
+        finally:
+            self.waiting[inputFile] -= 1
+
+    def status(self):
+        return {"sessions":[{"inputFile":name,"solves":session["solves"],"build":session["build"],
+                             "weights":session["model"]["weights"],"queued":self.waiting.get(name,0),
+                             "pins":{level:len(pins) for level, pins in session["pins"].items()},
+                             "offline":{level:sorted(map(str,rooms)) for level, rooms in session["offline"].items()}}
+                            for name, session in self.sessions.items()],
+                "threads per solve":self.threads}
+
+    async def load(self,request,send):
+        async def work(session):
+            mod = session["model"]["mod"]
+            return {"event":"result","inputFile":session["inputFile"],"build":session["build"],
+                    "variables":mod.NumVars,"constraints":mod.NumConstrs}
+        return await self.run(request["inputFile"],send,work)
+
+    async def solve(self,request,send):
+        loop = asyncio.get_running_loop()
+        sending = {}
+        def progress(event):
+            # Called on the solver thread; at most one progress event is in flight, later ones are
+            # dropped while a slow client is still reading it (the result has the final values)
+            if sending.get("future") is None or sending["future"].done():
+                sending["future"] = asyncio.run_coroutine_threadsafe(send(event),loop)
+        async def work(session):
+            apply_changes(session,request)
+            result = await loop.run_in_executor(self.pool,solve,session,request.get("timelimit"),progress)
+            if "outputFile" in request and "schedule" in result:
+                values = {key:result[key] for key in ["Objective","U","R","Q"]}
+                chosen = {level:[(i,j,t) for i, (j,t) in session["schedule"][level].items()] for level in ["ug","g"]}
+                await loop.run_in_executor(self.pool,opt.write_schedule,session["instance"],chosen,values,
+                                           session["model"]["weights"],request["outputFile"])
+                result["outputFile"] = request["outputFile"]
+            return result
+        return await self.run(request["inputFile"],send,work)
+
+
+class HTTPError(Exception):
+    pass
+
+
+class InfeasibleInput(Exception):
+    def __init__(self,violations):
+        super().__init__('{} violated groups'.format(len(violations)))
+        self.violations = violations
+
+
+async def read_request(reader):
+    '''Method, path and JSON body of an HTTP/1.1 request'''
+    line = (await reader.readline()).decode('latin-1').split()
+    if len(line) < 2:
+        raise ValueError('malformed request line')
+    headers = {}
+    while True:
+        header = (await reader.readline()).decode('latin-1').strip()
+        if not header:
+            break
+        name, _, value = header.partition(':')
+        headers[name.strip().lower()] = value.strip()
+    length = int(headers.get("content-length",0))
+    body = json.loads(await reader.readexactly(length)) if length else {}
+    return line[0], line[1], body
+
+
+async def handle(service,reader,writer):
+    '''Serve one request: plain JSON for /status, newline-delimited JSON chunks for /load and /solve'''
+    def head(code,content_type,extra=''):
+        writer.write('HTTP/1.1 {} {}\r\nContent-Type: {}\r\nConnection: close\r\n{}\r\n'.format(
+            code,STATUS[code],content_type,extra).encode())
+    async def send(event):
+        # Wait for the client to take the chunk, so nothing piles up for slow clients
+        data = (json.dumps(event,default=profiling.plain)+'\n').encode()
+        writer.write(b'%x\r\n%s\r\n' % (len(data),data))
+        await writer.drain()
+    try:
+        method, path, request = await read_request(reader)
+        if path == '/status' and method == 'GET':
+            data = json.dumps(service.status(),default=profiling.plain).encode()
+            head(200,'application/json','Content-Length: {}\r\n'.format(len(data)))
+            writer.write(data)
+        elif path in ('/load','/solve'):
+            if method != 'POST':
+                raise HTTPError(405)
+            if "inputFile" not in request:
+                raise ValueError('inputFile missing')
+            head(200,'application/x-ndjson','Transfer-Encoding: chunked\r\n')
+            try:
+                await send(await (service.load if path == '/load' else service.solve)(request,send))
+            except InfeasibleInput as error:
+                await send({"event":"error","error":str(error),"violations":error.violations})
+            except ConnectionError:
+                raise
+            except Exception as error:
+                # Bad labels, missing workbooks and solver errors end the stream with an error event
+                await send({"event":"error","error":str(error)})
+            writer.write(b'0\r\n\r\n')
+        else:
+            raise HTTPError(404)
+    except HTTPError as error:
+        head(error.args[0],'application/json','Content-Length: 0\r\n')
+    except (ValueError, asyncio.IncompleteReadError) as error:
+        data = json.dumps({"error":str(error)}).encode()
+        head(400,'application/json','Content-Length: {}\r\n'.format(len(data)))
+        writer.write(data)
+    except ConnectionError:
+        # The client went away; a solve it started still updates the session
+        pass
+    try:
+        await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(port=8765,workers=2,threads=4):
+    service = Service(workers,threads)
+    server = await asyncio.start_server(lambda reader, writer: handle(service,reader,writer),'127.0.0.1',port)
+    print(f'Scheduling service on http://127.0.0.1:{port}, {workers} workers, {service.threads} solver threads each')
+    async with server:
+        await server.serve_forever()
+
+
+if __name__=='__main__':
+    import sys
+    if len(sys.argv) > 4:
+        print('Correct syntax: python service.py port(optional) workers(optional) threads(optional)')
+    else:
+        arguments = [int(argument) for argument in sys.argv[1:]]
+        asyncio.run(serve(*arguments))
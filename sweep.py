@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+'''Weight sweep over the three evaluation metrics of optimize().
+
+The input workbook is preprocessed (or loaded from the instance cache) and the
+model is built once; every weighting (weight1, weight2, weight3) then only
+changes the objective coefficients of U, Q and R and re-solves, starting from
+the previous weighting's schedule. With
+processes > 1 the weightings are split into contiguous chunks that are solved
+concurrently, each worker building the model once for its chunk and splitting
+the machine's cores between the Gurobi solves.
+
+The output is a Pareto table with one row per weighting: the weights, the
+objective, U (average utilization), R (# of professors with a back-to-back
+class), Q (# of professors teaching more than two days), the solve runtime and
+whether the point is Pareto-optimal (no other weighting has U and R at least as
+high and Q at least as low, with one of them strictly better).
+
+    python sweep.py inputFile outputFile weight1s weight2s weight3s processes(optional)
+with comma-separated values for each weight, e.g. 1 0,0.5,1 0,0.2,1'''
+
+import os
+import time
+import itertools as it
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+import optimize as opt
+
+
+def solve_weights(instance,weights,threads=0,cliques=True):
+    '''Build the model once and solve it for each weighting in turn, warm-starting
+    each solve from the previous one. Returns one result row per weighting.'''
+    model = opt.assembly.build_model(instance,*weights[0],cliques=cliques)
+    mod = model["mod"]
+    mod.setParam('OutputFlag',False)
+    mod.setParam('Threads',threads)
+    allvars = mod.getVars()
+    rows = []
+    for weight1, weight2, weight3 in weights:
+        opt.set_weights(model,weight1,weight2,weight3)
+        start_time = time.time()
+        mod.optimize()
+        row = {"weight1":weight1,"weight2":weight2,"weight3":weight3,"Objective":np.nan,
+               "U":np.nan,"R":np.nan,"Q":np.nan,"Runtime":time.time()-start_time,"Status":mod.Status}
+        if mod.SolCount > 0:
+            row.update({"Objective":mod.ObjVal,"U":model["U"].X,"R":round(model["R"].X),"Q":round(model["Q"].X)})
+            mod.setAttr('Start',allvars,mod.getAttr('X',allvars))
+        rows.append(row)
+        print('Weights ({}, {}, {}) --> U {:.2f}, R {}, Q {} in {:.1f} seconds'.format(weight1,weight2,weight3,row["U"],row["R"],row["Q"],row["Runtime"]))
+    return rows
+
+
+def _solve_chunk(args):
+    return solve_weights(*args)
+
+
+def pareto(table):
+    '''Flag the rows not dominated by any other row (maximize U and R, minimize Q)'''
+    points = table[["U","R","Q"]].values*np.array([1,1,-1])
+    solved = ~np.isnan(points).any(axis=1)
+    atleast = (points[None,:,:] >= points[:,None,:]).all(axis=2)
+    better = (points[None,:,:] > points[:,None,:]).any(axis=2)
+    dominated = (atleast & better & solved[None,:]).any(axis=1)
+    return solved & ~dominated
+
+
+def sweep(inputFile,outputFile,weights,processes=1,cliques=True):
+    '''Solve every weighting in weights and write the Pareto table to outputFile (.xlsx or .csv)'''
+    start_time = time.time()
+    instance = opt.load_instance(inputFile)
+    weights = [tuple(float(w) for w in weight) for weight in weights]
+    if processes > 1 and len(weights) > 1:
+        chunks = [list(chunk) for chunk in np.array_split(np.array(weights),min(processes,len(weights)))]
+        threads = max(1,(os.cpu_count() or 1)//len(chunks))
+        with ProcessPoolExecutor(len(chunks)) as pool:
+            results = pool.map(_solve_chunk,[(instance,chunk,threads,cliques) for chunk in chunks])
+            rows = [row for chunk in results for row in chunk]
+    else:
+        rows = solve_weights(instance,weights,cliques=cliques)
+    table = pd.DataFrame(rows)
+    table["Pareto"] = pareto(table)
+    if outputFile.endswith('.csv'):
+        table.to_csv(outputFile,index=False)
+    else:
+        with pd.ExcelWriter(outputFile) as writer:
+            table.to_excel(writer,sheet_name='Pareto',index=False)
+    print('Weight sweep of {} weightings finished in {:.1f} minutes'.format(len(weights),(time.time()-start_time)/60))
+    return table
+
+
+if __name__=='__main__':
+    import sys
+    if len(sys.argv)!=6 and len(sys.argv)!=7:
+        print('Correct syntax: python sweep.py inputFile outputFile weight1s weight2s weight3s processes(optional)')
+    elif not os.path.exists(sys.argv[1]):
+        print(f'File "{sys.argv[1]}" not found!')
+    else:
+        grid = [[float(w) for w in arg.split(',')] for arg in sys.argv[3:6]]
+        processes = int(sys.argv[6]) if len(sys.argv)==7 else 1
+        sweep(sys.argv[1],sys.argv[2],list(it.product(*grid)),processes)
+        print(f'Results in "{sys.argv[2]}"')